@@ -3,7 +3,7 @@ from django.contrib import admin, messages
 from django.core.mail import send_mail
 from django.conf import settings
 from django.http import HttpResponse
-from .models import Message, Conversation
+from .models import Job, Message, Conversation
 import csv
 import io
 
@@ -59,3 +59,10 @@ class ConversationAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "started_at")
     search_fields = ("user__username",)
     readonly_fields = ("started_at",)
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "lane", "status", "attempts", "max_attempts", "run_after", "locked_by", "finished_at")
+    list_filter = ("status", "lane", "name")
+    search_fields = ("name", "last_error")
+    readonly_fields = ("created_at", "finished_at", "locked_until", "locked_by", "attempts")
@@ -1,15 +1,21 @@
 import logging
 import asyncio
 from collections import defaultdict
+from functools import partial
 from datetime import datetime
 from threading import Lock
 
-from .tasks import handle_user_message
+from .conversation_executor import get_conversation_executor
+from .jobs import LANE_CRISIS, arun_on_lane, durable, enqueue
+from .tasks import (
+    handle_user_message, handle_user_message_async, reply_lane, reply_to_messages_async, screen_user_message_async,
+)
 
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.core.exceptions import PermissionDenied
 
+from .ml_http import ml_setting
 from .models import Conversation, Message
 from .serializers import MessageSerializer
 
@@ -28,7 +34,9 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
     - On connect: validates user + conversation access, sends recent messages
     - receive_json: supports "send_message" and "ping"
     - chat_message: handler for group sends (type="chat_message")
+    - ai_delta: streamed pieces of the bot reply (MHCHAT_ML_STREAM)
     - Per-user rate limiting: 6 messages per 10 seconds (persists across reconnections via _global_user_rate_limits)
+    - Replies are generated in order per conversation (conversation_executor)
     """
 
     # per-user rate-limit settings
@@ -126,6 +134,11 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
                     # Record this message timestamp
                     _global_user_rate_limits[self.user_id].append(now)
 
+                # too many replies already pending here: refuse before saving the message
+                if get_conversation_executor().full(self.conv_id):
+                    await self.send_json({"type": "error", "error": "conversation_busy"})
+                    return
+
                 # create message in DB (sync -> async)
                 user = self.scope.get("user")
                 created = await self._create_message(self.conv_id, user.id, text)
@@ -147,9 +160,33 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
                     {"type": "ai_typing_indicator", "conversation_id": self.conv_id}
                 )
 
-                # spawn background task to generate AI reply off the event loop
-                # do not await here to keep consumer responsive
-                asyncio.create_task(self._generate_and_send_ai(created.id, text))
+                # safety screen first (lexicon scan, off the loop): flagged messages take the crisis lane
+                lane = await self._reply_lane(created)
+
+                if durable():
+                    # a run_workers process replies and broadcasts via the (shared) channel layer
+                    await database_sync_to_async(enqueue)(handle_user_message, created.id, lane=lane)
+                    return
+
+                if lane == LANE_CRISIS:
+                    # reserved threads, not queued behind ordinary replies for the shared DB thread
+                    asyncio.create_task(self._handle_crisis(created.id))
+                    return
+
+                coalesce_ms = float(ml_setting("MHCHAT_CONVERSATION_COALESCE_MS", 0))
+                if coalesce_ms > 0:
+                    # safety runs now; the reply waits for the burst to end
+                    if await screen_user_message_async(created.id) is None:
+                        max_ms = float(ml_setting("MHCHAT_CONVERSATION_COALESCE_MAX_MS", 2000))
+                        get_conversation_executor().debounce(
+                            self.conv_id, created.id, self._reply_to_burst, coalesce_ms / 1000.0, max_ms / 1000.0,
+                        )
+                    return
+
+                # generate the AI reply in the background, after this conversation's
+                # earlier replies (other conversations run concurrently)
+                if not get_conversation_executor().submit(self.conv_id, partial(self._generate_and_send_ai, created.id, text)):
+                    await self.send_json({"type": "error", "error": "conversation_busy"})
 
                 return
 
@@ -191,8 +228,10 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
     async def _generate_and_send_ai(self, user_message_id, user_text):
         """Background task to generate a bot reply via mhchat-ml (no OpenAI/Celery)."""
         try:
-            # Run synchronous pipeline in a thread. It will create/broadcast system+bot messages.
-            await asyncio.to_thread(handle_user_message, int(user_message_id))
+            # DB steps run via sync_to_async; the mhchat-ml call is awaited on the
+            # event loop, so waiting replies do not hold threads.
+            on_delta = self._delta_sender(user_message_id) if ml_setting("MHCHAT_ML_STREAM", False) else None
+            await handle_user_message_async(int(user_message_id), on_delta=on_delta)
         except Exception:
             logger.exception("_generate_and_send_ai: error generating AI reply")
             err_payload = {"system": "ai_error", "error": "server_error"}
@@ -201,6 +240,52 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             except Exception:
                 logger.exception("_generate_and_send_ai: failed to send ai_error payload")
 
+    async def _reply_to_burst(self, user_message_ids):
+        """One AI reply for coalesced messages (MHCHAT_CONVERSATION_COALESCE_MS)."""
+        try:
+            on_delta = self._delta_sender(user_message_ids[-1]) if ml_setting("MHCHAT_ML_STREAM", False) else None
+            await reply_to_messages_async([int(i) for i in user_message_ids], on_delta=on_delta)
+        except Exception:
+            logger.exception("_reply_to_burst: error generating AI reply")
+            err_payload = {"system": "ai_error", "error": "server_error"}
+            try:
+                await self.channel_layer.group_send(self.group_name, {"type": "chat_message", "message": err_payload})
+            except Exception:
+                logger.exception("_reply_to_burst: failed to send ai_error payload")
+
+    async def _handle_crisis(self, user_message_id):
+        """Crisis-lane pipeline run: the system message is broadcast from inside handle_user_message."""
+        try:
+            await arun_on_lane(handle_user_message, int(user_message_id), lane=LANE_CRISIS)
+        except Exception:
+            logger.exception("_handle_crisis: error handling flagged message %s", user_message_id)
+
+    def _delta_sender(self, user_message_id):
+        """on_delta callback: forward reply pieces to the group as ai_delta events."""
+        seq = 0
+
+        async def send(delta):
+            nonlocal seq
+            seq += 1
+            await self.channel_layer.group_send(
+                self.group_name,
+                {"type": "ai_delta", "reply_to": user_message_id, "seq": seq, "delta": delta},
+            )
+
+        return send
+
+    async def ai_delta(self, event):
+        """
+        Streamed piece of the bot reply to message ``reply_to``. The complete
+        reply still arrives as a normal "message" once it is saved.
+        """
+        await self.send_json({
+            "type": "ai_delta",
+            "reply_to": event.get("reply_to"),
+            "seq": event.get("seq"),
+            "delta": event.get("delta", ""),
+        })
+
     # -------------------------
     # Database helper methods
     # -------------------------
@@ -226,6 +311,10 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         msg = Message.objects.create(conversation=conv, sender="user", text=text)
         return msg
 
+    @database_sync_to_async
+    def _reply_lane(self, msg):
+        return reply_lane(msg)
+
     @database_sync_to_async
     def _serialize_message(self, message_id: int):
         msg = (
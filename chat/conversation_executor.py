@@ -0,0 +1,168 @@
+# chat/conversation_executor.py
+"""
+Ordered reply scheduling for the WebSocket consumer: serial within a
+conversation, concurrent across conversations.
+
+Each conversation with pending work gets an actor, a task on the event loop
+that runs the conversation's queued coroutines one at a time, in submission
+order. Three quick messages in one chat are therefore answered in order and
+each reply sees the previous one in its context window, while other
+conversations are not held up.
+
+Queues are bounded (MHCHAT_CONVERSATION_QUEUE_SIZE, default 8 pending replies
+per conversation); submit() returns False when the conversation's queue is
+full. An actor exits as soon as its queue is empty, so idle conversations hold
+nothing.
+
+debounce() coalesces bursts ("hey", "so", "i feel awful today"): items for
+a conversation are collected until none has arrived for the window
+(MHCHAT_CONVERSATION_COALESCE_MS, 0 = off) or MHCHAT_CONVERSATION_COALESCE_MAX_MS
+has passed since the first, then handed to one queued call.
+
+Crisis-lane replies (chat.jobs) deliberately bypass this: a flagged message
+is answered before earlier, ordinary replies in the same conversation.
+"""
+import asyncio
+import logging
+import weakref
+from collections import deque
+from functools import partial
+
+from .ml_http import ml_setting
+
+logger = logging.getLogger(__name__)
+
+
+class _Burst:
+    __slots__ = ("items", "flush", "started", "timer")
+
+    def __init__(self, flush, started):
+        self.items = []
+        self.flush = flush
+        self.started = started
+        self.timer = None
+
+
+class ConversationExecutor:
+    """Per-conversation FIFO actors on one event loop. Not thread-safe: use from the loop."""
+
+    def __init__(self, queue_size=8):
+        self.queue_size = max(1, int(queue_size))
+        self._actors = {}  # conversation id -> (deque of coroutine factories, task)
+        self._bursts = {}  # conversation id -> open _Burst
+        self._stats = {
+            "submitted": 0, "rejected": 0, "processed": 0, "errors": 0, "actors_started": 0, "actors_reaped": 0,
+            "coalesced": 0, "bursts": 0,
+        }
+
+    def full(self, conversation_id):
+        actor = self._actors.get(conversation_id)
+        return actor is not None and len(actor[0]) >= self.queue_size
+
+    def submit(self, conversation_id, make_coro):
+        """
+        Run ``make_coro()`` after the conversation's earlier submissions have
+        finished. Returns False (and runs nothing) when its queue is full.
+        """
+        actor = self._actors.get(conversation_id)
+        if actor is None:
+            queue = deque()
+            queue.append(make_coro)
+            task = asyncio.get_running_loop().create_task(self._run(conversation_id, queue))
+            self._actors[conversation_id] = (queue, task)
+            self._stats["actors_started"] += 1
+        elif len(actor[0]) >= self.queue_size:
+            self._stats["rejected"] += 1
+            logger.warning("Conversation %s has %d replies queued; rejecting another", conversation_id, len(actor[0]))
+            return False
+        else:
+            actor[0].append(make_coro)
+        self._stats["submitted"] += 1
+        return True
+
+    def debounce(self, conversation_id, item, flush, window_s, max_wait_s=None):
+        """
+        Add ``item`` to the conversation's open burst. ``flush(items)`` is
+        submitted once no item has arrived for ``window_s``, or ``max_wait_s``
+        after the burst's first item.
+        """
+        loop = asyncio.get_running_loop()
+        burst = self._bursts.get(conversation_id)
+        if burst is None:
+            burst = self._bursts[conversation_id] = _Burst(flush, loop.time())
+        else:
+            burst.timer.cancel()
+            self._stats["coalesced"] += 1
+        burst.items.append(item)
+        close_at = loop.time() + max(0.0, window_s)
+        if max_wait_s is not None:
+            close_at = min(close_at, burst.started + max(0.0, max_wait_s))
+        burst.timer = loop.call_at(close_at, self._close_burst, conversation_id)
+
+    def _close_burst(self, conversation_id):
+        burst = self._bursts.pop(conversation_id, None)
+        if burst is None:
+            return
+        self._stats["bursts"] += 1
+        if not self.submit(conversation_id, partial(burst.flush, burst.items)):
+            logger.error("Conversation %s: dropped a burst of %d message(s), queue full", conversation_id, len(burst.items))
+
+    async def _run(self, conversation_id, queue):
+        try:
+            # no await between the empty check and the removal below, so a
+            # submit() either lands in this queue or starts a new actor
+            while queue:
+                make_coro = queue[0]
+                try:
+                    await make_coro()
+                except Exception:
+                    self._stats["errors"] += 1
+                    logger.exception("Conversation %s: queued reply failed", conversation_id)
+                finally:
+                    queue.popleft()
+                self._stats["processed"] += 1
+        finally:
+            if self._actors.get(conversation_id, (None,))[0] is queue:
+                del self._actors[conversation_id]
+            self._stats["actors_reaped"] += 1
+
+    async def drain(self):
+        """Wait until every burst has closed and every actor has finished (tests, shutdown)."""
+        while self._actors or self._bursts:
+            if self._bursts:
+                await asyncio.sleep(0.01)
+                continue
+            await asyncio.gather(*(task for _, task in list(self._actors.values())), return_exceptions=True)
+
+    def stats(self):
+        out = dict(self._stats)
+        out.update(
+            actors=len(self._actors),
+            queued=sum(len(queue) for queue, _ in self._actors.values()),
+            open_bursts=len(self._bursts),
+            queue_size=self.queue_size,
+        )
+        return out
+
+
+# one executor per event loop (channels runs one per process; tests make more)
+_executors = weakref.WeakKeyDictionary()
+
+
+def get_conversation_executor():
+    """The running loop's executor; call from a coroutine."""
+    loop = asyncio.get_running_loop()
+    executor = _executors.get(loop)
+    queue_size = int(ml_setting("MHCHAT_CONVERSATION_QUEUE_SIZE", 8))
+    if executor is None or (executor.queue_size != max(1, queue_size) and not executor._actors and not executor._bursts):
+        executor = _executors[loop] = ConversationExecutor(queue_size=queue_size)
+    return executor
+
+
+def conversation_executor_stats():
+    """Stats summed over the executors of live event loops."""
+    total = {}
+    for executor in list(_executors.values()):
+        for key, value in executor.stats().items():
+            total[key] = total.get(key, 0) + value if key != "queue_size" else value
+    return total
@@ -0,0 +1,205 @@
+# chat/dedup.py
+"""
+Duplicate-message guard for the reply pipeline.
+
+A user message is a duplicate when the same user sent the same text within
+MHCHAT_DEDUP_WINDOW_S (default 5s); the pipeline then skips it. Entries are
+keyed by a digest of (user id, text) and expire with the window whether or
+not the user writes again.
+
+Backends (MHCHAT_DEDUP_BACKEND):
+    local   per-process store with bucketed expiry and a global entry cap
+            (MHCHAT_DEDUP_MAX_ENTRIES, default 100000; oldest evicted first)
+    django  Django's cache framework (MHCHAT_DEDUP_ALIAS, default "default"):
+            an atomic cache.add(), so duplicates are caught across daphne
+            workers when that cache is Redis/Memcached
+    off     no deduplication
+
+dedup_stats() reports checks, duplicates caught, entries and evictions.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from .ml_http import ml_setting
+
+logger = logging.getLogger(__name__)
+
+
+def dedup_key(user_id, text):
+    """Digest of the sender and the exact message text."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(user_id).encode("utf-8"))
+    h.update(b"\x00")
+    h.update((text or "").encode("utf-8"))
+    return h.hexdigest()
+
+
+class _StatsMixin:
+    def _init_stats(self):
+        self._stats = {"checks": 0, "duplicates": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        out["backend"] = self.backend
+        out["window_s"] = self.window_s
+        return out
+
+
+class LocalDedupStore(_StatsMixin):
+    """
+    Thread-safe set of recent keys. Keys are filed in time buckets of
+    ``bucket_s`` by expiry; each check drops whole expired buckets from the
+    front, so lookups and expiry are O(1) amortized.
+    """
+
+    backend = "local"
+
+    def __init__(self, window_s=5.0, max_entries=100000, bucket_s=1.0, clock=time.monotonic):
+        self.window_s = float(window_s)
+        self.max_entries = max(1, int(max_entries))
+        self.bucket_s = max(0.001, float(bucket_s))
+        self._clock = clock
+        self._expires = {}  # key -> expires_at
+        self._buckets = OrderedDict()  # bucket number -> keys expiring in it, oldest first
+        self._lock = threading.Lock()
+        self._init_stats()
+        self._stats.update(evictions=0, expired=0)
+
+    def _drop(self, key, bucket_keys):
+        bucket_keys.discard(key)
+        del self._expires[key]
+
+    def _expire(self, now):
+        while self._buckets:
+            bucket, keys = next(iter(self._buckets.items()))
+            if (bucket + 1) * self.bucket_s > now:
+                break
+            del self._buckets[bucket]
+            for key in keys:
+                del self._expires[key]
+            self._stats["expired"] += len(keys)
+
+    def check_and_add(self, key):
+        """True if ``key`` is new (process the message), False if seen within the window."""
+        now = self._clock()
+        with self._lock:
+            self._stats["checks"] += 1
+            self._expire(now)
+            expires_at = self._expires.get(key)
+            if expires_at is not None:
+                if expires_at > now:
+                    self._stats["duplicates"] += 1
+                    return False
+                # expired inside a bucket that is not over yet
+                self._drop(key, self._buckets[math.floor(expires_at / self.bucket_s)])
+            expires_at = now + self.window_s
+            self._expires[key] = expires_at
+            bucket = math.floor(expires_at / self.bucket_s)
+            keys = self._buckets.get(bucket)
+            if keys is None:
+                keys = self._buckets[bucket] = set()
+            keys.add(key)
+            while len(self._expires) > self.max_entries:
+                oldest, oldest_keys = next(iter(self._buckets.items()))
+                if oldest_keys:
+                    del self._expires[oldest_keys.pop()]
+                    self._stats["evictions"] += 1
+                if not oldest_keys:
+                    del self._buckets[oldest]
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._expires.clear()
+            self._buckets.clear()
+
+    def stats(self):
+        out = super().stats()
+        with self._lock:
+            out.update(entries=len(self._expires), buckets=len(self._buckets), max_entries=self.max_entries)
+        return out
+
+
+class DjangoDedupStore(_StatsMixin):
+    """Django cache framework backend: cache.add() is atomic, so workers agree on the first sender."""
+
+    backend = "django"
+    key_prefix = "mhchat-dedup:"
+
+    def __init__(self, alias="default", window_s=5.0):
+        from django.core.cache import caches
+
+        self._cache = caches[alias]
+        self.window_s = float(window_s)
+        self._lock = threading.Lock()
+        self._init_stats()
+
+    def check_and_add(self, key):
+        self._count("checks")
+        try:
+            added = self._cache.add(self.key_prefix + key, 1, timeout=self.window_s)
+        except Exception:
+            logger.exception("Dedup cache add failed; processing the message")
+            self._count("errors")
+            return True
+        if not added:
+            self._count("duplicates")
+        return bool(added)
+
+    def clear(self):
+        pass  # shared cache: entries expire with the window
+
+
+_store = None
+_store_key = None
+_store_lock = threading.Lock()
+
+
+def get_dedup_store():
+    """The configured store, or None when MHCHAT_DEDUP_BACKEND is "off"."""
+    global _store, _store_key
+    backend = str(ml_setting("MHCHAT_DEDUP_BACKEND", "local")).lower()
+    if backend in ("off", "none", ""):
+        return None
+    key = (
+        backend,
+        float(ml_setting("MHCHAT_DEDUP_WINDOW_S", 5.0)),
+        int(ml_setting("MHCHAT_DEDUP_MAX_ENTRIES", 100000)),
+        str(ml_setting("MHCHAT_DEDUP_ALIAS", "default")),
+    )
+    if _store is not None and _store_key == key:
+        return _store
+    with _store_lock:
+        if _store is None or _store_key != key:
+            if backend == "django":
+                _store = DjangoDedupStore(alias=key[3], window_s=key[1])
+            else:
+                _store = LocalDedupStore(window_s=key[1], max_entries=key[2])
+            _store_key = key
+        return _store
+
+
+def is_new_message(user_id, text):
+    """False when ``user_id`` sent ``text`` within the dedup window."""
+    store = get_dedup_store()
+    return store is None or store.check_and_add(dedup_key(user_id, text))
+
+
+def dedup_stats():
+    store = _store
+    return store.stats() if store is not None else {}
+
+
+def reset_dedup_store():
+    global _store, _store_key
+    with _store_lock:
+        _store, _store_key = None, None
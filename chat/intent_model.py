@@ -0,0 +1,360 @@
+# chat/intent_model.py
+"""
+Model-backed intent classification for chat/nlp.py.
+
+Artifacts are written by scripts/train_intent.py into a versioned directory:
+
+    <MHCHAT_INTENT_MODEL_DIR>/
+        LATEST                  # name of the active version directory
+        <version>/
+            manifest.json       # format, classes, analyzer settings
+            vocabulary.json     # term -> feature index
+            idf.npy             # (n_features,) float32
+            coef.npy            # (n_features, n_classes) float32, row per feature
+            intercept.npy       # (n_classes,) float32
+
+scripts/export_intent_model.py compiles such a version into a single
+dependency-free file (format "hashed-linear", see write_hashed_linear()):
+a hashed term table plus the float32 weights, loadable without scikit-learn,
+SciPy or pandas and without parsing a vocabulary dict.
+
+Nothing is read until the first prediction. Weight arrays are memory-mapped
+(np.load(mmap_mode="r") / mmap.mmap), so every worker process maps the same
+page-cache pages instead of holding a private copy.
+
+Engines are pluggable: any object with ``version``, ``classes`` and
+``predict_proba(texts)`` can be installed with set_intent_classifier().
+When no artifact (or NumPy) is available, get_intent_classifier() returns
+None and nlp.analyze_message keeps using its keyword rules.
+"""
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_DIR = Path(__file__).resolve().parent.parent / "artifacts" / "intent"
+
+
+class IntentClassifier:
+    """Interface for intent engines used by chat.nlp."""
+
+    version: str = ""
+    classes: Tuple[str, ...] = ()
+
+    def predict_proba(self, texts: Sequence[str]):
+        """Return an (len(texts), len(classes)) array of class probabilities."""
+        raise NotImplementedError
+
+    def predict(self, texts: Sequence[str]) -> List[Tuple[str, float]]:
+        """Return the top (label, probability) for each text."""
+        if not texts:
+            return []
+        proba = self.predict_proba(texts)
+        best = proba.argmax(axis=1)
+        return [(self.classes[i], float(proba[row, i])) for row, i in enumerate(best)]
+
+
+class _LinearTfidfClassifier(IntentClassifier):
+    """
+    NumPy re-implementation of scikit-learn's TfidfVectorizer + LogisticRegression
+    scoring path. Subclasses provide the storage: _load() must set _idf, _coef
+    (n_features, n_classes) and _intercept, and _feature_index() maps a term to
+    its feature row (or None).
+    """
+
+    def __init__(self, path: Path, manifest: Dict):
+        self.path = Path(path)
+        self.version = str(manifest.get("version") or self.path.name)
+        self.classes = tuple(manifest["classes"])
+        self._manifest = manifest
+        self._ngram_range = tuple(manifest.get("ngram_range", (1, 1)))
+        self._lowercase = bool(manifest.get("lowercase", True))
+        self._token_re = re.compile(manifest.get("token_pattern", r"(?u)\b\w\w+\b"))
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _feature_index(self, term: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def _ensure_loaded(self):
+        with self._load_lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+                logger.info("Loaded intent model %s (%d features, %d classes)",
+                            self.version, self._idf.shape[0], len(self.classes))
+
+    def _terms(self, text: str) -> List[str]:
+        if self._lowercase:
+            text = text.lower()
+        tokens = self._token_re.findall(text)
+        min_n, max_n = self._ngram_range
+        terms = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), max_n + 1):
+            terms.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return terms
+
+    def predict_proba(self, texts: Sequence[str]):
+        if not self._loaded:
+            self._ensure_loaded()
+
+        n_classes = len(self.classes)
+        # Sparse TF-IDF rows flattened into (doc, feature, weight) triplets for the whole batch.
+        docs, feats, weights = [], [], []
+        feature_index = self._feature_index
+        for row, text in enumerate(texts):
+            counts: Dict[int, int] = {}
+            for term in self._terms(text or ""):
+                idx = feature_index(term)
+                if idx is not None:
+                    counts[idx] = counts.get(idx, 0) + 1
+            if not counts:
+                continue
+            idxs = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            w = np.fromiter(counts.values(), dtype=np.float32, count=len(counts)) * self._idf[idxs]
+            norm = float(np.sqrt(np.dot(w, w)))
+            if norm > 0:
+                w /= norm
+            docs.append(np.full(len(idxs), row, dtype=np.int64))
+            feats.append(idxs)
+            weights.append(w)
+
+        scores = np.zeros((len(texts), self._coef.shape[1]), dtype=np.float32)
+        if feats:
+            feats_a = np.concatenate(feats)
+            contrib = self._coef[feats_a] * np.concatenate(weights)[:, None]
+            np.add.at(scores, np.concatenate(docs), contrib)
+        scores += self._intercept
+
+        if scores.shape[1] == 1 and n_classes == 2:
+            # Binary LogisticRegression keeps a single decision column.
+            p = 1.0 / (1.0 + np.exp(-scores[:, 0]))
+            return np.stack([1.0 - p, p], axis=1)
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+
+
+class TfidfLogRegClassifier(_LinearTfidfClassifier):
+    """Artifact as written by scripts/train_intent.py: JSON vocabulary + .npy arrays."""
+
+    FORMAT = "tfidf-logreg"
+
+    def _load(self):
+        with open(self.path / "vocabulary.json", encoding="utf-8") as fh:
+            self._vocab = json.load(fh)
+        self._idf = np.load(self.path / "idf.npy", mmap_mode="r")
+        self._coef = np.load(self.path / "coef.npy", mmap_mode="r")
+        self._intercept = np.load(self.path / "intercept.npy", mmap_mode="r")
+
+    def _feature_index(self, term):
+        return self._vocab.get(term)
+
+
+# --- compiled hashed-linear format ---------------------------------------------
+#
+# One little-endian file, every section 64-byte aligned so it can be mapped
+# straight into NumPy views:
+#
+#   b"MHLM" | u32 format version | u32 header length | JSON header
+#   keys      uint64[table_size]   64-bit term hash, 0 = empty slot
+#   rows      int32[table_size]    feature row for the slot
+#   idf       float32[n_features]
+#   coef      float32[n_features * n_classes]
+#   intercept float32[n_classes]
+#
+# The vocabulary is an open-addressing (linear probing) table of term hashes,
+# so loading it costs one mmap instead of parsing a JSON dict per process.
+
+_HLM_MAGIC = b"MHLM"
+_HLM_VERSION = 1
+_HLM_ALIGN = 64
+
+
+def term_hash(term: str) -> int:
+    """Stable non-zero 64-bit term hash (crc32 and adler32 halves; Python's hash() is salted)."""
+    data = term.encode("utf-8")
+    return ((zlib.crc32(data) << 32) | zlib.adler32(data)) or 1
+
+
+def _aligned(n: int) -> int:
+    return (n + _HLM_ALIGN - 1) // _HLM_ALIGN * _HLM_ALIGN
+
+
+def write_hashed_linear(path: Path, header: Dict, vocabulary: Dict[str, int], idf, coef, intercept) -> None:
+    """Write a hashed-linear model file; ``coef`` is (n_features, n_classes)."""
+    n_features = len(idf)
+    table_size = 1
+    while table_size < 2 * max(1, len(vocabulary)):
+        table_size <<= 1
+    mask = table_size - 1
+    keys = np.zeros(table_size, dtype="<u8")
+    rows = np.full(table_size, -1, dtype="<i4")
+    for term, row in vocabulary.items():
+        h = term_hash(term)
+        slot = h & mask
+        while keys[slot]:
+            if int(keys[slot]) == h:
+                raise ValueError(f"Term hash collision for {term!r}; cannot compile vocabulary")
+            slot = (slot + 1) & mask
+        keys[slot] = h
+        rows[slot] = row
+
+    header = {**header, "table_size": table_size, "n_features": n_features, "n_classes": int(coef.shape[1])}
+    header_bytes = json.dumps(header).encode("utf-8")
+    sections = [
+        keys,
+        rows,
+        np.asarray(idf, dtype="<f4"),
+        np.ascontiguousarray(coef, dtype="<f4").reshape(-1),
+        np.asarray(intercept, dtype="<f4"),
+    ]
+    with open(path, "wb") as fh:
+        fh.write(_HLM_MAGIC + struct.pack("<II", _HLM_VERSION, len(header_bytes)) + header_bytes)
+        for arr in sections:
+            fh.write(b"\0" * (_aligned(fh.tell()) - fh.tell()))
+            fh.write(arr.tobytes())
+
+
+class HashedLinearClassifier(_LinearTfidfClassifier):
+    """Compiled single-file format produced by scripts/export_intent_model.py."""
+
+    FORMAT = "hashed-linear"
+
+    def _load(self):
+        with open(self.path / self._manifest.get("file", "model.hlm"), "rb") as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        if mm[:4] != _HLM_MAGIC:
+            raise ValueError(f"{self.path}: not a hashed-linear intent model")
+        fmt_version, header_len = struct.unpack_from("<II", mm, 4)
+        if fmt_version != _HLM_VERSION:
+            raise ValueError(f"{self.path}: unsupported model file version {fmt_version}")
+        header = json.loads(mm[12:12 + header_len])
+        table_size = header["table_size"]
+        n_features, n_classes = header["n_features"], header["n_classes"]
+
+        offset = 12 + header_len
+        views = []
+        for dtype, count in (("<u8", table_size), ("<i4", table_size), ("<f4", n_features),
+                             ("<f4", n_features * n_classes), ("<f4", n_classes)):
+            offset = _aligned(offset)
+            views.append(np.frombuffer(mm, dtype=dtype, count=count, offset=offset))
+            offset += views[-1].nbytes
+        self._keys, self._rows, self._idf, coef, self._intercept = views
+        self._coef = coef.reshape(n_features, n_classes)
+        self._mask = table_size - 1
+
+    def _feature_index(self, term):
+        h = term_hash(term)
+        keys = self._keys
+        slot = h & self._mask
+        while True:
+            key = int(keys[slot])
+            if key == h:
+                return int(self._rows[slot])
+            if key == 0:
+                return None
+            slot = (slot + 1) & self._mask
+
+
+# manifest "format" -> engine class
+ENGINES = {
+    TfidfLogRegClassifier.FORMAT: TfidfLogRegClassifier,
+    HashedLinearClassifier.FORMAT: HashedLinearClassifier,
+}
+
+
+def resolve_artifact(root: Path) -> Optional[Path]:
+    """Return the active version directory under ``root`` (LATEST, else newest name)."""
+    root = Path(root)
+    if not root.is_dir():
+        return None
+    latest = root / "LATEST"
+    if latest.is_file():
+        name = latest.read_text(encoding="utf-8").strip()
+        if name and (root / name / "manifest.json").is_file():
+            return root / name
+    versions = sorted(p for p in root.iterdir() if (p / "manifest.json").is_file())
+    return versions[-1] if versions else None
+
+
+def load_classifier(path: Path) -> IntentClassifier:
+    """Build the engine for an artifact directory (weights are loaded on first use)."""
+    with open(Path(path) / "manifest.json", encoding="utf-8") as fh:
+        manifest = json.load(fh)
+    engine = ENGINES.get(manifest.get("format"))
+    if engine is None:
+        raise ValueError(f"Unknown intent model format: {manifest.get('format')!r}")
+    return engine(path, manifest)
+
+
+# How often (seconds) to re-check LATEST for a newly trained/exported version.
+RELOAD_INTERVAL_S = float(os.environ.get("MHCHAT_INTENT_MODEL_RELOAD_S", "30"))
+
+_classifier: Optional[IntentClassifier] = None
+_artifact_path: Optional[Path] = None
+_checked_at: Optional[float] = None  # None = never resolved
+_pinned = False  # set_intent_classifier() disables the disk checks
+_lock = threading.Lock()
+
+
+def get_intent_classifier() -> Optional[IntentClassifier]:
+    """
+    Return the configured classifier, or None when no usable artifact exists.
+    The artifact directory is re-resolved every RELOAD_INTERVAL_S, so pointing
+    LATEST at a new version swaps the model without a restart.
+    """
+    global _classifier, _artifact_path, _checked_at
+    if _pinned or (_checked_at is not None and time.monotonic() - _checked_at < RELOAD_INTERVAL_S):
+        return _classifier
+    with _lock:
+        if _pinned or (_checked_at is not None and time.monotonic() - _checked_at < RELOAD_INTERVAL_S):
+            return _classifier
+        if np is not None:
+            root = os.environ.get("MHCHAT_INTENT_MODEL_DIR") or DEFAULT_MODEL_DIR
+            try:
+                path = resolve_artifact(root)
+                if path != _artifact_path:
+                    _classifier = load_classifier(path) if path is not None else None
+                    _artifact_path = path
+            except Exception:
+                logger.exception("Failed to load intent model from %s; keeping the current engine", root)
+        _checked_at = time.monotonic()
+    return _classifier
+
+
+def set_intent_classifier(classifier: Optional[IntentClassifier]) -> None:
+    """Install an engine explicitly (or None to force the keyword rules)."""
+    global _classifier, _pinned
+    with _lock:
+        _classifier = classifier
+        _pinned = True
+
+
+def reset_intent_classifier() -> None:
+    """Forget the current engine; the next call re-resolves the artifact directory."""
+    global _classifier, _artifact_path, _checked_at, _pinned
+    with _lock:
+        _classifier = None
+        _artifact_path = None
+        _checked_at = None
+        _pinned = False
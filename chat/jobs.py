@@ -0,0 +1,352 @@
+# chat/jobs.py
+"""
+Durable job queue for the reply pipeline, kept in the chat_job table.
+
+Producers call ``enqueue(handle_user_message, message_id)``. With
+MHCHAT_JOBS_BACKEND=db that inserts a Job row (inside the caller's transaction,
+so it commits together with the message) and ``python manage.py run_workers``
+runs it on a bounded pool of worker threads. There is no broker: a plain table
+works on SQLite and Postgres.
+
+Leasing: a worker claims a job with a conditional UPDATE (pending and due, or
+running with an expired lease), so no two workers hold it at once. The lease
+(visibility timeout) is MHCHAT_JOBS_VISIBILITY_S, default 120s; if a worker
+dies its jobs are picked up again once the lease expires. Delivery is
+therefore at-least-once.
+
+Retries: a job that raises is retried after MHCHAT_JOBS_RETRY_BASE_S * 2**n
+(capped at 5 minutes) until it has run max_attempts times
+(MHCHAT_JOBS_MAX_ATTEMPTS, default 3), then it is marked failed with its last
+error. Finished jobs are purged after MHCHAT_JOBS_KEEP_S; failed ones are kept.
+
+MHCHAT_JOBS_BACKEND=inline (the default, no worker process needed) runs
+enqueued calls on an in-process pool of MHCHAT_JOBS_INLINE_WORKERS threads
+instead: bounded, but lost on restart.
+
+Lanes: jobs for safety-flagged messages (and their escalation emails) go on the
+"crisis" lane. Crisis jobs are claimed before normal ones and get
+MHCHAT_JOBS_CRISIS_WORKERS reserved threads (in run_workers and inline) that
+normal jobs never use, so a saturated normal lane does not delay them. Time
+from user message to the first system/bot message is tracked per lane
+(record_lane_latency / lane_stats).
+
+With the db backend bot replies are broadcast from the worker process, so the
+channel layer must be shared between processes (CHANNEL_LAYER_BACKEND=redis).
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .ml_deadline import LatencyTracker
+from .ml_http import ml_setting
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY_S = 300.0
+_PURGE_EVERY_S = 600.0
+
+LANE_CRISIS = Job.LANE_CRISIS
+LANE_NORMAL = Job.LANE_NORMAL
+LANES = (LANE_CRISIS, LANE_NORMAL)  # claim order
+
+
+def jobs_backend():
+    return str(ml_setting("MHCHAT_JOBS_BACKEND", "inline")).lower()
+
+
+def durable():
+    """True when enqueue() writes Job rows for run_workers."""
+    return jobs_backend() == "db"
+
+
+def job_name(func):
+    """Dotted import path of a module-level function (what a Job stores)."""
+    if isinstance(func, str):
+        return func
+    name = f"{func.__module__}.{func.__qualname__}"
+    if "<" in name or import_string(name) is not func:
+        raise ValueError(f"{func!r} is not an importable module-level function")
+    return name
+
+
+def _crisis_workers():
+    return max(1, int(ml_setting("MHCHAT_JOBS_CRISIS_WORKERS", 2)))
+
+
+def enqueue(func, *args, delay_s=0.0, max_attempts=None, lane=LANE_NORMAL, **kwargs):
+    """
+    Queue ``func(*args, **kwargs)`` on ``lane``. Returns the Job (db backend)
+    or a concurrent Future (inline backend). Arguments must be JSON-serializable.
+    """
+    name = job_name(func)
+    if lane not in LANES:
+        raise ValueError(f"Unknown job lane {lane!r}")
+    if not durable():
+        return _inline_pool(lane).submit(_run_inline, name, args, kwargs)
+    return Job.objects.create(
+        name=name,
+        lane=lane,
+        args=list(args),
+        kwargs=kwargs,
+        run_after=timezone.now() + timedelta(seconds=delay_s),
+        max_attempts=max_attempts or int(ml_setting("MHCHAT_JOBS_MAX_ATTEMPTS", 3)),
+    )
+
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def _inline_pool(lane=LANE_NORMAL):
+    pool = _pools.get(lane)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(lane)
+            if pool is None:
+                size = _crisis_workers() if lane == LANE_CRISIS else int(ml_setting("MHCHAT_JOBS_INLINE_WORKERS", 4))
+                pool = _pools[lane] = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"mhchat-job-{lane}")
+    return pool
+
+
+async def arun_on_lane(func, *args, lane=LANE_NORMAL, **kwargs):
+    """
+    Await ``func(*args, **kwargs)`` on the lane's inline pool. Runs through
+    sync_to_async, so async_to_sync calls inside (broadcasts) use this loop.
+    """
+    name = job_name(func)
+    return await sync_to_async(_run_inline, thread_sensitive=False, executor=_inline_pool(lane))(name, args, kwargs)
+
+
+def _run_inline(name, args, kwargs):
+    try:
+        return import_string(name)(*args, **kwargs)
+    except Exception:
+        logger.exception("Inline job %s failed", name)
+    finally:
+        close_old_connections()
+
+
+def _retry_delay_s(attempts):
+    base = float(ml_setting("MHCHAT_JOBS_RETRY_BASE_S", 5.0))
+    return min(base * (2 ** max(0, attempts - 1)), MAX_RETRY_DELAY_S)
+
+
+class Worker:
+    """
+    Claims ready jobs and runs them on ``workers`` threads plus
+    ``crisis_workers`` threads reserved for the crisis lane (workers=0: one job
+    at a time in the calling thread, crisis lane first).
+    """
+
+    def __init__(self, workers=4, visibility_s=None, poll_interval_s=1.0, name=None, crisis_workers=None):
+        self.workers = max(0, int(workers))
+        self.crisis_workers = max(1, int(crisis_workers)) if crisis_workers is not None else _crisis_workers()
+        self.visibility_s = float(visibility_s if visibility_s is not None else ml_setting("MHCHAT_JOBS_VISIBILITY_S", 120.0))
+        self.poll_interval_s = float(poll_interval_s)
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"[:100]
+        self._lock = threading.Lock()
+        self._stats = {"claimed": 0, "crisis_claimed": 0, "done": 0, "retried": 0, "failed": 0, "lost_leases": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    @staticmethod
+    def _ready(now):
+        return Q(status=Job.STATUS_PENDING, run_after__lte=now) | Q(status=Job.STATUS_RUNNING, locked_until__lt=now)
+
+    def claim(self, limit, lane=None):
+        """Lease up to ``limit`` ready jobs (of ``lane``, or any); returns them (attempts already incremented)."""
+        if limit <= 0:
+            return []
+        now = timezone.now()
+        ready = self._ready(now)
+        if lane is not None:
+            ready &= Q(lane=lane)
+        candidates = list(
+            Job.objects.filter(ready).order_by("run_after", "id").values_list("id", flat=True)[:limit * 2]
+        )
+        claimed = []
+        for job_id in candidates:
+            if len(claimed) >= limit:
+                break
+            # another worker may have taken it since the SELECT: only one UPDATE matches
+            if Job.objects.filter(ready, id=job_id).update(
+                status=Job.STATUS_RUNNING,
+                locked_until=now + timedelta(seconds=self.visibility_s),
+                locked_by=self.name,
+                attempts=F("attempts") + 1,
+            ):
+                claimed.append(job_id)
+        for _ in claimed:
+            self._count("crisis_claimed" if lane == LANE_CRISIS else "claimed")
+        return list(Job.objects.filter(id__in=claimed).order_by("run_after", "id"))
+
+    def _finish(self, job, **fields):
+        """Update the job if we still hold its lease; False if it expired and was taken over."""
+        held = Job.objects.filter(
+            id=job.id, status=Job.STATUS_RUNNING, locked_by=self.name, attempts=job.attempts,
+        ).update(locked_until=None, **fields)
+        if not held:
+            self._count("lost_leases")
+            logger.warning("Job %s finished after its lease expired; result dropped", job.id)
+        return bool(held)
+
+    def run_job(self, job):
+        if job.attempts > job.max_attempts:
+            # leased again after a worker died mid-run too many times
+            if self._finish(job, status=Job.STATUS_FAILED, finished_at=timezone.now(),
+                            last_error=job.last_error or "lease expired on every attempt"):
+                self._count("failed")
+            return
+        try:
+            import_string(job.name)(*job.args, **job.kwargs)
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            if job.attempts < job.max_attempts:
+                delay = _retry_delay_s(job.attempts)
+                logger.warning("Job %s (%s) failed on attempt %d/%d: %s; retrying in %.0fs",
+                               job.id, job.name, job.attempts, job.max_attempts, error, delay)
+                if self._finish(job, status=Job.STATUS_PENDING, last_error=error,
+                                run_after=timezone.now() + timedelta(seconds=delay)):
+                    self._count("retried")
+            else:
+                logger.exception("Job %s (%s) failed after %d attempts", job.id, job.name, job.attempts)
+                if self._finish(job, status=Job.STATUS_FAILED, last_error=error, finished_at=timezone.now()):
+                    self._count("failed")
+        else:
+            if self._finish(job, status=Job.STATUS_DONE, finished_at=timezone.now()):
+                self._count("done")
+
+    def _run_in_thread(self, job):
+        close_old_connections()
+        try:
+            self.run_job(job)
+        except Exception:
+            logger.exception("Worker error on job %s", job.id)
+        finally:
+            close_old_connections()
+
+    def _claim_inline(self):
+        for lane in LANES:
+            jobs = self.claim(1, lane)
+            if jobs:
+                return jobs
+        return []
+
+    def run(self, stop=None, once=False):
+        """
+        Work until ``stop`` (a threading.Event) is set; with ``once``, return
+        as soon as no job is ready and none is running. In-flight jobs always
+        finish before returning.
+
+        Each round crisis jobs are claimed first, for the free reserved threads
+        and then any free normal thread; normal jobs only get normal threads.
+        """
+        stop = stop or threading.Event()
+        pools = {}
+        if self.workers:
+            pools = {
+                LANE_CRISIS: ThreadPoolExecutor(max_workers=self.crisis_workers, thread_name_prefix="mhchat-worker-crisis"),
+                LANE_NORMAL: ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="mhchat-worker"),
+            }
+        size = {LANE_CRISIS: self.crisis_workers, LANE_NORMAL: self.workers}
+        in_flight = {}  # future -> pool lane
+        last_purge = time.monotonic()
+        try:
+            while not stop.is_set():
+                in_flight = {f: pool for f, pool in in_flight.items() if not f.done()}
+                if pools:
+                    busy = {lane: sum(1 for pool in in_flight.values() if pool == lane) for lane in LANES}
+                    free = {lane: size[lane] - busy[lane] for lane in LANES}
+                    jobs = self.claim(free[LANE_CRISIS] + free[LANE_NORMAL], LANE_CRISIS)
+                    normal_slots = free[LANE_NORMAL] - max(0, len(jobs) - free[LANE_CRISIS])
+                    jobs += self.claim(normal_slots, LANE_NORMAL)
+                    for job in jobs:
+                        lane = LANE_CRISIS if job.lane == LANE_CRISIS and free[LANE_CRISIS] > 0 else LANE_NORMAL
+                        free[lane] -= 1
+                        in_flight[pools[lane].submit(self._run_in_thread, job)] = lane
+                else:
+                    jobs = self._claim_inline()
+                    for job in jobs:
+                        self._run_in_thread(job)
+                if once and not jobs and not in_flight:
+                    break
+                if time.monotonic() - last_purge > _PURGE_EVERY_S:
+                    purge_finished_jobs()
+                    last_purge = time.monotonic()
+                if not jobs:
+                    if in_flight:
+                        wait(in_flight, timeout=self.poll_interval_s, return_when=FIRST_COMPLETED)
+                    else:
+                        stop.wait(self.poll_interval_s)
+                elif pools and len(in_flight) >= self.workers + self.crisis_workers:
+                    wait(in_flight, timeout=self.poll_interval_s, return_when=FIRST_COMPLETED)
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        out.update(name=self.name, workers=self.workers, crisis_workers=self.crisis_workers, visibility_s=self.visibility_s)
+        return out
+
+
+def purge_finished_jobs(older_than_s=None):
+    """Delete done jobs finished more than MHCHAT_JOBS_KEEP_S ago; returns the count."""
+    keep_s = float(older_than_s if older_than_s is not None else ml_setting("MHCHAT_JOBS_KEEP_S", 86400.0))
+    deleted, _ = Job.objects.filter(
+        status=Job.STATUS_DONE, finished_at__lt=timezone.now() - timedelta(seconds=keep_s),
+    ).delete()
+    return deleted
+
+
+def job_queue_stats():
+    """Jobs per status, pending jobs per lane and the age of the oldest ready one."""
+    out = {status: 0 for status, _ in Job.STATUS_CHOICES}
+    for row in Job.objects.values("status").annotate(n=Count("id")):
+        out[row["status"]] = row["n"]
+    pending = {lane: 0 for lane in LANES}
+    for row in Job.objects.filter(status=Job.STATUS_PENDING).values("lane").annotate(n=Count("id")):
+        pending[row["lane"]] = row["n"]
+    out["pending_by_lane"] = pending
+    oldest = Job.objects.filter(status=Job.STATUS_PENDING, run_after__lte=timezone.now()).aggregate(t=Min("run_after"))["t"]
+    out["oldest_ready_s"] = (timezone.now() - oldest).total_seconds() if oldest else 0.0
+    return out
+
+
+_lane_latency = {lane: LatencyTracker(size=500) for lane in LANES}
+
+
+def record_lane_latency(lane, seconds):
+    """Time from a user message to its first system/bot message, for ``lane``."""
+    _lane_latency[lane].record(max(0.0, seconds))
+
+
+def lane_stats():
+    """Per lane: samples and p50/p95/p99 time-to-first-reply in ms."""
+    out = {}
+    for lane, tracker in _lane_latency.items():
+        row = {"samples": len(tracker)}
+        for q in (50, 95, 99):
+            value = tracker.percentile(q)
+            row[f"p{q}_ms"] = round(value * 1000.0, 1) if value is not None else None
+        out[lane] = row
+    return out
+
+
+def reset_lane_stats():
+    for lane in LANES:
+        _lane_latency[lane] = LatencyTracker(size=500)
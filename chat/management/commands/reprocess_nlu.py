@@ -0,0 +1,126 @@
+# chat/management/commands/reprocess_nlu.py
+"""
+Re-score stored user messages with the current NLU lexicons.
+
+Streams Message rows in id order, analyzes them in batches on a process pool
+(chat.nlp.analyze_messages) and writes nlp_metadata back with bulk_update.
+Existing keys that the NLU does not produce (e.g. "ml") are kept. is_flagged
+is left alone so admin reviews are not undone.
+
+Resumable: with --checkpoint, the last committed id is written to that file
+after every batch and picked up again on the next run.
+
+    python manage.py reprocess_nlu --workers 4 --checkpoint /tmp/reprocess_nlu.ckpt
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.models import Message
+from chat.nlp import analyze_messages
+from chat.tasks import _build_message_text
+
+
+class _InlineExecutor:
+    """Executor stand-in for --workers 0 (runs batches in this process)."""
+
+    def submit(self, fn, *args):
+        fut = Future()
+        fut.set_result(fn(*args))
+        return fut
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Re-run NLU over stored user messages and rewrite nlp_metadata (resumable)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Messages per analysis batch.")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows fetched per DB round trip.")
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count() or 1,
+            help="Worker processes (0 = analyze in this process).",
+        )
+        parser.add_argument("--after-id", type=int, default=None, help="Only process messages with id > this.")
+        parser.add_argument("--checkpoint", default=None, help="File holding the last processed id (read + updated).")
+        parser.add_argument("--limit", type=int, default=None, help="Stop after this many messages.")
+        parser.add_argument("--report-every", type=float, default=5.0, help="Seconds between progress lines.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be >= 1")
+
+        checkpoint = options["checkpoint"]
+        after_id = options["after_id"]
+        if after_id is None and checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as fh:
+                raw = fh.read().strip()
+            after_id = int(raw) if raw else None
+            if after_id is not None:
+                self.stdout.write(f"Resuming after message id {after_id}")
+
+        qs = Message.objects.filter(sender=Message.ROLE_USER).order_by("id").only("id", "text", "nlp_metadata")
+        if after_id is not None:
+            qs = qs.filter(id__gt=after_id)
+        if options["limit"]:
+            qs = qs[:options["limit"]]
+        qs = qs.prefetch_related("attachments")
+
+        workers = options["workers"]
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else _InlineExecutor()
+        # Results are consumed in submission order so the checkpoint never skips a batch.
+        max_in_flight = max(1, workers) * 2
+        pending = deque()
+
+        self._started = time.monotonic()
+        self._last_report = self._started
+        self._processed = 0
+        self._last_id = after_id
+
+        try:
+            batch = []
+            for msg in qs.iterator(chunk_size=options["chunk_size"]):
+                batch.append(msg)
+                if len(batch) >= batch_size:
+                    pending.append((batch, executor.submit(analyze_messages, [_build_message_text(m) for m in batch])))
+                    batch = []
+                    while len(pending) >= max_in_flight:
+                        self._flush(*pending.popleft(), checkpoint, options["report_every"])
+            if batch:
+                pending.append((batch, executor.submit(analyze_messages, [_build_message_text(m) for m in batch])))
+            while pending:
+                self._flush(*pending.popleft(), checkpoint, options["report_every"])
+        finally:
+            executor.shutdown(wait=True)
+
+        elapsed = time.monotonic() - self._started
+        rate = self._processed / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Reprocessed {self._processed} messages in {elapsed:.1f}s ({rate:.0f} rows/s); last id {self._last_id}"
+        ))
+
+    def _flush(self, msgs, future, checkpoint, report_every):
+        metas = future.result()
+        for msg, meta in zip(msgs, metas):
+            msg.nlp_metadata = {**(msg.nlp_metadata or {}), **meta}
+        Message.objects.bulk_update(msgs, ["nlp_metadata"])
+
+        self._processed += len(msgs)
+        self._last_id = msgs[-1].id
+        if checkpoint:
+            tmp = f"{checkpoint}.tmp"
+            with open(tmp, "w") as fh:
+                fh.write(str(self._last_id))
+            os.replace(tmp, checkpoint)
+
+        now = time.monotonic()
+        if now - self._last_report >= report_every:
+            self._last_report = now
+            rate = self._processed / (now - self._started)
+            self.stdout.write(f"  {self._processed} messages ({rate:.0f} rows/s), last id {self._last_id}")
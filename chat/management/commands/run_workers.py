@@ -0,0 +1,64 @@
+# chat/management/commands/run_workers.py
+"""
+Run queued jobs (chat/jobs.py) on a bounded pool of worker threads.
+
+Used with MHCHAT_JOBS_BACKEND=db: web processes enqueue Job rows, this
+command leases and runs them. Start as many of these processes as needed;
+leases keep them from running the same job. Crisis-lane jobs are claimed first
+and have their own reserved threads. SIGTERM/SIGINT stop claiming new
+jobs and wait for the running ones.
+
+    python manage.py run_workers --workers 8
+    python manage.py run_workers --once        # drain ready jobs and exit
+"""
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.jobs import Worker, job_queue_stats, lane_stats
+from chat.ml_http import ml_setting
+
+
+class Command(BaseCommand):
+    help = "Run queued reply/escalation jobs with a bounded worker pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=int(ml_setting("MHCHAT_JOBS_WORKERS", 4)),
+            help="Worker threads (0 = run jobs in the main thread).",
+        )
+        parser.add_argument(
+            "--crisis-workers", type=int, default=None,
+            help="Extra threads reserved for crisis-lane jobs (MHCHAT_JOBS_CRISIS_WORKERS).",
+        )
+        parser.add_argument("--visibility-timeout", type=float, default=None,
+                            help="Lease seconds before a running job is retried elsewhere (MHCHAT_JOBS_VISIBILITY_S).")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls when idle.")
+        parser.add_argument("--once", action="store_true", help="Exit once no job is ready.")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 0:
+            raise CommandError("--workers must be >= 0")
+        worker = Worker(
+            workers=options["workers"],
+            visibility_s=options["visibility_timeout"],
+            poll_interval_s=options["poll_interval"],
+            crisis_workers=options["crisis_workers"],
+        )
+        stop = threading.Event()
+
+        def _stop(signum, frame):
+            self.stdout.write("Stopping: finishing running jobs...")
+            stop.set()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, _stop)
+            signal.signal(signal.SIGINT, _stop)
+
+        self.stdout.write(
+            f"Worker {worker.name} running {worker.workers} + {worker.crisis_workers} crisis thread(s); "
+            f"queue: {job_queue_stats()}"
+        )
+        worker.run(stop=stop, once=options["once"])
+        self.stdout.write(self.style.SUCCESS(f"Worker stopped: {worker.stats()}; reply latency: {lane_stats()}"))
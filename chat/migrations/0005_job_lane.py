@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_job'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='job',
+            name='chat_job_ready_idx',
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='lane',
+            field=models.CharField(choices=[('crisis', 'crisis'), ('normal', 'normal')], default='normal', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'lane', 'run_after'], name='chat_job_ready_idx'),
+        ),
+    ]
@@ -0,0 +1,340 @@
+# chat/ml_async.py
+"""
+asyncio transport for the mhchat-ml service (used by ml_brain_client.apredict).
+
+The WebSocket consumer used to run the whole reply pipeline in
+asyncio.to_thread, so every in-flight reply held an executor thread blocked in
+urllib or a backoff sleep. AsyncMLClient speaks HTTP/1.1 over asyncio streams
+with a small keep-alive pool, and bounds concurrent requests with an
+asyncio.Semaphore (MHCHAT_ML_ASYNC_CONCURRENCY, default 64) instead of threads.
+
+Streams belong to one event loop, so there is one client per running loop;
+get_async_ml_client() picks the right one.
+"""
+import asyncio
+import contextlib
+import http.client
+import ssl
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+from .ml_http import DEFAULT_API_BASE, Response, ml_setting
+
+# Errors that mean the server closed a reused keep-alive connection.
+_STALE_ERRORS = (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+_MAX_HEADER_LINES = 100
+
+
+class _StaleConnection(Exception):
+    pass
+
+
+class AsyncMLClient:
+    """Keep-alive HTTP/1.1 client over asyncio streams for one origin and one event loop."""
+
+    def __init__(self, base_url, max_concurrency=64, max_idle=8, idle_timeout_s=30.0):
+        parts = urlsplit(base_url.rstrip("/"))
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported ML API base URL: {base_url!r}")
+        self.base_url = base_url.rstrip("/")
+        self._host = parts.hostname
+        self._port = parts.port or (443 if parts.scheme == "https" else 80)
+        self._ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self._prefix = parts.path
+        self._host_header = parts.netloc
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_idle = max(0, int(max_idle))
+        self.idle_timeout_s = float(idle_timeout_s)
+
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+        self._idle = []  # [(reader, writer, released_at)], newest last
+        self._in_flight = 0
+        self._waiting = 0
+        self._stats = {"requests": 0, "connects": 0, "reuses": 0, "stale_retries": 0, "errors": 0, "max_in_flight": 0, "streams": 0}
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    async def request(self, method, path, body=None, headers=None, timeout_s=8.0):
+        """Send one request; waits for a concurrency slot, then at most ``timeout_s`` for the response."""
+        self._stats["requests"] += 1
+        self._waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+        self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._in_flight)
+        try:
+            return await asyncio.wait_for(self._request(method, path, body, headers), timeout_s)
+        except BaseException:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._sem.release()
+
+    async def _request(self, method, path, body, headers):
+        raw = self._encode_request(method, path, body, headers)
+
+        for attempt in (0, 1):
+            reader, writer, reused = await self._acquire()
+            try:
+                writer.write(raw)
+                await writer.drain()
+                status, resp_headers, resp_body, keep = await self._read_response(reader, method)
+            except (_StaleConnection, *_STALE_ERRORS) as exc:
+                writer.close()
+                if reused and attempt == 0:
+                    self._stats["stale_retries"] += 1
+                    continue
+                if isinstance(exc, _StaleConnection):
+                    raise http.client.RemoteDisconnected("Remote end closed connection without response") from None
+                raise
+            except BaseException:
+                writer.close()  # timeout/cancel mid-response: connection state is unknown
+                raise
+            self._release(reader, writer, keep)
+            return Response(status, resp_headers, resp_body)
+
+    def _encode_request(self, method, path, body, headers):
+        data = body or b""
+        head = [
+            f"{method} {self._prefix}{path} HTTP/1.1",
+            f"Host: {self._host_header}",
+            "Connection: keep-alive",
+            f"Content-Length: {len(data)}",
+        ]
+        head.extend(f"{k}: {v}" for k, v in (headers or {}).items())
+        return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data
+
+    async def _acquire(self, timeout_s=None):
+        now = time.monotonic()
+        while self._idle:
+            reader, writer, released_at = self._idle.pop()
+            if now - released_at <= self.idle_timeout_s and not writer.is_closing() and not reader.at_eof():
+                self._stats["reuses"] += 1
+                return reader, writer, True
+            writer.close()
+        self._stats["connects"] += 1
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self._host, self._port, ssl=self._ssl), timeout_s,
+        )
+        return reader, writer, False
+
+    def _release(self, reader, writer, keep):
+        if keep and len(self._idle) < self.max_idle:
+            self._idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    async def _read_response(self, reader, method):
+        status, headers, keep = await self._read_head(reader)
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await _read_chunked(reader)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep = False
+        return status, headers, body, keep
+
+    async def _read_head(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise _StaleConnection()
+        try:
+            version, status, _ = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+            status = int(status)
+        except ValueError:
+            raise http.client.BadStatusLine(status_line) from None
+
+        headers = {}
+        for _ in range(_MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise http.client.HTTPException("too many response headers")
+
+        keep = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        return status, headers, keep
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, path, body=None, headers=None, timeout_s=8.0):
+        """
+        Like request(), but the body is not buffered: yields a StreamResponse
+        whose chunks() async-iterates it. ``timeout_s`` bounds the wait for the
+        response head and every gap between chunks, not the whole body.
+        """
+        self._stats["requests"] += 1
+        self._stats["streams"] += 1
+        await self._sem.acquire()
+        self._in_flight += 1
+        self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._in_flight)
+        writer = None
+        resp = None
+        try:
+            raw = self._encode_request(method, path, body, headers)
+            reader, writer, status, resp_headers, keep = await self._open_stream(raw, timeout_s)
+            resp = StreamResponse(status, resp_headers, reader, timeout_s, keep)
+            yield resp
+        except BaseException:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._sem.release()
+            if writer is not None:
+                if resp is not None and resp.finished and resp.keep:
+                    self._release(reader, writer, True)
+                else:
+                    writer.close()  # body not fully read: connection can't be reused
+
+    async def _open_stream(self, raw, timeout_s):
+        """
+        Send ``raw`` and read the response head. Like _request, a reused
+        connection the server already closed is retried once on a fresh one;
+        nothing has been handed to the caller yet, so the retry is safe.
+        """
+        for attempt in (0, 1):
+            reader, writer, reused = await self._acquire(timeout_s)
+            try:
+                writer.write(raw)
+                await asyncio.wait_for(writer.drain(), timeout_s)
+                status, headers, keep = await asyncio.wait_for(self._read_head(reader), timeout_s)
+            except (_StaleConnection, *_STALE_ERRORS) as exc:
+                writer.close()
+                if reused and attempt == 0:
+                    self._stats["stale_retries"] += 1
+                    continue
+                if isinstance(exc, _StaleConnection):
+                    raise http.client.RemoteDisconnected("Remote end closed connection without response") from None
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            return reader, writer, status, headers, keep
+
+    def close(self):
+        idle, self._idle = self._idle, []
+        for _, writer, _ in idle:
+            try:
+                writer.close()
+            except RuntimeError:
+                pass  # event loop already closed; the transport went with it
+
+    def stats(self):
+        out = dict(self._stats)
+        out.update(
+            idle=len(self._idle), in_flight=self._in_flight, waiting=self._waiting,
+            max_concurrency=self.max_concurrency, base_url=self.base_url,
+        )
+        return out
+
+
+class StreamResponse:
+    """Response head plus an incrementally read body (see AsyncMLClient.stream)."""
+
+    def __init__(self, status, headers, reader, timeout_s, keep):
+        self.status = status
+        self.headers = headers
+        self.keep = keep
+        self.finished = False
+        self._reader = reader
+        self._timeout_s = timeout_s
+
+    async def chunks(self, size=65536):
+        reader, timeout = self._reader, self._timeout_s
+        if self.status in (204, 304) or 100 <= self.status < 200:
+            pass
+        elif self.headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size_line = await asyncio.wait_for(reader.readline(), timeout)
+                if not size_line:
+                    raise asyncio.IncompleteReadError(b"", None)
+                n = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                if n == 0:
+                    while (await asyncio.wait_for(reader.readline(), timeout)) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                yield await asyncio.wait_for(reader.readexactly(n), timeout)
+                await asyncio.wait_for(reader.readexactly(2), timeout)
+        elif "content-length" in self.headers:
+            remaining = int(self.headers["content-length"])
+            while remaining > 0:
+                chunk = await asyncio.wait_for(reader.read(min(size, remaining)), timeout)
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(chunk)
+                yield chunk
+        else:
+            self.keep = False
+            while True:
+                chunk = await asyncio.wait_for(reader.read(size), timeout)
+                if not chunk:
+                    break
+                yield chunk
+        self.finished = True
+
+    async def read(self):
+        return b"".join([chunk async for chunk in self.chunks()])
+
+
+async def _read_chunked(reader):
+    parts = []
+    while True:
+        size_line = await reader.readline()
+        if not size_line:
+            raise asyncio.IncompleteReadError(b"", None)
+        size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+        if size == 0:
+            # trailers until blank line
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            return b"".join(parts)
+        parts.append(await reader.readexactly(size))
+        await reader.readexactly(2)  # CRLF after each chunk
+
+
+_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncMLClient
+_clients_lock = threading.Lock()
+
+
+def get_async_ml_client():
+    """Client for the running event loop and the configured MHCHAT_ML_API_BASE."""
+    loop = asyncio.get_running_loop()
+    base_url = str(ml_setting("MHCHAT_ML_API_BASE", DEFAULT_API_BASE)).rstrip("/")
+    with _clients_lock:
+        client = _clients.get(loop)
+        if client is None or client.base_url != base_url:
+            if client is not None:
+                client.close()
+            client = AsyncMLClient(
+                base_url,
+                max_concurrency=int(ml_setting("MHCHAT_ML_ASYNC_CONCURRENCY", 64)),
+                max_idle=int(ml_setting("MHCHAT_ML_POOL_SIZE", 8)),
+                idle_timeout_s=float(ml_setting("MHCHAT_ML_POOL_IDLE_S", 30.0)),
+            )
+            _clients[loop] = client
+        return client
+
+
+def ml_async_stats():
+    """Stats of every live per-loop client."""
+    with _clients_lock:
+        return [client.stats() for client in _clients.values()]
+
+
+def reset_async_ml_clients():
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
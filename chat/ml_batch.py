@@ -0,0 +1,178 @@
+# chat/ml_batch.py
+"""
+Micro-batching of mhchat-ml /predict calls across concurrent conversations.
+
+With batching on, predict()/apredict() hand their payload to a PredictBatcher
+instead of posting it. A flusher thread collects payloads until
+MHCHAT_ML_BATCH_MAX_SIZE are queued or MHCHAT_ML_BATCH_MAX_WAIT_MS passed since
+the first one, sends them as one /predict_batch call (on a small pool of
+MHCHAT_ML_BATCH_WORKERS sender threads) and resolves each caller's Future with
+its own result. Async callers await the same Future via asyncio.wrap_future,
+so they hold no thread while waiting.
+
+/predict_batch contract:
+    request   {"items": [{"message": str, "context": [...]}, ...]}
+    response  {"results": [<same object /predict returns>, ...]}  same order and length
+
+Batching is off by default (MHCHAT_ML_BATCH_MAX_SIZE=0). If the service
+answers /predict_batch with 404/405 it is switched off for the process and
+callers go back to /predict.
+
+ml_batch_stats() reports batches, items, mean fill, flush reasons and callers
+that gave up before their batch was sent (cancelled).
+"""
+import http.client
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .ml_http import HTTPStatusError, ml_setting
+
+logger = logging.getLogger(__name__)
+
+
+class BatchUnsupported(http.client.HTTPException):
+    """The ML service has no /predict_batch endpoint (callers retry on /predict)."""
+
+
+class PredictBatcher:
+    def __init__(self, send_batch, max_size=16, max_wait_ms=5.0, workers=4):
+        self._send = send_batch  # list of payloads -> list of results
+        self.max_size = max(1, int(max_size))
+        self.max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+        self.supported = True
+        self._cv = threading.Condition()
+        self._pending = []  # [(payload, Future)]
+        self._first_at = None
+        self._thread = None
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="mhchat-ml-batch")
+        self._stats = {"submitted": 0, "batches": 0, "items": 0, "flush_full": 0, "flush_timeout": 0, "errors": 0, "cancelled": 0}
+
+    def submit(self, payload):
+        """Queue one /predict payload; the Future resolves to its result dict (or None)."""
+        fut = Future()
+        with self._cv:
+            if self._closed:
+                raise RuntimeError("PredictBatcher is closed")
+            self._pending.append((payload, fut))
+            self._stats["submitted"] += 1
+            if len(self._pending) == 1:
+                self._first_at = time.monotonic()
+                self._cv.notify()
+            elif len(self._pending) >= self.max_size:
+                self._cv.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mhchat-ml-batcher", daemon=True)
+                self._thread.start()
+        return fut
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not self._pending and not self._closed:
+                    self._cv.wait()
+                if self._closed and not self._pending:
+                    return
+                deadline = self._first_at + self.max_wait_s
+                while len(self._pending) < self.max_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cv.wait(remaining)
+                batch = self._pending[:self.max_size]
+                del self._pending[:self.max_size]
+                self._first_at = time.monotonic() if self._pending else None
+                self._stats["batches"] += 1
+                self._stats["items"] += len(batch)
+                self._stats["flush_full" if len(batch) >= self.max_size else "flush_timeout"] += 1
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        # Drop callers that already gave up (timed out or cancelled while
+        # queued); the rest are marked running, so a caller giving up during
+        # the send can no longer cancel its Future under the set_result below.
+        live = [(payload, fut) for payload, fut in batch if fut.set_running_or_notify_cancel()]
+        if len(live) < len(batch):
+            with self._cv:
+                self._stats["cancelled"] += len(batch) - len(live)
+        batch = live
+        if not batch:
+            return
+        try:
+            results = self._send([payload for payload, _ in batch])
+            if not isinstance(results, list) or len(results) != len(batch):
+                raise ValueError(f"/predict_batch returned {type(results).__name__} for {len(batch)} items")
+        except BaseException as exc:
+            if isinstance(exc, HTTPStatusError) and exc.status in (404, 405):
+                self.supported = False
+                logger.warning("mhchat-ml has no /predict_batch (HTTP %s); batching disabled", exc.status)
+                exc = BatchUnsupported(str(exc))
+            with self._cv:
+                self._stats["errors"] += 1
+            for _, fut in batch:
+                fut.set_exception(exc)
+            return
+        for (_, fut), result in zip(batch, results):
+            fut.set_result(result if isinstance(result, dict) else None)
+
+    def close(self):
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        with self._cv:
+            out = dict(self._stats)
+            out.update(queued=len(self._pending), max_size=self.max_size,
+                       max_wait_ms=self.max_wait_s * 1000.0, supported=self.supported)
+        out["mean_fill"] = out["items"] / (out["batches"] * self.max_size) if out["batches"] else 0.0
+        out["mean_batch"] = out["items"] / out["batches"] if out["batches"] else 0.0
+        return out
+
+
+_batcher = None
+_batcher_key = None
+_batcher_lock = threading.Lock()
+
+
+def get_predict_batcher(send_batch):
+    """The process batcher, or None when batching is off or unsupported by the service."""
+    global _batcher, _batcher_key
+    max_size = int(ml_setting("MHCHAT_ML_BATCH_MAX_SIZE", 0))
+    if max_size <= 1:
+        return None
+    key = (
+        max_size,
+        float(ml_setting("MHCHAT_ML_BATCH_MAX_WAIT_MS", 5.0)),
+        int(ml_setting("MHCHAT_ML_BATCH_WORKERS", 4)),
+        str(ml_setting("MHCHAT_ML_API_BASE", "")),
+    )
+    batcher = _batcher
+    if batcher is None or _batcher_key != key:
+        with _batcher_lock:
+            if _batcher is None or _batcher_key != key:
+                old = _batcher
+                _batcher = PredictBatcher(send_batch, max_size=key[0], max_wait_ms=key[1], workers=key[2])
+                _batcher_key = key
+                if old is not None:
+                    old.close()
+            batcher = _batcher
+    return batcher if batcher.supported else None
+
+
+def ml_batch_stats():
+    batcher = _batcher
+    return batcher.stats() if batcher is not None else {}
+
+
+def reset_predict_batcher():
+    global _batcher, _batcher_key
+    with _batcher_lock:
+        old, _batcher, _batcher_key = _batcher, None, None
+    if old is not None:
+        old.close()
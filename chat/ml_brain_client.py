@@ -1,12 +1,21 @@
+import asyncio
+import http.client
 import json
-import os
-import socket
 import time
-import urllib.request
-import urllib.error
 import logging
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from typing import Any, Dict, Optional
 
+from .ml_async import get_async_ml_client
+from .ml_batch import get_predict_batcher
+from .ml_cache import get_ml_response_cache, prediction_cache_key
+from .ml_codec import get_wire_codec
+from .ml_context import conversation_context
+from . import ml_deadline
+from .ml_deadline import MIN_ATTEMPT_S, Deadline, DeadlineExceeded, arun_bounded, hedge_delay_s, run_bounded
+from .ml_health import ensure_health_prober, get_ml_breaker
+from .ml_http import HTTPStatusError, get_ml_http_client, ml_setting
+
 logger = logging.getLogger(__name__)
 
 
@@ -84,16 +93,12 @@ def is_ml_service_healthy(timeout_s: float = 5.0) -> bool:
     Returns:
         True if service is healthy, False otherwise
     """
-    base_url = os.environ.get("MHCHAT_ML_API_BASE", "http://127.0.0.1:8001").rstrip("/")
-    url = f"{base_url}/health"
-    
     try:
-        req = urllib.request.Request(url, method="GET")
-        with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-            if resp.status == 200:
-                logger.debug("ML service health check passed")
-                return True
-    except (urllib.error.URLError, socket.timeout):
+        resp = get_ml_http_client().request("GET", "/health", timeout_s=timeout_s)
+        if resp.status == 200:
+            logger.debug("ML service health check passed")
+            return True
+    except (OSError, http.client.HTTPException):
         pass
     except Exception as e:
         logger.debug(f"ML service health check failed: {type(e).__name__}")
@@ -101,95 +106,440 @@ def is_ml_service_healthy(timeout_s: float = 5.0) -> bool:
     return False
 
 def _fetch_context(conversation_id: Optional[int]) -> list:
-    """Load recent messages for a conversation (best-effort)."""
+    """Recent messages for a conversation (best-effort), from the context cache when warm."""
     if not conversation_id:
         return []
 
     try:
-        from .models import Message, Conversation
-        conv = Conversation.objects.get(id=conversation_id)
-        recent_msgs = Message.objects.filter(conversation=conv).order_by('-created_at')[:5]
-        return [
-            {"sender": msg.sender, "text": msg.text}
-            for msg in reversed(recent_msgs)
-        ]
+        return conversation_context(conversation_id)
     except Exception as e:
         logger.warning(f"Failed to fetch conversation context: {e}")
         return []
 
 
-def _post_json(url: str, payload: dict, timeout_s: float) -> Optional[Dict[str, Any]]:
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(
-        url,
-        data=data,
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
-    with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-        raw = resp.read().decode("utf-8")
-        parsed = json.loads(raw)
-        return parsed if isinstance(parsed, dict) else None
+def _post_json(path: str, payload: dict, timeout_s: float) -> Optional[Dict[str, Any]]:
+    """POST ``payload``; the body is JSON or MessagePack as negotiated by ml_codec."""
+    client = get_ml_http_client()
+    codec = get_wire_codec()
+    body, headers = codec.encode(payload)
+    resp = client.request("POST", path, body=body, headers=headers, timeout_s=timeout_s)
+    if codec.rejected(resp.status):
+        body, headers = codec.encode(payload)
+        resp = client.request("POST", path, body=body, headers=headers, timeout_s=timeout_s)
+    if not 200 <= resp.status < 300:
+        raise HTTPStatusError(resp.status, client.url(path), resp.body)
+    parsed = codec.decode(resp.headers, resp.body)
+    return parsed if isinstance(parsed, dict) else None
+
+
+def _send_predict_batch(payloads: list) -> Optional[list]:
+    """PredictBatcher sender: one /predict_batch call for many /predict payloads."""
+    timeout_s = float(ml_setting("MHCHAT_ML_BATCH_TIMEOUT_S", 8.0))
+    resp = _post_json("/predict_batch", {"items": payloads}, timeout_s)
+    return (resp or {}).get("results")
+
+
+def _post_predict(payload: dict, timeout_s: float) -> Optional[Dict[str, Any]]:
+    batcher = get_predict_batcher(_send_predict_batch)
+    if batcher is None:
+        started = time.monotonic()
+        pred = _post_json("/predict", payload, timeout_s)
+        ml_deadline.predict_latency.record(time.monotonic() - started)
+        return pred
+    return batcher.submit(payload).result(timeout=timeout_s)
+
+
+async def _apost_predict(payload: dict, timeout_s: float) -> Optional[Dict[str, Any]]:
+    batcher = get_predict_batcher(_send_predict_batch)
+    if batcher is None:
+        started = time.monotonic()
+        pred = await _apost_json("/predict", payload, timeout_s)
+        ml_deadline.predict_latency.record(time.monotonic() - started)
+        return pred
+    return await asyncio.wait_for(asyncio.wrap_future(batcher.submit(payload)), timeout_s)
+
+
+def _hedge_after() -> Optional[float]:
+    # A batched /predict already shares one request; hedging it would double the batch.
+    if get_predict_batcher(_send_predict_batch) is not None:
+        return None
+    return hedge_delay_s()
+
+
+def _call(fn, timeout_s: float, deadline: Deadline, hedge_after: Optional[float] = None):
+    """fn(), bounded by ``timeout_s`` on the call pool when a deadline or hedging applies."""
+    if deadline.budget_s is None and hedge_after is None:
+        return fn()
+    return run_bounded(fn, timeout_s, hedge_after)
+
+
+async def _acall(make_coro, timeout_s: float, deadline: Deadline, hedge_after: Optional[float] = None):
+    if deadline.budget_s is None and hedge_after is None:
+        return await make_coro()
+    return await arun_bounded(make_coro, timeout_s, hedge_after)
+
+
+def _merge_chat(pred: Dict[str, Any], chat: Dict[str, Any]) -> Dict[str, Any]:
+    """/predict result overlaid with /chat's; a crisis flag from either survives (and keeps it out of the cache)."""
+    merged = {**pred, **chat}
+    if pred.get("crisis") or chat.get("crisis"):
+        merged["crisis"] = True
+    return merged
+
+
+def _out_of_budget(deadline: Deadline, what: str, best: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    ml_deadline.count("deadline_exceeded")
+    logger.warning(f"ML reply deadline ({deadline.budget_s}s) reached before {what}; "
+                   f"{'using /predict reply' if best else 'using local fallback'}")
+    return best
+
+
+# Retry policy shared by predict() and apredict(): exponential backoff
+# 100ms, 200ms, 400ms, ... capped at 800ms.
+_MAX_RETRIES = 4
+_BASE_DELAY_MS = 100
+_MAX_DELAY_MS = 800
+
+# Transient errors (connect/timeout/reset or non-2xx status) are retried; a bad
+# response or anything unexpected is not.
+_TRANSIENT_ERRORS = (OSError, FutureTimeoutError, asyncio.TimeoutError, http.client.HTTPException)
+_BAD_RESPONSE_ERRORS = (ValueError, json.JSONDecodeError)
 
 
-def predict(message: str, conversation_id: int = None, timeout_s: float = 8.0) -> Optional[Dict[str, Any]]:
+# The decisions below are shared by _predict_with_retries and
+# _apredict_with_retries so the sync and async paths cannot drift apart; the
+# loops themselves only do the I/O and the sleeping.
+
+def _attempt_timeout(attempt: int, breaker, deadline: Deadline, timeout_s: float,
+                     best: Optional[Dict[str, Any]]) -> Optional[float]:
+    """Timeout for this /predict attempt, or None to stop and return ``best``."""
+    if attempt > 0 and not breaker.allow():
+        logger.warning("ML circuit breaker opened; giving up after %d attempts", attempt)
+        return None
+    attempt_timeout = deadline.cap(timeout_s)
+    if attempt_timeout < MIN_ATTEMPT_S:
+        _out_of_budget(deadline, "/predict", best)
+        return None
+    return attempt_timeout
+
+
+def _accept_prediction(pred: Dict[str, Any], breaker) -> Dict[str, Any]:
+    breaker.record_success()
+    pred.setdefault("reply", _build_reply(pred))
+    return pred
+
+
+def _chat_timeout(deadline: Deadline, timeout_s: float, pred: Dict[str, Any]) -> Optional[float]:
+    """Timeout for the /chat call, or None when the budget cannot cover one."""
+    chat_timeout = deadline.cap(timeout_s)
+    if chat_timeout < MIN_ATTEMPT_S:
+        _out_of_budget(deadline, "/chat", pred)
+        return None
+    return chat_timeout
+
+
+def _chat_outcome(pred: Dict[str, Any], chat: Any, attempt: int, message: str):
+    """(result, complete) once /chat returned; an empty /chat reply keeps the /predict one."""
+    if isinstance(chat, dict) and str(chat.get("reply", "")).strip():
+        if attempt > 0:
+            logger.info(f"ML chat succeeded after {attempt} retries (message: {message[:50]}...)")
+        return _merge_chat(pred, chat), True
+    return pred, False
+
+
+def _retry_delay(attempt: int, breaker, deadline: Deadline, error: BaseException,
+                 best: Optional[Dict[str, Any]]) -> Optional[float]:
+    """Seconds to back off after a transient failure, or None when there is no retry left."""
+    breaker.record_failure()
+    if attempt >= _MAX_RETRIES - 1:
+        logger.error(f"ML prediction failed after {_MAX_RETRIES} attempts (final error: {type(error).__name__})")
+        return None
+    delay_ms = min(_BASE_DELAY_MS * (2 ** attempt), _MAX_DELAY_MS)
+    if deadline.expired(delay_ms / 1000.0 + MIN_ATTEMPT_S):
+        _out_of_budget(deadline, "a retry", best)
+        return None
+    logger.warning(f"ML prediction failed (attempt {attempt + 1}/{_MAX_RETRIES}): {type(error).__name__}. Retrying in {delay_ms}ms...")
+    return delay_ms / 1000.0
+
+
+def _give_up(breaker, error: BaseException) -> None:
+    """A failure that is not worth retrying."""
+    breaker.record_failure()
+    if isinstance(error, _BAD_RESPONSE_ERRORS):
+        logger.error(f"ML prediction failed with invalid JSON response: {error}")
+    else:
+        logger.exception(f"ML prediction failed with unexpected error: {error}")
+
+
+def predict(message: str, conversation_id: int = None, timeout_s: float = 8.0,
+            deadline_s: Optional[float] = None, context: Optional[list] = None) -> Optional[Dict[str, Any]]:
     """
     Call mhchat-ml /predict for intent + KB, then /chat for combined RAG response.
 
+    ``timeout_s`` caps each request; ``deadline_s`` (default
+    MHCHAT_ML_DEADLINE_S, 0 = none) bounds the whole call including retries,
+    backoff and /chat. See chat/ml_deadline.py. ``context`` skips the DB
+    lookup when the caller has it.
+
     Returns:
         Dict with intent, crisis, kb_hits, reply, summary, web_highlights, sources
-        or None on failure.
+        or None on failure, once the deadline passed without a /predict answer,
+        or while the circuit breaker is open.
+    """
+    deadline = Deadline.from_settings(deadline_s)
+    if context is None:
+        context = _fetch_context(conversation_id)
+    payload = {"message": message, "context": context}
+
+    # Identical message + context -> reuse a recent non-crisis result. Looked
+    # up before the breaker: a hit calls nothing, so it must not take the
+    # half-open trial.
+    cache = get_ml_response_cache()
+    cache_key = prediction_cache_key(message, context) if cache is not None else None
+    if cache_key is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # Health is probed in the background; an open breaker skips the service
+    # so the caller falls back right away.
+    ensure_health_prober()
+    breaker = get_ml_breaker()
+    if not breaker.allow():
+        logger.debug("ML circuit breaker open; using local fallback")
+        return None
+
+    result, complete = _predict_with_retries(payload, breaker, timeout_s, deadline)
+    # only cache full answers: a /predict-only reply (/chat failed or ran out
+    # of time) should not stand in for the real one for the whole TTL
+    if cache_key is not None and complete:
+        cache.put(cache_key, result)
+    return result
+
+
+def _predict_with_retries(payload: dict, breaker, timeout_s: float, deadline: Deadline):
+    """(result, complete); complete is True only when /chat answered."""
+    message = payload["message"]
+    best = None  # /predict answer whose /chat failed: still a better reply than the local one
+
+    for attempt in range(_MAX_RETRIES):
+        attempt_timeout = _attempt_timeout(attempt, breaker, deadline, timeout_s, best)
+        if attempt_timeout is None:
+            return best, False
+        try:
+            pred = _call(lambda: _post_predict(payload, attempt_timeout), attempt_timeout, deadline, _hedge_after())
+            if isinstance(pred, dict):
+                best = _accept_prediction(pred, breaker)
+                chat_timeout = _chat_timeout(deadline, timeout_s, pred)
+                if chat_timeout is None:
+                    return pred, False
+                chat_payload = {**payload, "fallback_hint": pred.get("reply", "")}
+                try:
+                    chat = _call(lambda: _post_json("/chat", chat_payload, chat_timeout), chat_timeout, deadline)
+                except DeadlineExceeded:
+                    return _out_of_budget(deadline, "/chat answered", pred), False
+                return _chat_outcome(pred, chat, attempt, message)
+
+        except _TRANSIENT_ERRORS as e:
+            delay = _retry_delay(attempt, breaker, deadline, e, best)
+            if delay is None:
+                break
+            time.sleep(delay)
+        except Exception as e:
+            _give_up(breaker, e)
+            break
+
+    return best, False
+
+
+async def _apost_json(path: str, payload: dict, timeout_s: float) -> Optional[Dict[str, Any]]:
+    client = get_async_ml_client()
+    codec = get_wire_codec()
+    body, headers = codec.encode(payload)
+    resp = await client.request("POST", path, body=body, headers=headers, timeout_s=timeout_s)
+    if codec.rejected(resp.status):
+        body, headers = codec.encode(payload)
+        resp = await client.request("POST", path, body=body, headers=headers, timeout_s=timeout_s)
+    if not 200 <= resp.status < 300:
+        raise HTTPStatusError(resp.status, client.url(path), resp.body)
+    parsed = codec.decode(resp.headers, resp.body)
+    return parsed if isinstance(parsed, dict) else None
+
+
+async def apredict(message: str, conversation_id: int = None, timeout_s: float = 8.0,
+                   context: Optional[list] = None, on_delta=None,
+                   deadline_s: Optional[float] = None) -> Optional[Dict[str, Any]]:
     """
-    base_url = os.environ.get("MHCHAT_ML_API_BASE", "http://127.0.0.1:8001").rstrip("/")
-    predict_url = f"{base_url}/predict"
-    chat_url = f"{base_url}/chat"
+    asyncio version of predict() for the WebSocket path: same calls, retries,
+    circuit breaker and return value, but waits on the event loop instead of
+    holding a thread. ``context`` skips the DB lookup when the caller has it.
 
-    # Quick health check for visibility, but do not skip prediction attempts.
-    if not is_ml_service_healthy():
-        logger.warning("ML service health check failed; attempting prediction anyway")
+    With ``on_delta`` (an async callable) /chat is requested as a stream and
+    ``await on_delta(text)`` runs for each piece of the reply as it arrives;
+    the returned dict still carries the complete reply.
+    """
+    deadline = Deadline.from_settings(deadline_s)
+    from asgiref.sync import sync_to_async
 
-    context = _fetch_context(conversation_id)
+    if context is None:
+        context = await sync_to_async(_fetch_context)(conversation_id)
     payload = {"message": message, "context": context}
-    
-    # Retry configuration: exponential backoff
-    max_retries = 4
-    base_delay_ms = 100
-    max_delay_ms = 800
-    
-    for attempt in range(max_retries):
+
+    cache = get_ml_response_cache()
+    cache_key = prediction_cache_key(message, context) if cache is not None else None
+    if cache_key is not None:
+        cached = await sync_to_async(cache.get)(cache_key) if cache.blocking else cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    ensure_health_prober()
+    breaker = get_ml_breaker()
+    if not breaker.allow():
+        logger.debug("ML circuit breaker open; using local fallback")
+        return None
+
+    result, complete = await _apredict_with_retries(payload, breaker, timeout_s, deadline, on_delta)
+    if cache_key is not None and complete:
+        if cache.blocking:
+            await sync_to_async(cache.put)(cache_key, result)
+        else:
+            cache.put(cache_key, result)
+    return result
+
+
+async def _apredict_with_retries(payload: dict, breaker, timeout_s: float, deadline: Deadline, on_delta=None):
+    """(result, complete), as _predict_with_retries."""
+    message = payload["message"]
+    best = None
+
+    for attempt in range(_MAX_RETRIES):
+        attempt_timeout = _attempt_timeout(attempt, breaker, deadline, timeout_s, best)
+        if attempt_timeout is None:
+            return best, False
         try:
-            pred = _post_json(predict_url, payload, timeout_s)
+            pred = await _acall(lambda: _apost_predict(payload, attempt_timeout), attempt_timeout, deadline, _hedge_after())
             if isinstance(pred, dict):
-                pred.setdefault("reply", _build_reply(pred))
-                fallback_hint = pred.get("reply", "")
-
-                chat_payload = {**payload, "fallback_hint": fallback_hint}
-                chat = _post_json(chat_url, chat_payload, timeout_s)
-                if isinstance(chat, dict) and str(chat.get("reply", "")).strip():
-                    merged = {**pred, **chat}
-                    if attempt > 0:
-                        logger.info(f"ML chat succeeded after {attempt} retries (message: {message[:50]}...)")
-                    return merged
-
-                return pred
-                    
-        except (urllib.error.URLError, socket.timeout) as e:
-            # Transient error - try again
-            if attempt < max_retries - 1:
-                # Calculate exponential backoff: 100ms, 200ms, 400ms, ...
-                delay_ms = min(base_delay_ms * (2 ** attempt), max_delay_ms)
-                logger.warning(f"ML prediction failed (attempt {attempt + 1}/{max_retries}): {type(e).__name__}. Retrying in {delay_ms}ms...")
-                time.sleep(delay_ms / 1000.0)
-            else:
-                logger.error(f"ML prediction failed after {max_retries} attempts (final error: {type(e).__name__})")
-                
-        except (ValueError, json.JSONDecodeError) as e:
-            # Bad response - don't retry
-            logger.error(f"ML prediction failed with invalid JSON response: {e}")
-            return None
+                best = _accept_prediction(pred, breaker)
+                chat_timeout = _chat_timeout(deadline, timeout_s, pred)
+                if chat_timeout is None:
+                    return pred, False
+                chat_payload = {**payload, "fallback_hint": pred.get("reply", "")}
+                try:
+                    if on_delta is None:
+                        make_chat = lambda: _apost_json("/chat", chat_payload, chat_timeout)
+                        chat = await _acall(make_chat, chat_timeout, deadline)
+                    else:
+                        chat = await _astream_chat_within(deadline, chat_payload, timeout_s, on_delta)
+                except DeadlineExceeded:
+                    return _out_of_budget(deadline, "/chat answered", pred), False
+                return _chat_outcome(pred, chat, attempt, message)
+
+        except _TRANSIENT_ERRORS as e:
+            delay = _retry_delay(attempt, breaker, deadline, e, best)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
         except Exception as e:
-            # Unexpected error - don't retry
-            logger.exception(f"ML prediction failed with unexpected error: {e}")
+            _give_up(breaker, e)
+            break
+
+    return best, False
+
+
+async def _iter_stream_events(chunks):
+    """
+    Parse a streamed /chat body into JSON events. Accepts Server-Sent Events
+    (``data: {...}`` blocks, ``data: [DONE]`` ends the stream) and NDJSON (one
+    JSON object per line).
+    """
+    buf = b""
+    data_lines = []
+    async for chunk in chunks:
+        buf += chunk
+        while True:
+            nl = buf.find(b"\n")
+            if nl < 0:
+                break
+            line, buf = buf[:nl].rstrip(b"\r").decode("utf-8"), buf[nl + 1:]
+            if not line:
+                if data_lines:
+                    data, data_lines = "\n".join(data_lines), []
+                    if data.strip() == "[DONE]":
+                        return
+                    yield json.loads(data)
+            elif line.startswith("data:"):
+                data_lines.append(line[5:].lstrip(" "))
+            elif line.startswith(("{", "[")):
+                yield json.loads(line)  # NDJSON
+            # other SSE fields (event:, id:, retry:, comments) carry nothing we use
+    if data_lines and "\n".join(data_lines).strip() != "[DONE]":
+        yield json.loads("\n".join(data_lines))
+
+
+async def _astream_chat_within(deadline: Deadline, chat_payload: dict, timeout_s: float, on_delta) -> Optional[Dict[str, Any]]:
+    """
+    _astream_chat() where the deadline only bounds the wait for the first
+    delta (DeadlineExceeded if none came). Once the user is watching the reply
+    arrive it is not cut off; from then on ``timeout_s`` bounds each gap.
+    """
+    started = asyncio.Event()
+
+    async def deliver(text):
+        started.set()
+        await on_delta(text)
+
+    task = asyncio.ensure_future(_astream_chat(chat_payload, timeout_s, deliver))
+    waiter = asyncio.ensure_future(started.wait())
+    try:
+        budget = deadline.remaining() if deadline.budget_s is not None else None
+        await asyncio.wait({task, waiter}, timeout=budget, return_when=asyncio.FIRST_COMPLETED)
+        if not task.done() and not started.is_set():
+            raise DeadlineExceeded(f"no /chat delta within {budget:.3f}s")
+        return await task
+    finally:
+        waiter.cancel()
+        task.cancel()
+
+
+async def _astream_chat(chat_payload: dict, timeout_s: float, on_delta) -> Optional[Dict[str, Any]]:
+    """
+    Streamed /chat. Events are {"delta": "..."} pieces, optionally followed by
+    a final object (e.g. {"done": true, "reply": ..., "sources": [...]}) whose
+    keys are merged into the result. A plain JSON response is accepted too.
+
+    Failures before the first delta are raised (the caller retries); after it
+    the stream is abandoned and None returned, so nothing is sent twice and the
+    caller falls back to the /predict reply.
+    """
+    client = get_async_ml_client()
+    parts = []
+    final = {}
+    async with client.stream(
+        "POST", "/chat",
+        body=json.dumps({**chat_payload, "stream": True}).encode("utf-8"),
+        headers={"Content-Type": "application/json", "Accept": "text/event-stream, application/x-ndjson"},
+        timeout_s=timeout_s,
+    ) as resp:
+        if not 200 <= resp.status < 300:
+            raise HTTPStatusError(resp.status, client.url("/chat"), await resp.read())
+        if resp.headers.get("content-type", "").startswith("application/json"):
+            parsed = json.loads((await resp.read()).decode("utf-8"))
+            if isinstance(parsed, dict) and parsed.get("reply"):
+                await on_delta(str(parsed["reply"]))
+            return parsed if isinstance(parsed, dict) else None
+        try:
+            async for event in _iter_stream_events(resp.chunks()):
+                if not isinstance(event, dict):
+                    continue
+                delta = event.get("delta")
+                if delta:
+                    parts.append(str(delta))
+                    await on_delta(str(delta))
+                if event.get("done"):
+                    final = {k: v for k, v in event.items() if k not in ("delta", "done")}
+        except (OSError, asyncio.TimeoutError, http.client.HTTPException, ValueError, EOFError) as e:
+            if not parts:
+                raise
+            logger.warning(f"ML chat stream broke after {len(parts)} deltas ({type(e).__name__}); using /predict reply")
             return None
-    
-    return None
+    return {**final, "reply": final.get("reply") or "".join(parts)}
@@ -0,0 +1,217 @@
+# chat/ml_cache.py
+"""
+Response cache for mhchat-ml predictions.
+
+predict()/apredict() results are cached under a digest of the normalized
+message plus the context window sent with it, so the same short message in the
+same (often empty) context skips both round trips. Results flagged
+crisis=True are never cached, and the client only stores complete results:
+a /predict-only reply (after /chat failed or the deadline ran out) is not.
+
+Backends (MHCHAT_ML_CACHE_BACKEND):
+    local   per-process LRU with TTL, capped by entries and bytes (default)
+    django  Django's cache framework (MHCHAT_ML_CACHE_ALIAS, default "default"),
+            shared by all workers when that cache is Redis/Memcached
+    off     no caching
+
+Other settings: MHCHAT_ML_CACHE_TTL_S (120), MHCHAT_ML_CACHE_MAX_ENTRIES (2048),
+MHCHAT_ML_CACHE_MAX_BYTES (16 MiB, local only). Values are stored as JSON, so
+every hit is a fresh copy. ml_cache_stats() reports hits, misses and hit rate.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from .ml_http import ml_setting
+
+logger = logging.getLogger(__name__)
+
+
+def prediction_cache_key(message, context):
+    """Digest of the normalized message and its context window."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(" ".join((message or "").lower().split()).encode("utf-8"))
+    h.update(b"\x00")
+    h.update(json.dumps(context or [], sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _cacheable(result):
+    return isinstance(result, dict) and not result.get("crisis")
+
+
+class _StatsMixin:
+    def _init_stats(self):
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "skipped_crisis": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = out["hits"] / lookups if lookups else 0.0
+        out["backend"] = self.backend
+        return out
+
+
+class LocalResponseCache(_StatsMixin):
+    """Thread-safe LRU with per-entry TTL and entry/byte caps."""
+
+    backend = "local"
+    blocking = False
+
+    def __init__(self, max_entries=2048, max_bytes=16 * 1024 * 1024, ttl_s=120.0, clock=time.monotonic):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.ttl_s = float(ttl_s)
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (expires_at, blob)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._init_stats()
+        self._stats.update(evictions=0, expired=0)
+
+    def get(self, key):
+        now = self._clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._data[key]
+                self._bytes -= len(entry[1])
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            blob = entry[1]
+        return json.loads(blob)
+
+    def put(self, key, result):
+        if not _cacheable(result):
+            if isinstance(result, dict):
+                self._count("skipped_crisis")
+            return
+        try:
+            blob = json.dumps(result, separators=(",", ":")).encode("utf-8")
+        except (TypeError, ValueError):
+            self._count("errors")
+            return
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._data[key] = (self._clock() + self.ttl_s, blob)
+            self._bytes += len(blob)
+            self._stats["stores"] += 1
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        out = super().stats()
+        with self._lock:
+            out.update(entries=len(self._data), bytes=self._bytes, max_entries=self.max_entries, max_bytes=self.max_bytes)
+        return out
+
+
+class DjangoResponseCache(_StatsMixin):
+    """Django cache framework backend (shared across workers with Redis/Memcached)."""
+
+    backend = "django"
+    blocking = True  # network cache: async callers go through sync_to_async
+    key_prefix = "mhchat-ml:"
+
+    def __init__(self, alias="default", ttl_s=120.0):
+        from django.core.cache import caches
+
+        self._cache = caches[alias]
+        self.ttl_s = float(ttl_s)
+        self._lock = threading.Lock()
+        self._init_stats()
+
+    def get(self, key):
+        try:
+            blob = self._cache.get(self.key_prefix + key)
+        except Exception:
+            logger.exception("ML response cache get failed")
+            self._count("errors")
+            return None
+        if blob is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return json.loads(blob)
+
+    def put(self, key, result):
+        if not _cacheable(result):
+            if isinstance(result, dict):
+                self._count("skipped_crisis")
+            return
+        try:
+            self._cache.set(self.key_prefix + key, json.dumps(result, separators=(",", ":")), timeout=self.ttl_s)
+        except Exception:
+            logger.exception("ML response cache set failed")
+            self._count("errors")
+            return
+        self._count("stores")
+
+    def clear(self):
+        pass  # shared cache: entries expire by TTL
+
+
+_cache = None
+_cache_key = None
+_cache_lock = threading.Lock()
+
+
+def get_ml_response_cache():
+    """The configured response cache, or None when MHCHAT_ML_CACHE_BACKEND is "off"."""
+    global _cache, _cache_key
+    backend = str(ml_setting("MHCHAT_ML_CACHE_BACKEND", "local")).lower()
+    if backend in ("off", "none", ""):
+        return None
+    key = (
+        backend,
+        float(ml_setting("MHCHAT_ML_CACHE_TTL_S", 120.0)),
+        int(ml_setting("MHCHAT_ML_CACHE_MAX_ENTRIES", 2048)),
+        int(ml_setting("MHCHAT_ML_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+        str(ml_setting("MHCHAT_ML_CACHE_ALIAS", "default")),
+        str(ml_setting("MHCHAT_ML_API_BASE", "")),  # another service, other answers
+    )
+    if _cache is not None and _cache_key == key:
+        return _cache
+    with _cache_lock:
+        if _cache is None or _cache_key != key:
+            if backend == "django":
+                _cache = DjangoResponseCache(alias=key[4], ttl_s=key[1])
+            else:
+                _cache = LocalResponseCache(max_entries=key[2], max_bytes=key[3], ttl_s=key[1])
+            _cache_key = key
+        return _cache
+
+
+def ml_cache_stats():
+    cache = _cache
+    return cache.stats() if cache is not None else {}
+
+
+def reset_ml_response_cache():
+    global _cache, _cache_key
+    with _cache_lock:
+        _cache, _cache_key = None, None
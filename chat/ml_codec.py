@@ -0,0 +1,131 @@
+# chat/ml_codec.py
+"""
+Wire format negotiation for mhchat-ml request/response bodies.
+
+Every request advertises ``Accept: application/msgpack, application/json`` and
+``Accept-Encoding: gzip``; responses are decoded by their Content-Type and
+Content-Encoding. Request bodies stay JSON until the service has answered in
+MessagePack (so it is known to understand it); from then on they are sent as
+MessagePack too. A 415 for a MessagePack body switches the process back to
+JSON and the request is resent as JSON.
+
+MHCHAT_ML_WIRE_FORMAT: "auto" (default) negotiates as above, "json" never
+offers MessagePack. MessagePack needs the optional ``msgpack`` package;
+without it everything is JSON. ml_wire_stats() counts bytes in and out per format.
+"""
+import gzip
+import json
+import threading
+
+from .ml_http import ml_setting
+
+try:
+    import msgpack
+except ImportError:  # optional: JSON only
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+_MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+
+
+class WireCodec:
+    def __init__(self, mode="auto"):
+        self.offer_msgpack = msgpack is not None and mode != "json"
+        self.send_msgpack = False  # set once the service has answered in msgpack
+        self._lock = threading.Lock()
+        self._stats = {
+            "sent_json": 0, "sent_msgpack": 0, "bytes_out": 0,
+            "received_json": 0, "received_msgpack": 0, "received_gzip": 0, "bytes_in": 0, "bytes_in_wire": 0,
+            "fallbacks": 0,
+        }
+
+    def encode(self, payload):
+        """(body, headers) for one request."""
+        if self.send_msgpack:
+            body, content_type, kind = msgpack.packb(payload, use_bin_type=True), MSGPACK, "sent_msgpack"
+        else:
+            body, content_type, kind = json.dumps(payload).encode("utf-8"), JSON, "sent_json"
+        with self._lock:
+            self._stats[kind] += 1
+            self._stats["bytes_out"] += len(body)
+        headers = {
+            "Content-Type": content_type,
+            "Accept": f"{MSGPACK}, {JSON};q=0.9" if self.offer_msgpack else JSON,
+            "Accept-Encoding": "gzip",
+        }
+        return body, headers
+
+    def decode(self, headers, body):
+        """Parsed response body (dict/list/...) according to its headers."""
+        wire_len = len(body)
+        if (headers.get("content-encoding") or "").lower() == "gzip":
+            try:
+                body = gzip.decompress(body)
+            except (OSError, EOFError) as exc:
+                raise ValueError(f"bad gzip body: {exc}") from None
+            gzipped = True
+        else:
+            gzipped = False
+        content_type = (headers.get("content-type") or JSON).split(";", 1)[0].strip().lower()
+        if content_type in _MSGPACK_TYPES:
+            if msgpack is None:
+                raise ValueError("mhchat-ml answered in msgpack but msgpack is not installed")
+            parsed, kind = msgpack.unpackb(body, raw=False), "received_msgpack"
+            if self.offer_msgpack and not self.send_msgpack:
+                self.send_msgpack = True
+        else:
+            parsed, kind = json.loads(body.decode("utf-8")), "received_json"
+        with self._lock:
+            self._stats[kind] += 1
+            self._stats["received_gzip"] += gzipped
+            self._stats["bytes_in"] += len(body)
+            self._stats["bytes_in_wire"] += wire_len
+        return parsed
+
+    def rejected(self, status):
+        """True if a msgpack request body was refused (415): go back to JSON and resend."""
+        if status != 415 or not self.send_msgpack:
+            return False
+        self.send_msgpack = False
+        self.offer_msgpack = False
+        with self._lock:
+            self._stats["fallbacks"] += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        out.update(offer_msgpack=self.offer_msgpack, send_msgpack=self.send_msgpack)
+        return out
+
+
+_codec = None
+_codec_key = None
+_codec_lock = threading.Lock()
+
+
+def get_wire_codec():
+    global _codec, _codec_key
+    key = (
+        str(ml_setting("MHCHAT_ML_WIRE_FORMAT", "auto")).lower(),
+        str(ml_setting("MHCHAT_ML_API_BASE", "")),  # negotiated per service
+    )
+    if _codec is not None and _codec_key == key:
+        return _codec
+    with _codec_lock:
+        if _codec is None or _codec_key != key:
+            _codec = WireCodec(mode=key[0])
+            _codec_key = key
+        return _codec
+
+
+def ml_wire_stats():
+    codec = _codec
+    return codec.stats() if codec is not None else {}
+
+
+def reset_wire_codec():
+    global _codec, _codec_key
+    with _codec_lock:
+        _codec, _codec_key = None, None
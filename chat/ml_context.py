@@ -0,0 +1,250 @@
+# chat/ml_context.py
+"""
+Per-conversation context window for mhchat-ml requests.
+
+ml_brain_client sends the last MHCHAT_ML_CONTEXT_WINDOW (5) messages of the
+conversation with every prediction. Instead of querying them each time, a
+ring buffer of ``{"sender", "text"}`` entries is kept per conversation and
+updated from Message post_save/post_delete, so an active chat builds its
+context without touching the database. Conversations are kept in an LRU
+(MHCHAT_ML_CONTEXT_CONVERSATIONS; default 0, off); a miss loads the window
+with one query and caches it.
+
+The cache is per process and only sees signals from its own process, so it is
+off by default. With several daphne workers, or run_workers next to the web
+process, a message saved elsewhere is missing from this process's window;
+MHCHAT_ML_CONTEXT_TTL_S bounds how long a loaded window is trusted (0 = until
+evicted, safe only with a single process).
+
+Writes that skip model signals (bulk_create, QuerySet.update, raw SQL) are not
+seen; call invalidate_conversation_context() after them. A message created
+inside a transaction that later rolls back stays in the window until the
+conversation is evicted or invalidated.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .ml_http import ml_setting
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationContextCache:
+    """
+    LRU of conversation id -> (loaded_at, deque of (message_id, sender, text),
+    oldest first). With ``ttl_s`` a window is reloaded that long after it was
+    loaded, whatever was appended since.
+    """
+
+    def __init__(self, max_conversations=1024, window=5, ttl_s=0.0, clock=time.monotonic):
+        self.max_conversations = max(1, int(max_conversations))
+        self.window = max(1, int(window))
+        self.ttl_s = max(0.0, float(ttl_s))
+        self._clock = clock
+        self._data = OrderedDict()
+        self._loading = {}  # conversation id -> [loaders, changed while loading]
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "fills": 0, "stale_fills": 0, "appends": 0, "invalidations": 0, "evictions": 0, "expired": 0}
+
+    def get(self, conversation_id):
+        """Cached window as a fresh list of dicts, or None on a miss."""
+        with self._lock:
+            entry = self._data.get(conversation_id)
+            if entry is not None and self.ttl_s and self._clock() - entry[0] > self.ttl_s:
+                del self._data[conversation_id]
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            ring = entry[1]
+            self._data.move_to_end(conversation_id)
+            self._stats["hits"] += 1
+            return [{"sender": sender, "text": text} for _, sender, text in ring]
+
+    def load(self, conversation_id, fetch):
+        """
+        Window for ``conversation_id``: cached, or ``fetch()`` (rows of
+        (id, sender, text), oldest first) stored unless the conversation
+        changed while it ran.
+        """
+        cached = self.get(conversation_id)
+        if cached is not None:
+            return cached
+        with self._lock:
+            self._loading.setdefault(conversation_id, [0, False])[0] += 1
+        rows = None
+        try:
+            rows = list(fetch())[-self.window:]
+        finally:
+            with self._lock:
+                state = self._loading[conversation_id]
+                state[0] -= 1
+                if state[0] == 0:
+                    del self._loading[conversation_id]
+                if rows is not None:
+                    if state[1]:
+                        self._stats["stale_fills"] += 1  # a message landed mid-query; next call reloads
+                    else:
+                        self._store(conversation_id, deque(rows, maxlen=self.window))
+                        self._stats["fills"] += 1
+        return [{"sender": sender, "text": text} for _, sender, text in rows]
+
+    def _store(self, conversation_id, ring):
+        self._data[conversation_id] = (self._clock(), ring)
+        self._data.move_to_end(conversation_id)
+        while len(self._data) > self.max_conversations:
+            self._data.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _touch(self, conversation_id):
+        state = self._loading.get(conversation_id)
+        if state is not None:
+            state[1] = True
+
+    def start(self, conversation_id):
+        """A new conversation: known empty, so its first context costs no query."""
+        with self._lock:
+            self._touch(conversation_id)
+            self._store(conversation_id, deque(maxlen=self.window))
+
+    def message_saved(self, conversation_id, message_id, sender, text):
+        with self._lock:
+            self._touch(conversation_id)
+            entry = self._data.get(conversation_id)
+            if entry is None:
+                return
+            ring = entry[1]
+            for i, (mid, _, _) in enumerate(ring):
+                if mid == message_id:
+                    ring[i] = (message_id, sender, text)
+                    return
+            if ring and ring[-1][0] > message_id:
+                # older message (e.g. created with an explicit id): order unknown, reload
+                del self._data[conversation_id]
+                self._stats["invalidations"] += 1
+                return
+            ring.append((message_id, sender, text))
+            self._stats["appends"] += 1
+
+    def invalidate(self, conversation_id):
+        with self._lock:
+            self._touch(conversation_id)
+            if self._data.pop(conversation_id, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update(
+                conversations=len(self._data), max_conversations=self.max_conversations, window=self.window, ttl_s=self.ttl_s,
+            )
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = out["hits"] / lookups if lookups else 0.0
+        return out
+
+
+_cache = None
+_cache_key = None
+_cache_lock = threading.Lock()
+
+
+def get_context_cache():
+    """The process cache, or None when MHCHAT_ML_CONTEXT_CONVERSATIONS is 0 (the default)."""
+    global _cache, _cache_key
+    key = (
+        int(ml_setting("MHCHAT_ML_CONTEXT_CONVERSATIONS", 0)),
+        int(ml_setting("MHCHAT_ML_CONTEXT_WINDOW", 5)),
+        float(ml_setting("MHCHAT_ML_CONTEXT_TTL_S", 0.0)),
+    )
+    if key[0] <= 0:
+        return None
+    if _cache is not None and _cache_key == key:
+        return _cache
+    with _cache_lock:
+        if _cache is None or _cache_key != key:
+            _cache = ConversationContextCache(max_conversations=key[0], window=key[1], ttl_s=key[2])
+            _cache_key = key
+        return _cache
+
+
+def _fetch_rows(conversation_id, window):
+    from .models import Message
+
+    rows = Message.objects.filter(conversation_id=conversation_id).order_by("-created_at", "-id").values_list("id", "sender", "text")[:window]
+    return reversed(list(rows))
+
+
+def conversation_context(conversation_id):
+    """Last MHCHAT_ML_CONTEXT_WINDOW messages as [{"sender", "text"}], oldest first."""
+    cache = get_context_cache()
+    if cache is None:
+        window = int(ml_setting("MHCHAT_ML_CONTEXT_WINDOW", 5))
+        return [{"sender": sender, "text": text} for _, sender, text in _fetch_rows(conversation_id, window)]
+    return cache.load(conversation_id, lambda: _fetch_rows(conversation_id, cache.window))
+
+
+def invalidate_conversation_context(conversation_id=None):
+    """Drop one conversation's window (or all of them) after writes that bypass signals."""
+    cache = _cache
+    if cache is None:
+        return
+    if conversation_id is None:
+        cache.clear()
+    else:
+        cache.invalidate(conversation_id)
+
+
+def ml_context_stats():
+    cache = _cache
+    return cache.stats() if cache is not None else {}
+
+
+def reset_context_cache():
+    global _cache, _cache_key
+    with _cache_lock:
+        _cache, _cache_key = None, None
+
+
+# --- signal receivers (connected in ChatConfig.ready) ---------------------------
+
+def _message_saved(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    cache = _cache
+    if cache is None or raw:
+        return
+    if not created and update_fields is not None and not {"text", "sender"} & set(update_fields):
+        return  # e.g. the pipeline saving nlp_metadata / is_flagged
+    cache.message_saved(instance.conversation_id, instance.id, instance.sender, instance.text)
+
+
+def _message_deleted(sender, instance, **kwargs):
+    # the window must slide back over an older message: reload it next time
+    if _cache is not None:
+        _cache.invalidate(instance.conversation_id)
+
+
+def _conversation_saved(sender, instance, created, raw=False, **kwargs):
+    if _cache is not None and created and not raw:
+        _cache.start(instance.id)
+
+
+def _conversation_deleted(sender, instance, **kwargs):
+    if _cache is not None:
+        _cache.invalidate(instance.id)
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+
+    from .models import Conversation, Message
+
+    post_save.connect(_message_saved, sender=Message, dispatch_uid="mhchat-ml-context-save")
+    post_delete.connect(_message_deleted, sender=Message, dispatch_uid="mhchat-ml-context-delete")
+    post_save.connect(_conversation_saved, sender=Conversation, dispatch_uid="mhchat-ml-context-conv-save")
+    post_delete.connect(_conversation_deleted, sender=Conversation, dispatch_uid="mhchat-ml-context-conv-delete")
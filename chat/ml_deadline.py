@@ -0,0 +1,194 @@
+# chat/ml_deadline.py
+"""
+Reply budget and hedged requests for mhchat-ml calls.
+
+A Deadline is the time left for one user message (MHCHAT_ML_DEADLINE_S,
+default 3s; 0 = no overall budget). predict()/apredict() derive every
+per-attempt timeout, backoff sleep and the /chat timeout from it and give up
+(returning None, so the caller uses the local NLU reply) when it runs out.
+
+Hedging (MHCHAT_ML_HEDGE=1): if a /predict attempt has not answered after the
+recent p95 /predict latency (MHCHAT_ML_HEDGE_DELAY_MS until enough samples
+exist), an identical second request is sent and whichever answers first wins.
+
+In the sync path bounded calls run on a small thread pool
+(MHCHAT_ML_CALL_THREADS) so a slow or trickling response can never hold the
+worker past the deadline; the async path uses asyncio.wait.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from .ml_http import ml_setting
+
+# Below this there is no point starting another request.
+MIN_ATTEMPT_S = 0.05
+
+
+class DeadlineExceeded(FutureTimeoutError):
+    """The reply budget ran out."""
+
+
+class Deadline:
+    def __init__(self, budget_s=None, clock=time.monotonic):
+        self._clock = clock
+        self.budget_s = budget_s if budget_s and budget_s > 0 else None
+        self.expires_at = clock() + self.budget_s if self.budget_s else None
+
+    @classmethod
+    def from_settings(cls, budget_s=None):
+        if budget_s is None:
+            budget_s = float(ml_setting("MHCHAT_ML_DEADLINE_S", 3.0))
+        return cls(budget_s)
+
+    def remaining(self):
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - self._clock())
+
+    def expired(self, margin_s=0.0):
+        return self.remaining() <= margin_s
+
+    def cap(self, timeout_s):
+        """``timeout_s`` shortened to the time left."""
+        return min(timeout_s, self.remaining())
+
+
+class LatencyTracker:
+    """Recent /predict latencies (seconds) for the hedge delay."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(round(q / 100.0 * (len(samples) - 1))))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+predict_latency = LatencyTracker()
+_stats = {"hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0}
+_stats_lock = threading.Lock()
+
+
+def count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def hedge_delay_s():
+    """Seconds to wait before hedging a /predict, or None when hedging is off."""
+    if str(ml_setting("MHCHAT_ML_HEDGE", "0")).lower() not in ("1", "true", "yes"):
+        return None
+    if len(predict_latency) >= int(ml_setting("MHCHAT_ML_HEDGE_MIN_SAMPLES", 20)):
+        return predict_latency.percentile(95)
+    return float(ml_setting("MHCHAT_ML_HEDGE_DELAY_MS", 300.0)) / 1000.0
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _call_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=int(ml_setting("MHCHAT_ML_CALL_THREADS", 64)), thread_name_prefix="mhchat-ml-call",
+                )
+    return _pool
+
+
+def run_bounded(fn, timeout_s, hedge_after_s=None):
+    """
+    Return fn() if it finishes within ``timeout_s`` (else DeadlineExceeded).
+    With ``hedge_after_s``, a second fn() starts if the first is still running
+    by then; the first success wins and a failure only counts once both failed.
+    """
+    started = time.monotonic()
+    pool = _call_pool()
+    first = pool.submit(fn)
+    pending = {first}
+    if hedge_after_s is not None and hedge_after_s < timeout_s:
+        done, _ = wait(pending, timeout=hedge_after_s)
+        if not done:
+            pending.add(pool.submit(fn))
+            count("hedges")
+    error = None
+    while pending:
+        remaining = timeout_s - (time.monotonic() - started)
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                if fut is not first:
+                    count("hedge_wins")
+                return fut.result()
+            error = fut.exception()
+    if error is not None and not pending:
+        raise error
+    raise DeadlineExceeded(f"no answer within {timeout_s:.3f}s")
+
+
+async def arun_bounded(make_coro, timeout_s, hedge_after_s=None):
+    """asyncio counterpart of run_bounded(); losing/unfinished tasks are cancelled."""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    first = asyncio.ensure_future(make_coro())
+    pending = {first}
+    try:
+        if hedge_after_s is not None and hedge_after_s < timeout_s:
+            done, _ = await asyncio.wait(pending, timeout=hedge_after_s)
+            if not done:
+                pending.add(asyncio.ensure_future(make_coro()))
+                count("hedges")
+        error = None
+        while pending:
+            remaining = timeout_s - (loop.time() - started)
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        count("hedge_wins")
+                    return task.result()
+                error = task.exception()
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded(f"no answer within {timeout_s:.3f}s")
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def ml_deadline_stats():
+    with _stats_lock:
+        out = dict(_stats)
+    out["predict_p50_ms"] = (predict_latency.percentile(50) or 0.0) * 1000.0
+    out["predict_p95_ms"] = (predict_latency.percentile(95) or 0.0) * 1000.0
+    out["samples"] = len(predict_latency)
+    return out
+
+
+def reset_ml_deadline_stats():
+    global predict_latency
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+    predict_latency = LatencyTracker()
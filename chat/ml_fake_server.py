@@ -0,0 +1,291 @@
+# chat/ml_fake_server.py
+"""
+Offline stand-in for the mhchat-ml service, with fault injection.
+
+Implements GET /health, POST /predict, /predict_batch and /chat (JSON, or SSE
+when the body has "stream": true) so ml_brain_client and the reply pipeline
+can be load-tested without the real service. Per request it can add latency
+drawn from a distribution and inject faults:
+
+    error      HTTP 503 with a JSON error body
+    reset      close the connection without answering
+    malformed  200 with a truncated body
+    slowloris  200 whose body trickles out one byte every --slowloris-gap-ms
+
+Like the real service it answers in MessagePack when the request's Accept
+header asks for it (unless --no-msgpack) and gzips responses of at least
+--gzip-min-bytes when the client accepts gzip.
+
+Latency specs (milliseconds): "0", "fixed:40", "uniform:10:80",
+"normal:50:15", "lognormal:40:0.6" (median, sigma), "exp:40" (mean).
+
+    python -m chat.ml_fake_server --port 8001 --latency lognormal:40:0.6 \\
+        --chat-latency lognormal:300:0.5 --error-rate 0.02 --malformed-rate 0.01
+
+Used by scripts/load_test_ml.py and chat/test_ml_client.py; no Django needed.
+"""
+import argparse
+import gzip
+import json
+import math
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import msgpack
+except ImportError:  # optional: JSON only
+    msgpack = None
+
+_DISTRIBUTIONS = {
+    "fixed": (1, lambda rnd, ms: ms),
+    "uniform": (2, lambda rnd, lo, hi: rnd.uniform(lo, hi)),
+    "normal": (2, lambda rnd, mean, sd: max(0.0, rnd.gauss(mean, sd))),
+    "lognormal": (2, lambda rnd, median, sigma: rnd.lognormvariate(math.log(max(median, 1e-3)), sigma)),
+    "exp": (1, lambda rnd, mean: rnd.expovariate(1.0 / mean) if mean > 0 else 0.0),
+}
+
+
+def parse_latency(spec):
+    """Latency spec -> (name, params); a bare number means "fixed"."""
+    spec = str(spec or "0").strip()
+    name, _, rest = spec.partition(":")
+    try:
+        if name not in _DISTRIBUTIONS:
+            return "fixed", (float(spec),)
+        params = tuple(float(p) for p in rest.split(":")) if rest else ()
+    except ValueError:
+        raise ValueError(f"Bad latency spec {spec!r}") from None
+    if len(params) != _DISTRIBUTIONS[name][0]:
+        raise ValueError(f"Latency {name!r} takes {_DISTRIBUTIONS[name][0]} parameter(s): {spec!r}")
+    return name, params
+
+
+class FaultProfile:
+    """What the fake service does to each POST. Rates are probabilities in [0, 1]."""
+
+    FAULTS = ("error", "reset", "malformed", "slowloris")
+
+    def __init__(self, latency="0", chat_latency=None, error_rate=0.0, reset_rate=0.0,
+                 malformed_rate=0.0, slowloris_rate=0.0, slowloris_gap_ms=200.0,
+                 crisis_rate=0.0, stream_gap_ms=20.0, batch=True, msgpack=True, gzip_min_bytes=1024,
+                 seed=None):
+        self.latency = parse_latency(latency)
+        self.chat_latency = parse_latency(chat_latency) if chat_latency is not None else self.latency
+        self.rates = {
+            "error": float(error_rate), "reset": float(reset_rate),
+            "malformed": float(malformed_rate), "slowloris": float(slowloris_rate),
+        }
+        if sum(self.rates.values()) > 1.0:
+            raise ValueError("fault rates add up to more than 1")
+        self.slowloris_gap_s = float(slowloris_gap_ms) / 1000.0
+        self.crisis_rate = float(crisis_rate)
+        self.stream_gap_s = float(stream_gap_ms) / 1000.0
+        self.batch = bool(batch)
+        self.msgpack = bool(msgpack)
+        self.gzip_min_bytes = int(gzip_min_bytes)
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "ok": 0, **{fault: 0 for fault in self.FAULTS}}
+
+    def draw(self, path):
+        """(delay_s, fault or None) for one request."""
+        with self._lock:
+            name, params = self.chat_latency if path == "/chat" else self.latency
+            delay_s = _DISTRIBUTIONS[name][1](self._rnd, *params) / 1000.0
+            roll = self._rnd.random()
+            fault = None
+            for candidate in self.FAULTS:
+                roll -= self.rates[candidate]
+                if roll < 0:
+                    fault = candidate
+                    break
+            self.counts["requests"] += 1
+            self.counts[fault or "ok"] += 1
+            return delay_s, fault
+
+    def crisis(self):
+        with self._lock:
+            return self._rnd.random() < self.crisis_rate
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+class FakeMLHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like uvicorn
+    profile = FaultProfile()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload, content_type="application/json"):
+        headers = {}
+        if isinstance(payload, bytes):
+            body = payload
+        elif self._wants_msgpack():
+            body, content_type = msgpack.packb(payload, use_bin_type=True), "application/msgpack"
+        else:
+            body = json.dumps(payload).encode()
+        if "gzip" in (self.headers.get("Accept-Encoding") or "") and len(body) >= self.profile.gzip_min_bytes:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _wants_msgpack(self):
+        return msgpack is not None and self.profile.msgpack and "application/msgpack" in (self.headers.get("Accept") or "")
+
+    def _read_payload(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if (self.headers.get("Content-Type") or "").startswith("application/msgpack"):
+            if msgpack is None or not self.profile.msgpack:
+                raise TypeError("msgpack body not supported")
+            return msgpack.unpackb(raw, raw=False) if raw else {}
+        return json.loads(raw or b"{}")
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"status": "ok"})
+        else:
+            self._send(404, {"detail": "Not Found"})
+
+    def _predict(self, item):
+        message = str(item.get("message", ""))
+        crisis = self.profile.crisis()
+        return {
+            "intent": "crisis" if crisis else ("mental_health_support" if len(message) > 40 else "casual_chat"),
+            "intent_score": 0.9,
+            "crisis": crisis,
+            "kb_hits": [] if crisis else ["Try box breathing: inhale 4s, hold 4s, exhale 4s, hold 4s."],
+        }
+
+    def do_POST(self):
+        try:
+            payload = self._read_payload()
+        except TypeError:
+            return self._send(415, {"detail": "unsupported media type"})
+        except ValueError:
+            return self._send(400, {"detail": "invalid body"})
+        if self.path == "/predict":
+            result = self._predict(payload)
+        elif self.path == "/predict_batch" and self.profile.batch:
+            result = {"results": [self._predict(item) for item in payload.get("items", [])]}
+        elif self.path == "/chat":
+            result = {"reply": f"(fake) I hear you: {str(payload.get('message', ''))[:80]}", "sources": []}
+        else:
+            return self._send(404, {"detail": "Not Found"})
+
+        delay_s, fault = self.profile.draw(self.path)
+        time.sleep(delay_s)
+        if fault == "error":
+            self._send(503, {"detail": "injected failure"})
+        elif fault == "reset":
+            self.close_connection = True
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        elif fault == "malformed":
+            body = msgpack.packb(result) if self._wants_msgpack() else json.dumps(result).encode()
+            ctype = "application/msgpack" if self._wants_msgpack() else "application/json"
+            self._send(200, body[: max(1, len(body) // 2)], ctype)
+        elif fault == "slowloris":
+            self._slowloris(json.dumps(result).encode())
+        elif self.path == "/chat" and payload.get("stream"):
+            self._stream(result)
+        else:
+            self._send(200, result)
+
+    def _slowloris(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            for i in range(len(body)):
+                self.wfile.write(body[i:i + 1])
+                self.wfile.flush()
+                time.sleep(self.profile.slowloris_gap_s)
+        except OSError:
+            self.close_connection = True  # client gave up
+
+    def _stream(self, result):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        try:
+            for i, word in enumerate(result["reply"].split(" ")):
+                chunk(f"data: {json.dumps({'delta': word if i == 0 else ' ' + word})}\n\n".encode())
+                time.sleep(self.profile.stream_gap_s)
+            chunk(f"data: {json.dumps({'done': True, 'sources': result['sources']})}\n\n".encode())
+            chunk(b"data: [DONE]\n\n")
+            chunk(b"")
+        except OSError:
+            self.close_connection = True
+
+
+def start_fake_ml_server(profile=None, host="127.0.0.1", port=0):
+    """Serve in a daemon thread; returns (server, base_url). Stop with server.shutdown()."""
+    handler = type("FakeML", (FakeMLHandler,), {"profile": profile or FaultProfile()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-mhchat-ml", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_profile_arguments(parser):
+    parser.add_argument("--latency", default="fixed:20", help="/predict latency spec (ms)")
+    parser.add_argument("--chat-latency", help="/chat latency spec (default: --latency)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reset-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--slowloris-rate", type=float, default=0.0)
+    parser.add_argument("--slowloris-gap-ms", type=float, default=200.0)
+    parser.add_argument("--crisis-rate", type=float, default=0.0)
+    parser.add_argument("--no-batch", action="store_true", help="answer /predict_batch with 404")
+    parser.add_argument("--no-msgpack", action="store_true", help="JSON only (415 for msgpack bodies)")
+    parser.add_argument("--gzip-min-bytes", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=1234)
+
+
+def profile_from_args(args):
+    return FaultProfile(
+        latency=args.latency, chat_latency=args.chat_latency, error_rate=args.error_rate,
+        reset_rate=args.reset_rate, malformed_rate=args.malformed_rate, slowloris_rate=args.slowloris_rate,
+        slowloris_gap_ms=args.slowloris_gap_ms, crisis_rate=args.crisis_rate, batch=not args.no_batch,
+        msgpack=not args.no_msgpack, gzip_min_bytes=args.gzip_min_bytes, seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    server, base = start_fake_ml_server(profile_from_args(args), args.host, args.port)
+    print(f"fake mhchat-ml listening on {base} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# chat/ml_health.py
+"""
+Failure handling for the mhchat-ml service: a circuit breaker in front of
+/predict + /chat and a background /health prober.
+
+    closed     calls go through; MHCHAT_ML_BREAKER_FAILURES consecutive
+               failures open the breaker
+    open       calls are refused immediately (caller uses the local NLU
+               fallback); after MHCHAT_ML_BREAKER_RESET_S one trial call is let
+               through (half-open), or sooner if the prober sees /health recover
+    half_open  the trial's success closes the breaker, failure re-opens it
+
+The prober thread checks /health every MHCHAT_ML_HEALTH_INTERVAL_S seconds
+(0 disables it) so no request pays for a health check. A failed probe counts
+as one breaker failure, so a single slow probe does not open the breaker; it
+takes MHCHAT_ML_BREAKER_FAILURES in a row, probes and calls together. It is
+started lazily by the first predict().
+
+ml_breaker_stats() exposes the state, transition counts and short-circuits.
+"""
+import logging
+import threading
+import time
+
+from .ml_http import ml_setting
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout_s=10.0, clock=time.monotonic):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout_s = float(reset_timeout_s)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0  # consecutive
+        self._opened_at = 0.0
+        self._trial_started = None  # half-open trial in flight since
+        self._transitions = {}
+        self._stats = {"allowed": 0, "short_circuits": 0, "successes": 0, "failures": 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def _set_state(self, new, now):
+        # caller holds the lock
+        old = self._state
+        if old == new:
+            return
+        self._state = new
+        key = f"{old}->{new}"
+        self._transitions[key] = self._transitions.get(key, 0) + 1
+        if new == OPEN:
+            self._opened_at = now
+        self._trial_started = None
+        log = logger.warning if new == OPEN else logger.info
+        log("mhchat-ml circuit breaker %s -> %s", old, new)
+
+    def allow(self):
+        """True if a call may go to the service now; False means use the fallback."""
+        with self._lock:
+            now = self._clock()
+            if self._state == OPEN and now - self._opened_at >= self.reset_timeout_s:
+                self._set_state(HALF_OPEN, now)
+            if self._state == HALF_OPEN:
+                # One trial at a time; a trial that never reported back expires.
+                if self._trial_started is not None and now - self._trial_started < self.reset_timeout_s:
+                    self._stats["short_circuits"] += 1
+                    return False
+                self._trial_started = now
+            elif self._state == OPEN:
+                self._stats["short_circuits"] += 1
+                return False
+            self._stats["allowed"] += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._stats["successes"] += 1
+            self._failures = 0
+            if self._state != CLOSED:
+                self._set_state(CLOSED, self._clock())
+
+    def record_failure(self):
+        with self._lock:
+            self._stats["failures"] += 1
+            self._failures += 1
+            now = self._clock()
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._set_state(OPEN, now)
+            elif self._state == OPEN:
+                self._opened_at = now
+
+    def trip(self):
+        """Open the breaker now (failed health probe)."""
+        with self._lock:
+            if self._state == CLOSED:
+                self._set_state(OPEN, self._clock())
+
+    def probe_succeeded(self):
+        """Healthy probe while open: let the next call through as a trial."""
+        with self._lock:
+            if self._state == OPEN:
+                self._set_state(HALF_OPEN, self._clock())
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update(state=self._state, consecutive_failures=self._failures, transitions=dict(self._transitions))
+            return out
+
+
+class HealthProber:
+    """Daemon thread keeping a cached /health result and feeding it to a breaker."""
+
+    def __init__(self, check, breaker, interval_s=5.0, timeout_s=1.0):
+        self._check = check
+        self._breaker = breaker
+        self.interval_s = float(interval_s)
+        self.timeout_s = float(timeout_s)
+        self.healthy = None  # unknown until the first probe
+        self.last_checked = None
+        self.probes = 0
+        self.probe_failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="mhchat-ml-health", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=self.timeout_s + 1.0)
+
+    def probe_once(self):
+        try:
+            ok = bool(self._check(timeout_s=self.timeout_s))
+        except Exception:
+            logger.exception("mhchat-ml health probe failed")
+            ok = False
+        if self.healthy is not None and ok != self.healthy:
+            logger.info("mhchat-ml health changed: %s", "healthy" if ok else "unhealthy")
+        self.healthy = ok
+        self.last_checked = time.time()
+        self.probes += 1
+        if ok:
+            self._breaker.probe_succeeded()
+        else:
+            self.probe_failures += 1
+            self._breaker.record_failure()
+        return ok
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe_once()
+            self._stop.wait(self.interval_s)
+
+    def stats(self):
+        return {
+            "healthy": self.healthy,
+            "last_checked": self.last_checked,
+            "probes": self.probes,
+            "probe_failures": self.probe_failures,
+            "running": bool(self._thread and self._thread.is_alive()),
+        }
+
+
+_breaker = None
+_prober = None
+_init_lock = threading.Lock()
+
+
+def get_ml_breaker():
+    global _breaker
+    if _breaker is None:
+        with _init_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    failure_threshold=int(ml_setting("MHCHAT_ML_BREAKER_FAILURES", 5)),
+                    reset_timeout_s=float(ml_setting("MHCHAT_ML_BREAKER_RESET_S", 10.0)),
+                )
+    return _breaker
+
+
+def ensure_health_prober():
+    """Start the background prober once per process (no-op when disabled)."""
+    global _prober
+    if _prober is not None:
+        return _prober
+    interval = float(ml_setting("MHCHAT_ML_HEALTH_INTERVAL_S", 5.0))
+    if interval <= 0:
+        return None
+    from .ml_brain_client import is_ml_service_healthy
+
+    breaker = get_ml_breaker()
+    with _init_lock:
+        if _prober is None:
+            _prober = HealthProber(is_ml_service_healthy, breaker, interval_s=interval)
+            _prober.start()
+    return _prober
+
+
+def ml_breaker_stats():
+    out = get_ml_breaker().stats()
+    out["health"] = _prober.stats() if _prober is not None else None
+    return out
+
+
+def reset_ml_health():
+    """Stop the prober and forget breaker state (tests)."""
+    global _breaker, _prober
+    with _init_lock:
+        prober, _prober, _breaker = _prober, None, None
+    if prober is not None:
+        prober.stop()
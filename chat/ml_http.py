@@ -0,0 +1,210 @@
+# chat/ml_http.py
+"""
+Pooled keep-alive HTTP client for the mhchat-ml service.
+
+urllib.request opens a new TCP connection per call; with /health, /predict
+and /chat per message (plus retries) that is several connects per reply and
+a pile of TIME_WAIT sockets under load. PooledHTTPClient keeps idle
+http.client connections and hands them out LIFO, one thread at a time.
+
+    client = get_ml_http_client()
+    resp = client.request("POST", "/predict", body=b"{...}", headers={...}, timeout_s=8.0)
+
+Configuration (Django settings, falling back to the environment):
+    MHCHAT_ML_API_BASE       base URL, default http://127.0.0.1:8001
+    MHCHAT_ML_POOL_SIZE      idle connections kept, default 8
+    MHCHAT_ML_POOL_IDLE_S    idle connections older than this are closed, default 30
+
+ml_http_stats() reports pool size, connects, reuses and stale retries.
+"""
+import http.client
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = "http://127.0.0.1:8001"
+
+Response = namedtuple("Response", "status headers body")
+
+# Errors that mean a reused keep-alive connection was closed by the server
+# before our request got an answer; safe to retry once on a fresh connection.
+_STALE_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+
+class HTTPStatusError(http.client.HTTPException):
+    """Non-2xx response from the ML service."""
+
+    def __init__(self, status, url, body=b""):
+        super().__init__(f"HTTP {status} from {url}")
+        self.status = status
+        self.url = url
+        self.body = body
+
+
+def ml_setting(name, default):
+    """Django setting ``name`` if configured, else the environment variable, else ``default``."""
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.environ.get(name, default)
+    return value
+
+
+class PooledHTTPClient:
+    """Thread-safe pool of keep-alive connections to one origin."""
+
+    def __init__(self, base_url, max_idle=8, idle_timeout_s=30.0):
+        parts = urlsplit(base_url.rstrip("/"))
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported ML API base URL: {base_url!r}")
+        self.base_url = base_url.rstrip("/")
+        self._conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._host = parts.hostname
+        self._port = parts.port
+        self._prefix = parts.path
+        self._host_header = parts.netloc
+        self.max_idle = max(0, int(max_idle))
+        self.idle_timeout_s = float(idle_timeout_s)
+
+        self._lock = threading.Lock()
+        self._idle = []  # [(conn, released_at)], newest last
+        self._in_use = 0
+        self._stats = {"requests": 0, "connects": 0, "reuses": 0, "stale_retries": 0, "discarded": 0, "errors": 0}
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def _acquire(self, timeout_s):
+        now = time.monotonic()
+        conn = None
+        expired = []
+        with self._lock:
+            while self._idle:
+                candidate, released_at = self._idle.pop()
+                if now - released_at <= self.idle_timeout_s:
+                    conn = candidate
+                    break
+                expired.append(candidate)
+            # Anything older than the newest expired one is expired too.
+            if expired:
+                expired.extend(c for c, _ in self._idle)
+                self._idle.clear()
+                self._stats["discarded"] += len(expired)
+            reused = conn is not None
+            if reused:
+                self._stats["reuses"] += 1
+            else:
+                self._stats["connects"] += 1
+            self._in_use += 1
+        for c in expired:
+            c.close()
+
+        if conn is None:
+            conn = self._conn_cls(self._host, self._port, timeout=timeout_s)
+        else:
+            conn.timeout = timeout_s
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout_s)
+        return conn, reused
+
+    def _release(self, conn, keep):
+        with self._lock:
+            self._in_use -= 1
+            if keep and len(self._idle) < self.max_idle:
+                self._idle.append((conn, time.monotonic()))
+                return
+            self._stats["discarded"] += 1
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None, timeout_s=8.0):
+        """Send one request and return Response(status, headers, body bytes)."""
+        hdrs = {"Host": self._host_header, "Connection": "keep-alive"}
+        if headers:
+            hdrs.update(headers)
+        with self._lock:
+            self._stats["requests"] += 1
+
+        for attempt in (0, 1):
+            conn, reused = self._acquire(timeout_s)
+            try:
+                conn.request(method, self._prefix + path, body=body, headers=hdrs)
+                resp = conn.getresponse()
+                data = resp.read()
+            except _STALE_ERRORS:
+                self._release(conn, keep=False)
+                if reused and attempt == 0:
+                    with self._lock:
+                        self._stats["stale_retries"] += 1
+                    continue
+                with self._lock:
+                    self._stats["errors"] += 1
+                raise
+            except BaseException:
+                self._release(conn, keep=False)
+                with self._lock:
+                    self._stats["errors"] += 1
+                raise
+            self._release(conn, keep=not resp.will_close)
+            return Response(resp.status, resp.headers, data)
+
+    def close(self):
+        """Close all idle connections (in-use ones are closed when released)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self.max_idle = 0
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update(idle=len(self._idle), in_use=self._in_use, max_idle=self.max_idle, base_url=self.base_url)
+        total = out["connects"] + out["reuses"]
+        out["reuse_ratio"] = out["reuses"] / total if total else 0.0
+        return out
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_ml_http_client():
+    """Process-wide client for the configured MHCHAT_ML_API_BASE (rebuilt if the setting changes)."""
+    global _client
+    base_url = str(ml_setting("MHCHAT_ML_API_BASE", DEFAULT_API_BASE)).rstrip("/")
+    client = _client
+    if client is not None and client.base_url == base_url:
+        return client
+    with _client_lock:
+        if _client is None or _client.base_url != base_url:
+            old = _client
+            _client = PooledHTTPClient(
+                base_url,
+                max_idle=int(ml_setting("MHCHAT_ML_POOL_SIZE", 8)),
+                idle_timeout_s=float(ml_setting("MHCHAT_ML_POOL_IDLE_S", 30.0)),
+            )
+            if old is not None:
+                old.close()
+        return _client
+
+
+def ml_http_stats():
+    client = _client
+    return client.stats() if client is not None else {}
+
+
+def reset_ml_http_client():
+    """Drop the pooled client (tests, or after fork)."""
+    global _client
+    with _client_lock:
+        old, _client = _client, None
+    if old is not None:
+        old.close()
@@ -91,3 +91,46 @@ class MessageAttachment(models.Model):
 
     def __str__(self):
         return f"Attachment {self.file_name} for message {self.message_id}"
+
+
+class Job(models.Model):
+    """
+    A queued call for the run_workers command (see chat/jobs.py). ``name`` is the
+    dotted path of a module-level function; args/kwargs must be JSON-serializable.
+    ``lane`` "crisis" jobs are claimed first and have reserved worker threads.
+    """
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "pending"), (STATUS_RUNNING, "running"),
+        (STATUS_DONE, "done"), (STATUS_FAILED, "failed"),
+    )
+    LANE_CRISIS = "crisis"
+    LANE_NORMAL = "normal"
+    LANE_CHOICES = ((LANE_CRISIS, "crisis"), (LANE_NORMAL, "normal"))
+
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    lane = models.CharField(max_length=10, choices=LANE_CHOICES, default=LANE_NORMAL)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)  # lease; expired leases are picked up again
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("id",)
+        indexes = [
+            models.Index(fields=["status", "lane", "run_after"], name="chat_job_ready_idx"),
+            models.Index(fields=["status", "locked_until"], name="chat_job_lease_idx"),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} {self.name} [{self.status}]"
@@ -1,15 +1,70 @@
 # chat/nlp.py
 """
-NLU helpers for MHChat (small, dependency-free).
+NLU helpers for MHChat (small; the rules need no third-party packages).
 - analyze_message(text) -> dict (intent, intent_confidence, entities, sentiment)
 - safety_check(text, nlp_meta) -> (flagged: bool, severity: "low"|"medium"|"high")
+- analyze_and_check(text) -> (nlp_meta, flagged, severity) in a single pass
+- analyze_messages(texts) -> [nlp_meta, ...] (batch analyze_message)
 - generate_bot_response(text, nlp_meta, conversation=None) -> str
+
+Sentiment is a weighted lexicon score with negation and intensity handling
+(_score_sentiment), computed over the same token list as everything else.
+
+Entities are gazetteer matches {"value", "start", "end"}: ``value`` is the
+normalized (lowercase) phrase, start/end are offsets into the text passed in.
+
+Intent comes from the trained model (chat/intent_model.py) when an artifact is
+available and confident, otherwise from the keyword rules below.
+
+All lexicons below are compiled once at import (_SUICIDAL_RE, _PHRASE_TABLE).
+Lexicon categories are looked up lazily (_LexiconHits): each is a C-level
+search that stops at its first hit, and the rules only search the categories
+they need, so risk-dense text is decided as early as the old any() chains.
+
+Results are memoized per normalized text in a bounded LRU cache
+(MHCHAT_NLU_CACHE_SIZE entries, 0 disables); see nlu_cache_stats(). The cache
+is dropped automatically when the lexicons are recompiled or the intent model
+changes. safety_check() needs only the lexicon scan, so it bypasses the cache
+and never runs sentiment, entities or the intent model.
 """
 
+import hashlib
+import logging
+import os
 import re
+import threading
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
 
-_NEG_WORDS = {"sad","down","depressed","unhappy","hopeless","miserable","terrible","bad","alone","lonely","worthless"}
-_POS_WORDS = {"good","happy","great","okay","fine","relieved","better","well","ok","better"}
+from .intent_model import get_intent_classifier
+
+logger = logging.getLogger(__name__)
+
+# Sentiment lexicons: word -> strength (see _score_sentiment).
+_NEG_WORDS = {
+    "sad": 2.0, "down": 1.0, "depressed": 2.5, "unhappy": 2.0, "hopeless": 3.0, "miserable": 2.5,
+    "terrible": 2.5, "bad": 1.5, "alone": 1.0, "lonely": 2.0, "worthless": 3.0,
+}
+_POS_WORDS = {
+    "good": 1.5, "happy": 2.0, "great": 2.5, "okay": 1.0, "fine": 1.0, "relieved": 2.0,
+    "better": 1.5, "well": 0.5, "ok": 1.0,
+}
+# Negators flip (and damp) the next _NEGATION_SCOPE tokens; modifiers scale
+# the next sentiment word ("very sad", "slightly better").
+_NEGATORS = {
+    "not","no","never","nothing","nobody","hardly","without","cannot",
+    "don't","dont","doesn't","doesnt","didn't","didnt","isn't","isnt","wasn't","wasnt","aren't","arent",
+    "can't","cant","won't","wont","couldn't","couldnt","wouldn't","wouldnt","haven't","havent","hasn't","hasnt",
+}
+_INTENSITY_MODIFIERS = {
+    "very": 1.5, "really": 1.5, "so": 1.4, "too": 1.3, "extremely": 1.8, "incredibly": 1.8,
+    "totally": 1.6, "completely": 1.6, "super": 1.5, "absolutely": 1.6,
+    "slightly": 0.5, "somewhat": 0.6, "kinda": 0.6, "barely": 0.4,
+}
+_NEGATION_SCOPE = 3
+_NEGATION_FACTOR = -0.74
+_COMPOUND_ALPHA = 15.0  # compound = s / sqrt(s*s + alpha), in (-1, 1)
 _SUICIDAL_PATTERNS = [
     r"\bkill\s+my\s*self\b",
     r"\bkill myself\b",
@@ -17,7 +72,7 @@ _SUICIDAL_PATTERNS = [
     r"\bi'm going to kill myself\b",
     r"\bi am going to kill myself\b",
     r"\bi want to end my life\b",
-    r"\bsuicid(e|al)\b",
+    r"\bsuicid(?:e|al)\b",
     r"\bend my life\b",
     r"\bnot worth living\b",
     r"\bhang myself\b",
@@ -38,36 +93,337 @@ _GREETINGS = {"hello","hi","hey","good morning","good evening","good afternoon",
 
 _URGENCY_WORDS = {"now","today","immediately","right now","already","this minute","tonight","soon","plan","planned","going to","tomorrow"}
 
+_HELP_PHRASES = {"help","cope","support","talk to someone","talk to a human"}
+
+_THANKS_PHRASES = {"thank","thanks"}
+
+# Explicit first-person statements that are high severity even without urgency words.
+_HIGH_RISK_PHRASES = {"i want to kill myself","i am going to kill myself"}
+
+# Lexicon categories reported by _scan_lexicons().
+_HIT_SUICIDAL = "suicidal"    # any of _SUICIDAL_PATTERNS
+_HIT_CRISIS = "crisis"
+_HIT_GREETING = "greeting"
+_HIT_URGENCY = "urgency"
+_HIT_HELP = "help"
+_HIT_THANKS = "thanks"
+_HIT_HIGH_RISK = "high_risk"
+
+_PHRASE_LEXICONS = {
+    _HIT_CRISIS: _CRISIS_WORDS,
+    _HIT_GREETING: _GREETINGS,
+    _HIT_URGENCY: _URGENCY_WORDS,
+    _HIT_HELP: _HELP_PHRASES,
+    _HIT_THANKS: _THANKS_PHRASES,
+    _HIT_HIGH_RISK: _HIGH_RISK_PHRASES,
+}
+
+
+def _compile_lexicons(phrase_lexicons, patterns):
+    """
+    Compile phrase lexicons + regex patterns for _scan_lexicons().
+
+    Returns one regex alternation of ``patterns`` (the leading word boundary
+    they share hoisted out) and a dict of category -> phrases, shortest first.
+    Phrases are plain substrings, as the rules have always matched them, so a
+    category is decided by C substring searches that stop at its first hit;
+    overlapping hits ("going to" inside "i'm going to kill myself") are found
+    because every category is checked on its own.
+    """
+    if all(p.startswith(r"\b") for p in patterns):
+        sui = r"\b(?:" + "|".join(p[2:] for p in patterns) + ")"
+    else:
+        sui = "|".join(f"(?:{p})" for p in patterns)
+    table = {
+        category: tuple(sorted(phrases, key=lambda p: (len(p), p)))
+        for category, phrases in phrase_lexicons.items()
+    }
+    return re.compile(sui), table
+
+
+def _lexicon_fingerprint():
+    """Digest of every lexicon that affects analysis results (cache invalidation key)."""
+    parts = [sorted(_NEG_WORDS.items()), sorted(_POS_WORDS.items()), list(_SUICIDAL_PATTERNS)]
+    parts += [sorted(_NEGATORS), sorted(_INTENSITY_MODIFIERS.items())]
+    parts.append((_NEGATION_SCOPE, _NEGATION_FACTOR, _COMPOUND_ALPHA))
+    parts.extend(sorted(words) for _, words in sorted(_PHRASE_LEXICONS.items()))
+    parts.extend(sorted(words) for _, words in sorted(_ENTITY_GAZETTEERS.items()))
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def recompile_lexicons():
+    """Rebuild the scanner, sentiment table and gazetteer after editing lexicons at runtime (drops cached results)."""
+    global _SUICIDAL_RE, _PHRASE_TABLE, _SENTIMENT_TABLE, _ENTITY_TRIE, _LEXICON_VERSION
+    _SUICIDAL_RE, _PHRASE_TABLE = _compile_lexicons(_PHRASE_LEXICONS, _SUICIDAL_PATTERNS)
+    _SENTIMENT_TABLE = _compile_sentiment_table()
+    _ENTITY_TRIE = _compile_gazetteer(_ENTITY_GAZETTEERS)
+    _LEXICON_VERSION = _lexicon_fingerprint()
+
+
+class _LexiconHits:
+    """
+    The _HIT_* categories of normalized text ``t``, each searched the first
+    time it is asked about, so the intent and safety rules stop at the
+    category that decides them. resolve() returns all of them as a frozenset.
+    """
+
+    __slots__ = ("_t", "_found")
+
+    def __init__(self, t):
+        self._t = t
+        self._found = {}
+
+    def __contains__(self, category):
+        found = self._found.get(category)
+        if found is None:
+            if category == _HIT_SUICIDAL:
+                found = _SUICIDAL_RE.search(self._t) is not None
+            else:
+                found = any(p in self._t for p in _PHRASE_TABLE.get(category, ()))
+            self._found[category] = found
+        return found
+
+    def resolve(self):
+        return frozenset(c for c in (_HIT_SUICIDAL, *_PHRASE_TABLE) if c in self)
+
+
+def _scan_lexicons(t):
+    """Return the set of _HIT_* categories found in normalized text ``t``."""
+    return _LexiconHits(t).resolve()
+
+def _rebase_entities(entities, text):
+    """
+    Move entity offsets from the normalized text onto ``text`` itself, in
+    place: undoes _normalize's strip and "my self" -> "myself". ``value``
+    stays normalized (lowercase), so text[start:end] may differ in case.
+    """
+    text = text or ""
+    lowered = text.lower()
+    lead = len(lowered) - len(lowered.lstrip())
+    body = lowered.strip()
+    # normalized index from which each joined "my self" is one char shorter
+    joined = []
+    i = body.find("my self")
+    while i >= 0:
+        joined.append(i - len(joined) + 2)
+        i = body.find("my self", i + 7)
+    if not lead and not joined and len(lowered) == len(text):
+        return entities
+    # lower() can lengthen a few non-ASCII characters: map back char by char
+    index = None if len(lowered) == len(text) else [i for i, ch in enumerate(text) for _ in ch.lower()] + [len(text)]
+    for spans in entities.values():
+        for e in spans:
+            for k in ("start", "end"):
+                pos = e[k] + lead + bisect_right(joined, e[k])
+                e[k] = pos if index is None else index[pos]
+    return entities
+
+
 def _normalize(text):
     t = (text or "").lower().strip()
     # Normalize common spacing variants like "my self" -> "myself".
     t = t.replace("my self", "myself")
     return t
 
-def analyze_message(text):
-    t = _normalize(text)
-    words = re.findall(r"[a-z']+", t)
-    neg = sum(1 for w in words if w in _NEG_WORDS)
-    pos = sum(1 for w in words if w in _POS_WORDS)
-    compound = 0.0
-    if (pos + neg) > 0:
-        compound = (pos - neg) / (pos + neg)
+# One normalized, tokenized view of a message shared by every analysis step.
+_TextView = namedtuple("_TextView", "t words hits")
+
+_WORD_RE = re.compile(r"[a-z']+")
+
+
+def _view_normalized(t):
+    return _TextView(t, _WORD_RE.findall(t), _LexiconHits(t))
+
+
+_SENT_VALENCE, _SENT_NEGATOR, _SENT_MODIFIER = 0, 1, 2
+
+
+def _compile_sentiment_table():
+    """Frozen token -> (kind, value) map so the scorer does one lookup per token."""
+    table = {}
+    for word, factor in _INTENSITY_MODIFIERS.items():
+        table[word] = (_SENT_MODIFIER, float(factor))
+    for word in _NEGATORS:
+        table[word] = (_SENT_NEGATOR, 0.0)
+    for word, strength in _NEG_WORDS.items():
+        table[word] = (_SENT_VALENCE, -float(strength))
+    for word, strength in _POS_WORDS.items():
+        table[word] = (_SENT_VALENCE, float(strength))
+    return MappingProxyType(table)
+
+
+def _score_sentiment(words):
+    """
+    Weighted lexicon sentiment over the token list with negation scope and
+    intensity modifiers: "not happy" is negative, "very sad" outweighs "sad".
+    Returns {"neg", "pos", "compound"}; neg/pos are summed magnitudes and
+    compound is normalized to (-1, 1).
+    """
+    table = _SENTIMENT_TABLE
+    pos = neg = 0.0
+    negate = 0  # tokens left in the current negation scope
+    boost = 1.0
+    for w in words:
+        entry = table.get(w)
+        if entry is None:
+            boost = 1.0
+        else:
+            kind, value = entry
+            if kind == _SENT_VALENCE:
+                value *= boost
+                if negate:
+                    value *= _NEGATION_FACTOR
+                if value > 0:
+                    pos += value
+                else:
+                    neg -= value
+                boost = 1.0
+            elif kind == _SENT_MODIFIER:
+                boost *= value
+            else:
+                negate = _NEGATION_SCOPE + 1  # counted down below, so covers the next N tokens
+                boost = 1.0
+        if negate:
+            negate -= 1
+    score = pos - neg
+    compound = score / (score * score + _COMPOUND_ALPHA) ** 0.5 if score else 0.0
+    return {"neg": neg, "pos": pos, "compound": compound}
+
+
+# Gazetteers for counselor-facing entities. Phrases are matched on whole
+# tokens (see _WORD_RE), longest match first.
+_ENTITY_GAZETTEERS = {
+    "medication": {
+        "sertraline","zoloft","fluoxetine","prozac","citalopram","escitalopram","lexapro","paroxetine",
+        "venlafaxine","effexor","bupropion","wellbutrin","mirtazapine","lithium","quetiapine","seroquel",
+        "olanzapine","lorazepam","ativan","diazepam","valium","alprazolam","xanax","clonazepam","klonopin",
+        "zolpidem","ambien","trazodone","paracetamol","acetaminophen","tylenol","ibuprofen","aspirin",
+        "codeine","tramadol","oxycodone","antidepressants","antidepressant","painkillers","sleeping pills",
+        "pills","my meds","my medication",
+    },
+    "substance": {
+        "alcohol","beer","wine","vodka","whiskey","whisky","tequila","drinking","weed","marijuana","cannabis",
+        "cocaine","crack","heroin","meth","methamphetamine","ecstasy","mdma","lsd","ketamine","fentanyl",
+        "opioids","vaping","cigarettes",
+    },
+    "time": {
+        "tonight","today","tomorrow","this morning","this afternoon","this evening","this weekend",
+        "right now","next week","this week","in an hour","at midnight","yesterday",
+        "last night",
+    },
+    "self_harm_method": {
+        "cut myself","cutting","razor","razors","blade","blades","overdose","overdosing",
+        "hang myself","hanging","rope","noose","jump off","jumping off","shoot myself","gun","burn myself",
+        "starve myself","poison","drown myself","bleach",
+    },
+}
+
+_ENTITY_END = ""  # trie key marking "a phrase ends here" (never a token)
+
+
+def _compile_gazetteer(gazetteers):
+    """Token trie: {token: {token: ..., _ENTITY_END: category}}."""
+    trie = {}
+    for category, phrases in gazetteers.items():
+        for phrase in phrases:
+            node = trie
+            for token in _WORD_RE.findall(phrase):
+                node = node.setdefault(token, {})
+            node[_ENTITY_END] = category
+    return trie
+
+
+_ENTITY_TRIE = _compile_gazetteer(_ENTITY_GAZETTEERS)
+
+
+def _extract_entities(t, words):
+    """
+    Leftmost-longest gazetteer matches over the token stream in one pass.
+    Returns {category: [{"value", "start", "end"}, ...]} with character offsets
+    into the normalized text ``t`` (the cached form; the public entry points
+    rebase them onto the caller's text, see _rebase_entities); empty dict when
+    nothing matches.
+    """
+    root = _ENTITY_TRIE
+    matches = []
+    i, n = 0, len(words)
+    while i < n:
+        node = root.get(words[i])
+        if node is None:
+            i += 1
+            continue
+        best = None
+        j = i
+        while True:
+            category = node.get(_ENTITY_END)
+            if category is not None:
+                best = (j + 1, category)
+            j += 1
+            if j >= n:
+                break
+            node = node.get(words[j])
+            if node is None:
+                break
+        if best is None:
+            i += 1
+            continue
+        matches.append((i, best[0], best[1]))
+        i = best[0]
+
+    if not matches:
+        return {}
+    # Token offsets are only needed when something matched.
+    spans = [m.span() for m in _WORD_RE.finditer(t)]
+    entities = {}
+    for first, end, category in matches:
+        start, stop = spans[first][0], spans[end - 1][1]
+        entities.setdefault(category, []).append({"value": t[start:stop], "start": start, "end": stop})
+    return entities
+
 
-    sentiment = {"neg": float(neg), "pos": float(pos), "compound": float(compound)}
+recompile_lexicons()
+
+
+# A model intent replaces the keyword intent only when at least this confident.
+_MODEL_MIN_CONFIDENCE = float(os.environ.get("MHCHAT_INTENT_MIN_CONFIDENCE", "0.5"))
+
+# Training labels that correspond to intents generate_bot_response already handles.
+_MODEL_INTENT_ALIASES = {"coping": "help_request"}
+
+
+def _predict_intents(ts):
+    """
+    Batched model predictions for normalized texts: a list of (label, score, version),
+    or None when no intent model is configured (keyword rules only).
+    """
+    clf = get_intent_classifier()
+    if clf is None or not ts:
+        return None
+    try:
+        return [(label, score, clf.version) for label, score in clf.predict(ts)]
+    except Exception:
+        logger.exception("Intent model %s failed; using keyword rules", getattr(clf, "version", "?"))
+        return None
+
+
+def _analyze_view(view, prediction=None):
+    t, words, hits = view
+    sentiment = _score_sentiment(words)
+    compound = sentiment["compound"]
 
     # Default intent
     intent = "unknown"
 
     # greeting detection
-    if any(g in t for g in _GREETINGS) and len(t.split()) <= 3:
+    if _HIT_GREETING in hits and len(t.split()) <= 3:
         intent = "greeting"
     # help request
-    elif any(w in t for w in ("help","cope","support","talk to someone","talk to a human")):
+    elif _HIT_HELP in hits:
         intent = "help_request"
-    elif any(w in t for w in ("thank", "thanks")):
+    elif _HIT_THANKS in hits:
         intent = "thanks"
     # suicidal phrases -> normalized to "suicidal" to match tests/expectations
-    elif any(re.search(p, t) for p in _SUICIDAL_PATTERNS) or any(cris in t for cris in _CRISIS_WORDS):
+    elif _HIT_SUICIDAL in hits or _HIT_CRISIS in hits:
         intent = "suicidal"
     elif compound > 0.2:
         intent = "positive"
@@ -75,50 +431,252 @@ def analyze_message(text):
         intent = "negative"
 
     intent_confidence = 0.7 if intent != "unknown" else 0.0
+    intent_model = None
 
-    entities = {}  # placeholder for future entity extraction
+    # Confident model predictions override the keyword intent, but suicidal
+    # language found by the rules is never downgraded.
+    if prediction is not None and intent != "suicidal":
+        label, score, version = prediction
+        if score >= _MODEL_MIN_CONFIDENCE:
+            intent = _MODEL_INTENT_ALIASES.get(label, label)
+            intent_confidence = score
+            intent_model = version
 
-    return {
+    entities = _extract_entities(t, words)
+
+    meta = {
         "intent": intent,
         "intent_confidence": float(intent_confidence),
         "entities": entities,
         "sentiment": sentiment,
     }
+    if intent_model:
+        meta["intent_model"] = intent_model
+    return meta
 
-def safety_check(text, nlp_meta=None):
+
+class _LRUCache:
+    """Thread-safe size-bounded LRU map with hit/miss/eviction/invalidation counters.
+
+    Every lookup carries the current fingerprint (lexicon digest + intent model);
+    when it differs from the one the entries were computed under, the cache is
+    emptied first.
     """
-    Return (flagged: bool, severity: 'low'|'medium'|'high').
-    High if explicit suicidal pattern + urgency words, or contains "kill myself" + "plan" etc.
-    Medium if suicidal language without immediate urgency, or very negative sentiment + crisis words.
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key, fingerprint):
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                if self._data:
+                    self.invalidations += 1
+                    self._data.clear()
+                self._fingerprint = fingerprint
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry, fingerprint):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                return  # computed under an older lexicon/model; don't keep it
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_NLU_CACHE = _LRUCache(int(os.environ.get("MHCHAT_NLU_CACHE_SIZE", "4096")))
+
+# Normalized texts longer than this are keyed by a digest instead of the text itself.
+_CACHE_KEY_MAX_CHARS = 256
+
+
+def _cache_key(t):
+    if len(t) <= _CACHE_KEY_MAX_CHARS:
+        return t
+    return (len(t), hashlib.blake2b(t.encode("utf-8"), digest_size=16).digest())
+
+
+def _cache_fingerprint():
+    clf = get_intent_classifier()
+    return (_LEXICON_VERSION, id(clf), getattr(clf, "version", None))
+
+
+def _copy_json(value):
+    # nlp_meta holds only dicts, lists and scalars: far cheaper than copy.deepcopy
+    if isinstance(value, dict):
+        return {k: _copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(v) for v in value]
+    return value
+
+
+def _copy_meta(meta):
+    # Cached results are shared between callers; hand out copies they can mutate.
+    out = {k: _copy_json(v) for k, v in meta.items() if k != "entities"}
+    # entities is the bulk of a long message's metadata: flat span dicts
+    out["entities"] = {category: [dict(e) for e in spans] for category, spans in meta["entities"].items()}
+    return out
+
+
+def _analyze_normalized(ts):
     """
-    t = _normalize(text)
+    (hits, nlp_meta) for each normalized text, served from the LRU cache where
+    possible; misses are analyzed with one batched model call.
+    The returned objects are cache-owned: copy nlp_meta before handing it out.
+    """
+    fingerprint = _cache_fingerprint()
+    if _NLU_CACHE.maxsize > 0:
+        keys = [_cache_key(t) for t in ts]
+        results = [_NLU_CACHE.get(key, fingerprint) for key in keys]
+    else:
+        keys = results = [None] * len(ts)  # cache off: don't digest long texts for nothing
+
+    missing = {}
+    for t, key, entry in zip(ts, keys, results):
+        if entry is None:
+            missing.setdefault(t, key)
+    if not missing:
+        return results
+
+    predictions = _predict_intents(list(missing)) or [None] * len(missing)
+    fresh = {}
+    for (t, key), prediction in zip(missing.items(), predictions):
+        view = _view_normalized(t)
+        meta = _analyze_view(view, prediction)
+        fresh[t] = (view.hits, meta)
+        if _NLU_CACHE.maxsize > 0:
+            # cached hits are a plain frozenset: the entry must not keep the text alive
+            _NLU_CACHE.put(key, (view.hits.resolve(), meta), fingerprint)
+    return [entry if entry is not None else fresh[t] for t, entry in zip(ts, results)]
+
+
+def nlu_cache_stats():
+    """Counters for the NLU result cache (size, maxsize, hits, misses, evictions, invalidations)."""
+    return _NLU_CACHE.stats()
+
+
+def clear_nlu_cache():
+    _NLU_CACHE.clear()
+
+
+def _lexicon_balance(t):
+    """
+    (pos - neg) / (pos + neg) over plain counts of sentiment-lexicon words in
+    normalized text ``t``, in [-1, 1]. The crisis-word gate keeps this scale:
+    the weighted compound from _score_sentiment pulls short messages toward
+    zero, so one negative word next to a crisis word would not cross -0.3.
+    """
+    neg = pos = 0
+    for w in _WORD_RE.findall(t):
+        if w in _NEG_WORDS:
+            neg += 1
+        elif w in _POS_WORDS:
+            pos += 1
+    return (pos - neg) / (pos + neg) if pos + neg else 0.0
+
+
+def _safety_hits(hits, t):
     flagged = False
     severity = "low"
 
     # direct suicidal patterns
-    if any(re.search(p, t) for p in _SUICIDAL_PATTERNS):
+    if _HIT_SUICIDAL in hits:
         flagged = True
         # if urgency words present -> high
-        if any(uw in t for uw in _URGENCY_WORDS):
+        if _HIT_URGENCY in hits:
             severity = "high"
-        elif "i want to kill myself" in t or "i am going to kill myself" in t:
+        elif _HIT_HIGH_RISK in hits:
             severity = "high"
         else:
             severity = "medium"
 
     # If not flagged by pattern, check crisis words + strongly negative sentiment
     if not flagged:
-        if any(cris in t for cris in _CRISIS_WORDS):
-            try:
-                comp = float(nlp_meta.get("sentiment", {}).get("compound", 0.0)) if nlp_meta else 0.0
-            except Exception:
-                comp = 0.0
-            if comp < -0.3:
-                flagged = True
-                severity = "medium"
+        if _HIT_CRISIS in hits and _lexicon_balance(t) < -0.3:
+            flagged = True
+            severity = "medium"
 
     return bool(flagged), severity
 
+
+def _own_meta(meta, text):
+    # with the cache off nothing else holds the result; skip the copy
+    meta = _copy_meta(meta) if _NLU_CACHE.maxsize > 0 else meta
+    if meta["entities"]:
+        _rebase_entities(meta["entities"], text)
+    return meta
+
+
+def analyze_message(text):
+    _, meta = _analyze_normalized([_normalize(text)])[0]
+    return _own_meta(meta, text)
+
+def safety_check(text, nlp_meta=None):
+    """
+    Return (flagged: bool, severity: 'low'|'medium'|'high').
+    High if explicit suicidal pattern + urgency words, or contains "kill myself" + "plan" etc.
+    Medium if suicidal language without immediate urgency, or very negative sentiment + crisis words.
+    Sentiment here is the lexicon-count balance of ``text`` (_lexicon_balance);
+    ``nlp_meta`` is accepted for compatibility and not needed.
+    """
+    t = _normalize(text)
+    # scan only: no full analysis, no model, no cache entry
+    return _safety_hits(_LexiconHits(t), t)
+
+def analyze_and_check(text):
+    """
+    Fused analyze_message + safety_check: normalize, scan and tokenize once.
+    Returns (nlp_meta, flagged, severity), the same verdict as safety_check(text).
+    """
+    t = _normalize(text)
+    hits, meta = _analyze_normalized([t])[0]
+    nlp_meta = _own_meta(meta, text)
+    flagged, severity = _safety_hits(hits, t)
+    return nlp_meta, flagged, severity
+
+def analyze_messages(texts):
+    """
+    Batch analyze_message(): returns one nlp_meta dict per input text, in order.
+    Texts that normalize to the same string are analyzed once.
+    """
+    results = _analyze_normalized([_normalize(text) for text in texts])
+    out = []
+    for text, (_, meta) in zip(texts, results):
+        meta = _copy_meta(meta)
+        if meta["entities"]:
+            _rebase_entities(meta["entities"], text)
+        out.append(meta)
+    return out
+
 def generate_bot_response(text, nlp_meta=None, conversation=None):
     meta = nlp_meta or analyze_message(text)
     intent = meta.get("intent", "unknown")
@@ -7,73 +7,47 @@ Behavior:
 - If not flagged -> call mhchat-ml (/predict) with retry logic for KB hits + crisis flag.
 - If mhchat-ml unavailable -> fall back to local rule-based generator.
 
-This module uses threading for non-blocking email sending to avoid blocking chat responses.
-Request deduplication prevents duplicate messages within 5-second window.
+handle_user_message_async() runs the same pipeline for the WebSocket consumer,
+awaiting mhchat-ml on the event loop instead of blocking a thread. With
+coalescing on, the consumer screens each message at once
+(screen_user_message_async) and answers a burst of them with one reply
+(reply_to_messages_async).
+
+Escalation emails go through chat.jobs.enqueue (bounded pool, or durable
+Job rows run by `manage.py run_workers` with MHCHAT_JOBS_BACKEND=db).
+Producers call reply_lane() first: messages the safety check flags, and their
+escalation emails, go on the crisis lane with its reserved workers.
+Duplicate messages (same user and text within MHCHAT_DEDUP_WINDOW_S, default
+5s) are skipped; the dedup store can be shared across workers (chat/dedup.py).
 """
 
-import hashlib
 import logging
-import threading
-from collections import defaultdict
-from threading import Thread
-from time import sleep, time as current_time
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.mail import send_mail
 from django.utils import timezone
 
+from .dedup import is_new_message
+from .jobs import LANE_CRISIS, LANE_NORMAL, enqueue, record_lane_latency
 from .models import Message
-from .nlp import analyze_message, safety_check, generate_bot_response as generate_bot_response_fallback
-from .ml_brain_client import predict as ml_predict
+from .nlp import analyze_and_check, analyze_message, safety_check, generate_bot_response as generate_bot_response_fallback
+from .ml_brain_client import _fetch_context, apredict as ml_apredict, predict as ml_predict
 
 logger = logging.getLogger(__name__)
 
-# Request deduplication: track (user_id, message_hash) with timestamp
-# Clean up after 5 seconds
-_dedup_cache = defaultdict(dict)  # {user_id: {msg_hash: timestamp}}
-_dedup_lock = threading.Lock()
-
-def _get_message_hash(text: str) -> str:
-    """Generate hash of message text for deduplication."""
-    return hashlib.md5(text.encode()).hexdigest()
-
-def _should_process_message(user_id: int, message_text: str, window_seconds: int = 5) -> bool:
+def _should_process_message(user_id: int, message_text: str) -> bool:
     """
-    Check if message should be processed (not duplicate within window).
-    
-    Args:
-        user_id: User who sent the message
-        message_text: Message content
-        window_seconds: Deduplication window (default 5 seconds)
-    
+    Check if message should be processed (not a duplicate within the
+    MHCHAT_DEDUP_WINDOW_S window; see chat/dedup.py).
+
     Returns:
         True if message is new/different, False if duplicate
     """
-    msg_hash = _get_message_hash(message_text)
-    current_t = current_time()
-    
-    with _dedup_lock:
-        user_cache = _dedup_cache[user_id]
-        
-        # Check if we've seen this exact message recently
-        if msg_hash in user_cache:
-            last_time = user_cache[msg_hash]
-            if current_t - last_time < window_seconds:
-                logger.warning(f"Duplicate message detected for user {user_id}: hash={msg_hash}, age={current_t - last_time:.2f}s")
-                return False  # Duplicate - skip processing
-            else:
-                # Expired - remove old entry and process as new
-                del user_cache[msg_hash]
-        
-        # New/valid message - record it and process
-        user_cache[msg_hash] = current_t
-        
-        # Clean up old entries (simple approach: remove anything older than window)
-        expired = [h for h, t in user_cache.items() if current_t - t >= window_seconds]
-        for h in expired:
-            del user_cache[h]
-        
-        return True  # Process this message
+    if is_new_message(user_id, message_text):
+        return True
+    logger.warning("Duplicate message detected for user %s", user_id)
+    return False
 
 # Channels availability (optional)
 try:
@@ -142,18 +116,64 @@ def _build_message_text(msg: Message) -> str:
     attachment_text = _collect_attachment_context(msg)
     if not attachment_text:
         return base
-    return f"{base}\n\n{attachment_text}".strip()
+    if not base.strip():
+        return attachment_text.strip()
+    # starts with msg.text unchanged, so NLU entity offsets up to len(msg.text) index into it
+    return f"{base}\n\n{attachment_text}".rstrip()
 
 
-def _generate_bot_reply_and_create_message(msg: Message) -> Message:
+class MessageContext:
     """
-    Build short history, call LLM (via safe wrapper) or fallback, create bot Message,
-    store optional embedding and broadcast. Returns created Message.
+    One user message and everything the pipeline reads about it, loaded once:
+    the message with its conversation and user (select_related) and its
+    attachments (prefetch_related). The text sent to NLU and mhchat-ml is built
+    once; NLU/safety results and the ML context window are filled in as the
+    pipeline goes, so later steps never reload them.
     """
-    user_text = _build_message_text(msg)
 
-    # Try mhchat-ml first, passing conversation context
-    pred = ml_predict(user_text, conversation_id=msg.conversation.id)
+    def __init__(self, msg: Message):
+        self.msg = msg
+        self.conversation = msg.conversation
+        self.user = self.conversation.user
+        self.text = _build_message_text(msg)
+        self.nlp_meta = None
+        self.flagged = False
+        self.severity = "low"
+        self._history = None
+
+    @classmethod
+    def load(cls, message_id):
+        """Raises Message.DoesNotExist."""
+        msg = (
+            Message.objects
+            .select_related("conversation__user")
+            .prefetch_related("attachments")
+            .get(id=message_id)
+        )
+        return cls(msg)
+
+    @property
+    def user_id(self):
+        return self.user.id if self.user else None
+
+    def history(self) -> list:
+        """mhchat-ml context window for the conversation (ml_context cache)."""
+        if self._history is None:
+            self._history = _fetch_context(self.conversation.id)
+        return self._history
+
+
+def _generate_bot_reply_and_create_message(ctx: MessageContext) -> Message:
+    """
+    Call mhchat-ml with the conversation context, or fall back to the local
+    generator, then create + broadcast the bot Message. Returns it.
+    """
+    pred = ml_predict(ctx.text, conversation_id=ctx.conversation.id, context=ctx.history())
+    return _create_bot_reply(ctx.msg, ctx.text, pred, ctx.nlp_meta)
+
+
+def _create_bot_reply(msg: Message, user_text: str, pred, nlp_meta: dict = None) -> Message:
+    """Persist + broadcast the bot reply from an mhchat-ml result (or the local fallback if pred is empty)."""
     if pred and isinstance(pred, dict) and pred.get("reply"):
         bot_text = str(pred.get("reply"))
         # attach ML output as metadata to the USER message for traceability
@@ -163,11 +183,12 @@ def _generate_bot_reply_and_create_message(msg: Message) -> Message:
         except Exception:
             logger.exception("Failed to store ml metadata for message %s", getattr(msg, "id", None))
     else:
-        bot_text = generate_bot_response_fallback(user_text, msg.nlp_metadata or {})
+        bot_text = generate_bot_response_fallback(user_text, nlp_meta or msg.nlp_metadata or {})
 
     # create bot message
-    bot_msg = Message.objects.create(conversation=msg.conversation, sender="bot", text=bot_text)
+    bot_msg = _create_message(msg.conversation, "bot", bot_text)
     logger.info(f"Bot message created with ID: {bot_msg.id}")
+    record_lane_latency(LANE_NORMAL, (bot_msg.created_at - msg.created_at).total_seconds())
 
     # broadcast (non-fatal) - wrapped in try/except for robustness
     try:
@@ -179,42 +200,76 @@ def _generate_bot_reply_and_create_message(msg: Message) -> Message:
     return bot_msg
 
 
+def _create_message(conversation, sender: str, text: str) -> Message:
+    """Create a pipeline (bot/system) message; it has no attachments, so the broadcast serializer need not query them."""
+    created = Message.objects.create(conversation=conversation, sender=sender, text=text)
+    created._prefetched_objects_cache = {"attachments": created.attachments.none()}
+    return created
+
+
 def _handle_user_message_logic(message_id):
     """
     Core logic: analyze message, flag if needed, create system/bot reply,
     escalate if high severity. Returns dict result.
     """
+    result, ctx = _prepare_user_message(message_id)
+    if result is not None:
+        return result
+
+    # 5) Not flagged -> generate bot reply via helper (handles LLM + fallback)
     try:
-        msg = Message.objects.get(id=message_id)
+        bot_msg = _generate_bot_reply_and_create_message(ctx)
+    except Exception as exc:
+        return _bot_reply_failed(message_id, exc)
+    return _bot_reply_ok(message_id, bot_msg)
+
+
+def _bot_reply_ok(message_id, bot_msg):
+    logger.info("Bot reply created for message %s -> bot_message_id=%s", message_id, bot_msg.id)
+    return {"status": "ok", "message_id": message_id, "bot_message_id": bot_msg.id}
+
+
+def _bot_reply_failed(message_id, exc):
+    logger.exception("Failed to create/broadcast bot message for user message %s", message_id)
+    return {"status": "error", "message_id": message_id, "error": str(exc)}
+
+
+def _prepare_user_message(message_id):
+    """
+    Steps 1-4 of the pipeline (load, dedup, NLU + safety, flag handling).
+    Returns (result, ctx): result is the final dict when no bot reply is
+    needed, otherwise None and the caller generates the reply from ``ctx``
+    (a MessageContext; None if the message does not exist).
+    """
+    try:
+        ctx = MessageContext.load(message_id)
     except Message.DoesNotExist:
         logger.warning("handle_user_message: Message %s does not exist", message_id)
-        return {"status": "missing", "message_id": message_id}
+        return {"status": "missing", "message_id": message_id}, None
 
+    msg, text, user_id = ctx.msg, ctx.text, ctx.user_id
     if msg.sender != "user":
         logger.debug("Skipping non-user message %s (sender=%s)", message_id, msg.sender)
-        return {"status": "skipped_non_user", "message_id": message_id}
+        return {"status": "skipped_non_user", "message_id": message_id}, ctx
 
-    text = _build_message_text(msg)
-    user_id = msg.conversation.user.id if msg.conversation.user else None
-    
-    # Check for duplicate messages within 5-second window
+    # Skip duplicate messages within the dedup window
     if user_id and not _should_process_message(user_id, text):
         logger.warning("Message %s rejected as duplicate (user %s)", message_id, user_id)
-        return {"status": "duplicate", "message_id": message_id}
+        return {"status": "duplicate", "message_id": message_id}, ctx
 
-    # 1) NLU analysis
+    # 1) NLU analysis + 2) Safety, from a single normalized/tokenized pass
     try:
-        nlp_meta = analyze_message(text)
+        nlp_meta, flagged, severity = analyze_and_check(text)
     except Exception:
         logger.exception("NLU analysis failed for message %s", message_id)
         nlp_meta = {"intent": "unknown", "intent_confidence": 0.0, "entities": {}, "sentiment": {}}
-
-    # 2) Safety
-    try:
-        flagged, severity = safety_check(text, nlp_meta)
-    except Exception:
-        logger.exception("safety_check failed for message %s", message_id)
-        flagged, severity = False, "low"
+        # Safety must still run even if the fused analysis failed.
+        try:
+            flagged, severity = safety_check(text, nlp_meta)
+        except Exception:
+            logger.exception("safety_check failed for message %s", message_id)
+            flagged, severity = False, "low"
+    ctx.nlp_meta, ctx.flagged, ctx.severity = nlp_meta, bool(flagged), severity
 
     # 3) Update message metadata
     msg.nlp_metadata = nlp_meta
@@ -231,49 +286,132 @@ def _handle_user_message_logic(message_id):
             "If you'd like, we can provide resources or request a human to reach out."
         )
         try:
-            sys_msg = Message.objects.create(conversation=msg.conversation, sender="system", text=sys_text)
+            sys_msg = _create_message(ctx.conversation, "system", sys_text)
+            record_lane_latency(LANE_CRISIS, (sys_msg.created_at - msg.created_at).total_seconds())
             _broadcast_message(sys_msg)
         except Exception:
             logger.exception("Failed to create/broadcast system message for flagged message %s", message_id)
 
         if severity == "high":
-            subject = f"[MHChat] High-severity flag (conv {msg.conversation.id})"
+            subject = f"[MHChat] High-severity flag (conv {ctx.conversation.id})"
             body = (
                 f"High severity message flagged.\n\n"
-                f"Conversation ID: {msg.conversation.id}\n"
-                f"User ID: {getattr(msg.conversation.user, 'id', 'N/A')}\n"
+                f"Conversation ID: {ctx.conversation.id}\n"
+                f"User ID: {user_id or 'N/A'}\n"
                 f"Message ID: {msg.id}\n"
                 f"Message text: {msg.text}\n"
                 f"Detected metadata: {nlp_meta}\n"
                 f"Time: {timezone.now().isoformat()}\n"
             )
             recipient_list = [a[1] for a in getattr(settings, "ADMINS", [])] or [getattr(settings, "DEFAULT_FROM_EMAIL", "admin@example.com")]
-            
-            # Send email in background thread to avoid blocking chat responses
-            def send_email_async():
-                try:
-                    send_mail(subject, body, getattr(settings, "DEFAULT_FROM_EMAIL", "mhchat@example.com"), recipient_list, fail_silently=False)
-                    logger.info("Escalation email sent for message %s to %s", message_id, recipient_list)
-                except Exception:
-                    logger.exception("Failed to send escalation email for message %s", message_id)
-            
-            # Start email send in background without blocking
-            email_thread = Thread(target=send_email_async, daemon=True)
-            email_thread.start()
-            logger.info("Escalation email queued for background send (message %s)", message_id)
-
-        return {"status": "flagged", "severity": severity, "message_id": message_id}
 
-    # 5) Not flagged -> generate bot reply via helper (handles LLM + fallback)
-    try:
-        bot_msg = _generate_bot_reply_and_create_message(msg)
-        logger.info("Bot reply created for message %s -> bot_message_id=%s", message_id, bot_msg.id)
-        return {"status": "ok", "message_id": message_id, "bot_message_id": bot_msg.id}
-    except Exception as exc:
-        logger.exception("Failed to create/broadcast bot message for user message %s", message_id)
-        return {"status": "error", "message_id": message_id, "error": str(exc)}
+            # Sent by a job (bounded pool / run_workers, retried there) so the chat reply never waits on SMTP
+            try:
+                enqueue(send_escalation_email, subject, body, recipient_list, message_id, lane=LANE_CRISIS)
+                logger.info("Escalation email queued (message %s)", message_id)
+            except Exception:
+                logger.exception("Failed to queue escalation email for message %s", message_id)
+
+        return {"status": "flagged", "severity": severity, "message_id": message_id}, ctx
+
+    return None, ctx
 
 
 def handle_user_message(message_id):
     return _handle_user_message_logic(message_id)
 
+
+def reply_lane(msg: Message) -> str:
+    """
+    Job lane for a new user message: crisis if the local safety check flags the
+    text the pipeline will analyze (message plus attachment text). The check is
+    a lexicon scan without the full NLU; it reads attachments, so call it off
+    the event loop.
+    """
+    try:
+        flagged, _ = safety_check(_build_message_text(msg))
+    except Exception:
+        logger.exception("reply_lane: safety_check failed; using the normal lane")
+        return LANE_NORMAL
+    return LANE_CRISIS if flagged else LANE_NORMAL
+
+
+def send_escalation_email(subject, body, recipient_list, message_id=None):
+    """Job: admin email for a high-severity flag. Raises on failure so the queue retries it."""
+    send_mail(subject, body, getattr(settings, "DEFAULT_FROM_EMAIL", "mhchat@example.com"), recipient_list, fail_silently=False)
+    logger.info("Escalation email sent for message %s to %s", message_id, recipient_list)
+
+
+async def handle_user_message_async(message_id, on_delta=None):
+    """
+    handle_user_message for the event loop: DB work runs via sync_to_async,
+    the mhchat-ml call is awaited (ml_brain_client.apredict) so a pending reply
+    does not hold a thread. ``on_delta`` streams the reply text as it arrives;
+    the bot Message is still created once, with the full text.
+    """
+    result, ctx = await sync_to_async(_prepare_with_history)(message_id)
+    if result is not None:
+        return result
+
+    try:
+        pred = await ml_apredict(ctx.text, conversation_id=ctx.conversation.id, context=ctx.history(), on_delta=on_delta)
+        bot_msg = await sync_to_async(_create_bot_reply)(ctx.msg, ctx.text, pred, ctx.nlp_meta)
+    except Exception as exc:
+        return _bot_reply_failed(message_id, exc)
+    return _bot_reply_ok(message_id, bot_msg)
+
+
+def _prepare_with_history(message_id):
+    """_prepare_user_message plus the ML context window, in one thread hop."""
+    result, ctx = _prepare_user_message(message_id)
+    if result is None:
+        ctx.history()  # loaded here, off the event loop
+    return result, ctx
+
+
+async def screen_user_message_async(message_id):
+    """
+    Steps 1-4 for one message right away (safety is never delayed). Returns the
+    final result dict, or None when the message still needs a bot reply.
+    """
+    result, _ = await sync_to_async(_prepare_user_message)(message_id)
+    return result
+
+
+def _burst_inputs(message_ids):
+    msgs = list(
+        Message.objects.select_related("conversation").prefetch_related("attachments")
+        .filter(id__in=message_ids).order_by("created_at", "id")
+    )
+    if not msgs:
+        return None, "", None
+    last = msgs[-1]
+    user_text = "\n".join(text for text in (_build_message_text(m) for m in msgs) if text)
+    return last, user_text, _fetch_context(last.conversation_id)
+
+
+def _create_burst_reply(msg: Message, user_text: str, pred, merged: bool) -> Message:
+    nlp_meta = None
+    if merged and not (isinstance(pred, dict) and pred.get("reply")):
+        # the local fallback should see the whole burst, not only its last fragment
+        nlp_meta = analyze_message(user_text)
+    return _create_bot_reply(msg, user_text, pred, nlp_meta)
+
+
+async def reply_to_messages_async(message_ids, on_delta=None):
+    """
+    One bot reply for a burst of screened user messages: their texts are sent
+    to mhchat-ml as a single message and the reply is attached to the last one.
+    """
+    msg, user_text, context = await sync_to_async(_burst_inputs)(message_ids)
+    if msg is None:
+        return {"status": "missing", "message_ids": list(message_ids)}
+    try:
+        pred = await ml_apredict(user_text, conversation_id=msg.conversation_id, context=context, on_delta=on_delta)
+        bot_msg = await sync_to_async(_create_burst_reply)(msg, user_text, pred, len(message_ids) > 1)
+    except Exception as exc:
+        return _bot_reply_failed(msg.id, exc)
+    result = _bot_reply_ok(msg.id, bot_msg)
+    result["coalesced"] = len(message_ids)
+    return result
+
@@ -0,0 +1,120 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from .conversation_executor import ConversationExecutor
+
+
+class ConversationExecutorTests(SimpleTestCase):
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_serial_within_a_conversation(self):
+        done = []
+
+        async def reply(name, delay):
+            await asyncio.sleep(delay)
+            done.append(name)
+
+        async def main():
+            executor = ConversationExecutor()
+            for name, delay in (("a1", 0.05), ("a2", 0.0), ("a3", 0.02)):
+                self.assertTrue(executor.submit("a", lambda n=name, d=delay: reply(n, d)))
+            await executor.drain()
+            return executor.stats()
+
+        stats = self.run_async(main())
+        self.assertEqual(done, ["a1", "a2", "a3"])
+        self.assertEqual((stats["processed"], stats["actors_started"]), (3, 1))
+
+    def test_parallel_across_conversations(self):
+        running = {"now": 0, "max": 0}
+
+        async def reply():
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            await asyncio.sleep(0.05)
+            running["now"] -= 1
+
+        async def main():
+            executor = ConversationExecutor()
+            for conv in range(5):
+                executor.submit(conv, reply)
+                executor.submit(conv, reply)
+            await executor.drain()
+
+        self.run_async(main())
+        self.assertEqual(running["max"], 5)
+
+    def test_bounded_queue_and_errors(self):
+        async def boom():
+            raise RuntimeError("boom")
+
+        async def main():
+            executor = ConversationExecutor(queue_size=2)
+            self.assertTrue(executor.submit("c", boom))
+            self.assertTrue(executor.submit("c", boom))
+            self.assertTrue(executor.full("c"))
+            self.assertFalse(executor.submit("c", boom))
+            self.assertTrue(executor.submit("other", boom))
+            await executor.drain()
+            return executor.stats()
+
+        stats = self.run_async(main())
+        self.assertEqual((stats["rejected"], stats["errors"], stats["processed"]), (1, 3, 3))
+
+    def test_idle_actors_are_reaped(self):
+        async def noop():
+            pass
+
+        async def main():
+            executor = ConversationExecutor()
+            executor.submit("c", noop)
+            self.assertEqual(executor.stats()["actors"], 1)
+            await executor.drain()
+            # a new burst after the actor exited starts a fresh one
+            executor.submit("c", noop)
+            await executor.drain()
+            return executor.stats()
+
+        stats = self.run_async(main())
+        self.assertEqual((stats["actors"], stats["queued"], stats["actors_reaped"], stats["actors_started"]), (0, 0, 2, 2))
+
+    def test_debounce_coalesces_a_burst(self):
+        flushed = []
+
+        async def flush(items):
+            flushed.append(list(items))
+
+        async def main():
+            executor = ConversationExecutor()
+            for item in ("hey", "so"):
+                executor.debounce("c", item, flush, 0.05)
+                await asyncio.sleep(0.01)
+            executor.debounce("c", "i feel awful today", flush, 0.05)
+            executor.debounce("other", "hello", flush, 0.05)
+            await asyncio.sleep(0.12)
+            executor.debounce("c", "later", flush, 0.05)
+            await executor.drain()
+            return executor.stats()
+
+        stats = self.run_async(main())
+        self.assertEqual(flushed, [["hey", "so", "i feel awful today"], ["hello"], ["later"]])
+        self.assertEqual((stats["bursts"], stats["coalesced"], stats["open_bursts"]), (3, 2, 0))
+
+    def test_debounce_max_wait_closes_a_long_burst(self):
+        flushed = []
+
+        async def flush(items):
+            flushed.append(list(items))
+
+        async def main():
+            executor = ConversationExecutor()
+            for i in range(8):
+                executor.debounce("c", i, flush, 0.05, max_wait_s=0.1)
+                await asyncio.sleep(0.03)
+            await executor.drain()
+
+        self.run_async(main())
+        self.assertGreater(len(flushed), 1)
+        self.assertEqual([i for burst in flushed for i in burst], list(range(8)))
@@ -0,0 +1,74 @@
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from . import dedup
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LocalDedupStoreTests(SimpleTestCase):
+    def test_duplicates_within_the_window(self):
+        clock = _Clock()
+        store = dedup.LocalDedupStore(window_s=5, clock=clock)
+        key = dedup.dedup_key(1, "hello")
+        self.assertTrue(store.check_and_add(key))
+        clock.now += 4
+        self.assertFalse(store.check_and_add(key))
+        self.assertTrue(store.check_and_add(dedup.dedup_key(2, "hello")))  # other user
+        clock.now += 1.5
+        self.assertTrue(store.check_and_add(key))
+        stats = store.stats()
+        self.assertEqual((stats["checks"], stats["duplicates"]), (4, 1))
+
+    def test_idle_entries_expire_without_a_new_message(self):
+        clock = _Clock()
+        store = dedup.LocalDedupStore(window_s=5, clock=clock)
+        for user in range(100):
+            store.check_and_add(dedup.dedup_key(user, "hi"))
+        self.assertEqual(store.stats()["entries"], 100)
+        clock.now += 7
+        store.check_and_add(dedup.dedup_key("someone else", "hi"))
+        stats = store.stats()
+        self.assertEqual((stats["entries"], stats["expired"]), (1, 100))
+
+    def test_entry_cap_evicts_oldest(self):
+        clock = _Clock()
+        store = dedup.LocalDedupStore(window_s=60, max_entries=10, clock=clock)
+        first = dedup.dedup_key(0, "x")
+        store.check_and_add(first)
+        for user in range(1, 20):
+            clock.now += 1
+            store.check_and_add(dedup.dedup_key(user, "x"))
+        stats = store.stats()
+        self.assertEqual((stats["entries"], stats["evictions"]), (10, 10))
+        self.assertTrue(store.check_and_add(first))  # evicted, so new again
+
+
+class DedupBackendTests(SimpleTestCase):
+    def setUp(self):
+        dedup.reset_dedup_store()
+
+    def tearDown(self):
+        dedup.reset_dedup_store()
+
+    @override_settings(MHCHAT_DEDUP_BACKEND="django")
+    def test_django_cache_backend_is_shared(self):
+        caches["default"].clear()
+        self.assertTrue(dedup.is_new_message(7, "same text"))
+        # another worker: a fresh store over the same cache
+        other = dedup.DjangoDedupStore(window_s=5)
+        self.assertFalse(other.check_and_add(dedup.dedup_key(7, "same text")))
+        self.assertFalse(dedup.is_new_message(7, "same text"))
+        self.assertEqual(dedup.dedup_stats()["duplicates"], 1)
+
+    @override_settings(MHCHAT_DEDUP_BACKEND="off")
+    def test_off(self):
+        self.assertTrue(dedup.is_new_message(7, "same text"))
+        self.assertTrue(dedup.is_new_message(7, "same text"))
+        self.assertIsNone(dedup.get_dedup_store())
@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from . import intent_model
+from .nlp import analyze_message, analyze_messages
+
+
+def _write_artifact(root, version="v1"):
+    path = os.path.join(root, version)
+    os.makedirs(path)
+    with open(os.path.join(path, "vocabulary.json"), "w") as fh:
+        json.dump({"hello": 0, "sad": 1, "cope": 2}, fh)
+    np.save(os.path.join(path, "idf.npy"), np.ones(3, dtype=np.float32))
+    # columns: greeting, mood_check, coping
+    np.save(os.path.join(path, "coef.npy"), np.eye(3, dtype=np.float32) * 5)
+    np.save(os.path.join(path, "intercept.npy"), np.zeros(3, dtype=np.float32))
+    with open(os.path.join(path, "manifest.json"), "w") as fh:
+        json.dump({"format": "tfidf-logreg", "version": version,
+                   "classes": ["greeting", "mood_check", "coping"], "ngram_range": [1, 2]}, fh)
+    with open(os.path.join(root, "LATEST"), "w") as fh:
+        fh.write(version)
+
+
+class IntentModelTest(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        _write_artifact(self.tmp.name)
+        self.clf = intent_model.load_classifier(intent_model.resolve_artifact(self.tmp.name))
+        intent_model.set_intent_classifier(self.clf)
+
+    def tearDown(self):
+        intent_model.reset_intent_classifier()
+        self.tmp.cleanup()
+
+    def test_weights_are_memory_mapped_on_first_use(self):
+        self.assertFalse(self.clf._loaded)
+        proba = self.clf.predict_proba(["hello", "so sad", "nothing known"])
+        self.assertIsInstance(self.clf._coef, np.memmap)
+        self.assertEqual(proba.shape, (3, 3))
+        np.testing.assert_allclose(proba.sum(axis=1), 1.0, rtol=1e-6)
+        np.testing.assert_allclose(proba[2], 1 / 3, rtol=1e-6)
+
+    def test_model_intent_and_confidence(self):
+        meta = analyze_message("I feel sad")
+        self.assertEqual(meta["intent"], "mood_check")
+        self.assertGreater(meta["intent_confidence"], 0.9)
+        self.assertEqual(meta["intent_model"], "v1")
+        self.assertEqual(analyze_messages(["help me cope"])[0]["intent"], "help_request")
+
+    def test_rules_keep_suicidal_and_low_confidence(self):
+        self.assertEqual(analyze_message("sad, I want to die")["intent"], "suicidal")
+        meta = analyze_message("thanks anyway")
+        self.assertEqual(meta["intent"], "thanks")
+        self.assertEqual(meta["intent_confidence"], 0.7)
+
+    def test_no_artifact_falls_back_to_rules(self):
+        intent_model.set_intent_classifier(None)
+        meta = analyze_message("I feel sad")
+        self.assertEqual(meta["intent"], "negative")
+        self.assertNotIn("intent_model", meta)
+
+
+class HashedLinearFormatTest(SimpleTestCase):
+    def test_compiled_file_matches_source_model(self):
+        with tempfile.TemporaryDirectory() as root:
+            _write_artifact(root)
+            src = intent_model.load_classifier(os.path.join(root, "v1"))
+            vocab = {"hello": 0, "sad": 1, "cope": 2}
+            out = os.path.join(root, "v1-hlm")
+            os.makedirs(out)
+            intent_model.write_hashed_linear(
+                os.path.join(out, "model.hlm"), {}, vocab,
+                np.ones(3), np.eye(3) * 5, np.zeros(3),
+            )
+            with open(os.path.join(out, "manifest.json"), "w") as fh:
+                json.dump({"format": "hashed-linear", "version": "v1-hlm", "file": "model.hlm",
+                           "classes": ["greeting", "mood_check", "coping"], "ngram_range": [1, 2]}, fh)
+
+            compiled = intent_model.load_classifier(out)
+            self.assertIsInstance(compiled, intent_model.HashedLinearClassifier)
+            texts = ["hello hello", "sad and cope", "unknown words only"]
+            np.testing.assert_allclose(compiled.predict_proba(texts), src.predict_proba(texts), rtol=1e-6)
+            self.assertIsNone(compiled._feature_index("unknown"))
+            self.assertEqual(compiled._feature_index("cope"), 2)
@@ -0,0 +1,181 @@
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import jobs
+from .models import Conversation, Job, Message
+
+User = get_user_model()
+
+CALLS = []
+
+
+def record(value, tag=None):
+    CALLS.append((value, tag))
+
+
+def flaky(value):
+    CALLS.append(value)
+    if len(CALLS) < 2:
+        raise RuntimeError("transient")
+
+
+def always_fails():
+    raise RuntimeError("boom")
+
+
+def blocked(gate):
+    GATES[gate].wait(5)
+
+
+GATES = {}
+
+
+@override_settings(MHCHAT_JOBS_BACKEND="db", MHCHAT_JOBS_RETRY_BASE_S=0, MHCHAT_ML_API_BASE="http://127.0.0.1:9",
+                   MHCHAT_ML_HEALTH_INTERVAL_S=0)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+        self.worker = jobs.Worker(workers=0, visibility_s=60)
+
+    def test_enqueue_and_run(self):
+        job = jobs.enqueue(record, 1, tag="x")
+        self.assertEqual((job.name, job.args, job.kwargs, job.status), ("chat.test_jobs.record", [1], {"tag": "x"}, "pending"))
+        self.worker.run(once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("done", 1))
+        self.assertEqual(CALLS, [(1, "x")])
+        self.assertEqual(jobs.job_queue_stats()["done"], 1)
+
+    def test_rejects_unimportable_functions(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue(lambda: None)
+
+    def test_retries_then_succeeds(self):
+        job = jobs.enqueue(flaky, "a")
+        self.worker.run(once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), ("done", 2, "RuntimeError: transient"))
+
+    def test_gives_up_after_max_attempts(self):
+        job = jobs.enqueue(always_fails, max_attempts=2)
+        self.worker.run(once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("failed", 2))
+        self.assertEqual(self.worker.stats()["failed"], 1)
+
+    def test_delayed_jobs_wait(self):
+        job = jobs.enqueue(record, 1, delay_s=60)
+        self.assertEqual(self.worker.claim(5), [])
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.assertEqual([j.id for j in self.worker.claim(5)], [job.id])
+
+    def test_lease_blocks_others_until_it_expires(self):
+        job = jobs.enqueue(record, 1)
+        [first] = self.worker.claim(5)
+        other = jobs.Worker(workers=0, name="other")
+        self.assertEqual(other.claim(5), [])
+        Job.objects.filter(id=job.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        [reclaimed] = other.claim(5)
+        self.assertEqual(reclaimed.attempts, 2)
+        # the first worker lost its lease: its late result is dropped
+        self.worker.run_job(first)
+        self.assertEqual(self.worker.stats()["lost_leases"], 1)
+        other.run_job(reclaimed)
+        self.assertEqual(Job.objects.get(id=job.id).status, "done")
+
+    def test_reply_pipeline_through_the_queue(self):
+        user = User.objects.create_user(username="jobs", password="pass")
+        conv = Conversation.objects.create(user=user)
+        msg = Message.objects.create(conversation=conv, sender="user", text="i had a good day actually")
+        from .tasks import handle_user_message
+        jobs.enqueue(handle_user_message, msg.id)
+        out = StringIO()
+        call_command("run_workers", workers=0, once=True, stdout=out)
+        self.assertIn("'done': 1", out.getvalue())
+        self.assertTrue(conv.messages.filter(sender="bot").exists())
+
+
+class InlineBackendTests(TestCase):
+    def test_runs_on_the_bounded_pool(self):
+        CALLS.clear()
+        with override_settings(MHCHAT_JOBS_BACKEND="inline"):
+            fut = jobs.enqueue(record, 7)
+        fut.result(timeout=5)
+        self.assertEqual(CALLS, [(7, None)])
+
+    def test_escalation_email_is_queued(self):
+        from .tasks import send_escalation_email
+        with override_settings(MHCHAT_JOBS_BACKEND="db"), mock.patch("chat.tasks.send_mail") as send:
+            jobs.enqueue(send_escalation_email, "s", "b", ["a@example.com"], 1)
+            jobs.Worker(workers=0).run(once=True)
+        send.assert_called_once()
+
+
+@override_settings(MHCHAT_JOBS_BACKEND="db", MHCHAT_ML_API_BASE="http://127.0.0.1:9", MHCHAT_ML_HEALTH_INTERVAL_S=0)
+class PriorityLaneTests(TestCase):
+    CRISIS_TEXT = "i feel suicidal and i want to end my life"
+
+    def setUp(self):
+        CALLS.clear()
+        jobs.reset_lane_stats()
+
+    def test_reply_lane_uses_the_safety_check(self):
+        from .models import MessageAttachment
+        from .tasks import reply_lane
+        user = User.objects.create_user(username="lane", password="pass")
+        conv = Conversation.objects.create(user=user)
+        crisis = Message.objects.create(conversation=conv, sender="user", text=self.CRISIS_TEXT)
+        calm = Message.objects.create(conversation=conv, sender="user", text="what a lovely afternoon")
+        self.assertEqual(reply_lane(crisis), jobs.LANE_CRISIS)
+        self.assertEqual(reply_lane(calm), jobs.LANE_NORMAL)
+        # a disclosure in an attachment counts too
+        MessageAttachment.objects.create(message=calm, file="attachments/diary.txt", file_name="diary.txt",
+                                         text_content=self.CRISIS_TEXT)
+        self.assertEqual(reply_lane(calm), jobs.LANE_CRISIS)
+
+    def test_crisis_jobs_are_claimed_first(self):
+        for i in range(3):
+            jobs.enqueue(record, i)
+        crisis = jobs.enqueue(record, "crisis", lane=jobs.LANE_CRISIS)
+        worker = jobs.Worker(workers=0)
+        worker.run(once=True)
+        self.assertEqual(CALLS[0], ("crisis", None))
+        self.assertEqual(worker.stats()["crisis_claimed"], 1)
+        self.assertEqual(Job.objects.get(id=crisis.id).lane, "crisis")
+        with self.assertRaises(ValueError):
+            jobs.enqueue(record, 1, lane="urgent")
+
+    def test_time_to_reply_is_tracked_per_lane(self):
+        from .tasks import handle_user_message, reply_lane
+        user = User.objects.create_user(username="lanes", password="pass")
+        conv = Conversation.objects.create(user=user)
+        for text in (self.CRISIS_TEXT, "the weather was nice on my walk"):
+            msg = Message.objects.create(conversation=conv, sender="user", text=text)
+            jobs.enqueue(handle_user_message, msg.id, lane=reply_lane(msg))
+        self.assertEqual(jobs.job_queue_stats()["pending_by_lane"], {"crisis": 1, "normal": 1})
+        jobs.Worker(workers=0).run(once=True)
+        stats = jobs.lane_stats()
+        self.assertEqual((stats["crisis"]["samples"], stats["normal"]["samples"]), (1, 1))
+        self.assertIsNotNone(stats["crisis"]["p95_ms"])
+
+
+class InlineLaneTests(TestCase):
+    def test_crisis_lane_runs_while_normal_lane_is_saturated(self):
+        CALLS.clear()
+        GATES["normal"] = threading.Event()
+        try:
+            with override_settings(MHCHAT_JOBS_BACKEND="inline"):
+                for _ in range(jobs._inline_pool(jobs.LANE_NORMAL)._max_workers + 2):
+                    jobs.enqueue(blocked, "normal")
+                fut = jobs.enqueue(record, "crisis", lane=jobs.LANE_CRISIS)
+            fut.result(timeout=2)
+            self.assertEqual(CALLS, [("crisis", None)])
+        finally:
+            GATES["normal"].set()
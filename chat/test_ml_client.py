@@ -0,0 +1,712 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.test import TestCase, override_settings
+
+from . import ml_async, ml_batch, ml_cache, ml_codec, ml_deadline, ml_health, ml_http
+from .ml_fake_server import FaultProfile, parse_latency, start_fake_ml_server
+from .ml_brain_client import apredict, is_ml_service_healthy, predict
+
+
+class _FakeML(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._send(200, {"status": "ok"})
+
+    delay_s = 0.0
+    batch_supported = True
+    batch_sizes = None  # per-subclass list of /predict_batch sizes
+
+    @staticmethod
+    def _predict(payload):
+        return {"intent": "casual_chat", "intent_score": 0.9, "crisis": False, "kb_hits": [], "seen": payload["message"]}
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.delay_s)
+        if self.path == "/predict":
+            self._send(200, self._predict(payload))
+        elif self.path == "/predict_batch":
+            if not self.batch_supported:
+                return self._send(404, {"detail": "Not Found"})
+            self.batch_sizes.append(len(payload["items"]))
+            self._send(200, {"results": [self._predict(item) for item in payload["items"]]})
+        elif payload.get("stream"):
+            self._stream_reply(f"echo: {payload['message']}")
+        else:
+            self._send(200, {"reply": f"echo: {payload['message']}"})
+
+    stream_gap_s = 0.0
+    stream_break_after = None  # drop the connection after this many deltas
+
+    def _stream_reply(self, reply):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        for i, word in enumerate(reply.split(" ")):
+            if self.stream_break_after is not None and i >= self.stream_break_after:
+                self.close_connection = True
+                return
+            delta = word if i == 0 else " " + word
+            chunk(f"data: {json.dumps({'delta': delta})}\n\n".encode())
+            time.sleep(self.stream_gap_s)
+        chunk(b'data: {"done": true, "sources": ["kb"]}\n\n')
+        chunk(b"data: [DONE]\n\n")
+        chunk(b"")
+
+
+def start_fake_ml(handler=_FakeML):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class PooledHTTPClientTests(TestCase):
+    def setUp(self):
+        self.server, self.base = start_fake_ml()
+        self.settings_ctx = override_settings(MHCHAT_ML_API_BASE=self.base, MHCHAT_ML_HEALTH_INTERVAL_S=0)
+        self.settings_ctx.enable()
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+        ml_cache.reset_ml_response_cache()
+
+    def tearDown(self):
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+        ml_cache.reset_ml_response_cache()
+        self.settings_ctx.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_predict_reuses_one_connection(self):
+        self.assertTrue(is_ml_service_healthy())
+        for i in range(3):
+            res = predict(f"hello {i}")
+            self.assertEqual(res["reply"], f"echo: hello {i}")
+        stats = ml_http.ml_http_stats()
+        # one /health, then /predict + /chat per message
+        self.assertEqual(stats["requests"], 7)
+        self.assertEqual(stats["connects"], 1)
+        self.assertEqual(stats["reuses"], 6)
+        self.assertEqual(stats["idle"], 1)
+
+    def test_stale_connection_is_retried_once(self):
+        client = ml_http.get_ml_http_client()
+        self.assertEqual(client.request("GET", "/health").status, 200)
+        # Server drops idle keep-alive connections (e.g. after a restart).
+        conn, _ = client._idle[-1]
+        conn.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(client.request("GET", "/health").status, 200)
+        self.assertEqual(client.stats()["stale_retries"], 1)
+
+    def test_unreachable_service_falls_back(self):
+        with override_settings(MHCHAT_ML_API_BASE="http://127.0.0.1:9"):
+            self.assertFalse(is_ml_service_healthy(timeout_s=0.5))
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.breaker = ml_health.CircuitBreaker(failure_threshold=2, reset_timeout_s=10, clock=lambda: self.now)
+
+    def test_open_half_open_closed(self):
+        b = self.breaker
+        self.assertTrue(b.allow())
+        b.record_failure()
+        b.record_failure()
+        self.assertEqual(b.state, ml_health.OPEN)
+        self.assertFalse(b.allow())
+
+        self.now += 10
+        self.assertTrue(b.allow())  # the half-open trial
+        self.assertFalse(b.allow())  # only one at a time
+        b.record_failure()
+        self.assertEqual(b.state, ml_health.OPEN)
+
+        self.now += 10
+        self.assertTrue(b.allow())
+        b.record_success()
+        self.assertEqual(b.state, ml_health.CLOSED)
+        stats = b.stats()
+        self.assertEqual(stats["transitions"], {"closed->open": 1, "open->half_open": 2, "half_open->open": 1, "half_open->closed": 1})
+        self.assertEqual(stats["short_circuits"], 2)
+
+    def test_probe_results_drive_breaker(self):
+        healthy = [False]
+        prober = ml_health.HealthProber(lambda timeout_s: healthy[0], self.breaker)
+        prober.probe_once()
+        prober.probe_once()
+        self.assertEqual(self.breaker.state, ml_health.OPEN)
+        healthy[0] = True
+        prober.probe_once()
+        self.assertEqual(self.breaker.state, ml_health.HALF_OPEN)
+        self.assertEqual(prober.stats()["probe_failures"], 2)
+
+    def test_one_failed_probe_does_not_open_the_breaker(self):
+        def slow_health(timeout_s):
+            raise TimeoutError("GC pause")
+
+        ml_health.HealthProber(slow_health, self.breaker).probe_once()
+        self.assertEqual(self.breaker.state, ml_health.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+
+@override_settings(MHCHAT_ML_API_BASE="http://127.0.0.1:9", MHCHAT_ML_HEALTH_INTERVAL_S=0, MHCHAT_ML_BREAKER_FAILURES=2)
+class PredictBreakerTests(TestCase):
+    def setUp(self):
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+        ml_cache.reset_ml_response_cache()
+
+    def tearDown(self):
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+        ml_cache.reset_ml_response_cache()
+
+    def test_open_breaker_short_circuits(self):
+        self.assertIsNone(predict("hello"))  # connection refused twice -> open
+        self.assertEqual(ml_health.get_ml_breaker().state, ml_health.OPEN)
+        requests_before = ml_http.ml_http_stats()["requests"]
+        self.assertIsNone(predict("hello again"))
+        self.assertEqual(ml_http.ml_http_stats()["requests"], requests_before)
+        self.assertEqual(ml_health.ml_breaker_stats()["short_circuits"], 2)
+
+
+class AsyncPredictTests(TestCase):
+    def setUp(self):
+        self.server, self.base = start_fake_ml(type("SlowML", (_FakeML,), {"delay_s": 0.05}))
+        self.settings_ctx = override_settings(
+            MHCHAT_ML_API_BASE=self.base, MHCHAT_ML_HEALTH_INTERVAL_S=0, MHCHAT_ML_ASYNC_CONCURRENCY=4,
+        )
+        self.settings_ctx.enable()
+        ml_health.reset_ml_health()
+        ml_cache.reset_ml_response_cache()
+        ml_async.reset_async_ml_clients()
+
+    def tearDown(self):
+        ml_async.reset_async_ml_clients()
+        ml_health.reset_ml_health()
+        ml_cache.reset_ml_response_cache()
+        self.settings_ctx.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_concurrent_calls_share_bounded_pool(self):
+        async def run():
+            results = await asyncio.gather(*(apredict(f"m{i}", context=[]) for i in range(12)))
+            return results, ml_async.get_async_ml_client().stats()
+
+        results, stats = asyncio.run(run())
+        self.assertEqual([r["reply"] for r in results], [f"echo: m{i}" for i in range(12)])
+        self.assertEqual(stats["requests"], 24)
+        self.assertLessEqual(stats["max_in_flight"], 4)
+        self.assertLessEqual(stats["connects"], 4)
+        self.assertEqual(stats["reuses"], 24 - stats["connects"])
+
+    def test_unreachable_service_returns_none(self):
+        with override_settings(MHCHAT_ML_API_BASE="http://127.0.0.1:9", MHCHAT_ML_BREAKER_FAILURES=1):
+            self.assertIsNone(asyncio.run(apredict("hello", context=[])))
+
+
+class PredictBatchingTests(TestCase):
+    def start(self, **attrs):
+        handler = type("BatchML", (_FakeML,), {"batch_sizes": [], **attrs})
+        self.server, base = start_fake_ml(handler)
+        self.handler = handler
+        self.settings_ctx = override_settings(
+            MHCHAT_ML_API_BASE=base, MHCHAT_ML_HEALTH_INTERVAL_S=0,
+            MHCHAT_ML_BATCH_MAX_SIZE=8, MHCHAT_ML_BATCH_MAX_WAIT_MS=50,
+        )
+        self.settings_ctx.enable()
+
+    def setUp(self):
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+        ml_cache.reset_ml_response_cache()
+        ml_batch.reset_predict_batcher()
+
+    def tearDown(self):
+        ml_batch.reset_predict_batcher()
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+        ml_cache.reset_ml_response_cache()
+        self.settings_ctx.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _predict_concurrently(self, n):
+        results = [None] * n
+
+        def call(i):
+            results[i] = predict(f"msg {i}")
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_concurrent_predicts_share_batches(self):
+        self.start()
+        results = self._predict_concurrently(12)
+        self.assertEqual([r["seen"] for r in results], [f"msg {i}" for i in range(12)])
+        self.assertEqual(sum(self.handler.batch_sizes), 12)
+        self.assertLess(len(self.handler.batch_sizes), 12)
+        stats = ml_batch.ml_batch_stats()
+        self.assertEqual(stats["items"], 12)
+        self.assertGreater(stats["mean_batch"], 1)
+
+    def test_async_callers_use_the_batcher(self):
+        self.start()
+
+        async def run():
+            return await asyncio.gather(*(apredict(f"a{i}", context=[]) for i in range(6)))
+
+        results = asyncio.run(run())
+        self.assertEqual([r["seen"] for r in results], [f"a{i}" for i in range(6)])
+        self.assertEqual(sum(self.handler.batch_sizes), 6)
+
+    def test_service_without_batch_endpoint_falls_back(self):
+        self.start(batch_supported=False)
+        self.assertEqual(predict("hello")["seen"], "hello")
+        self.assertFalse(ml_batch.ml_batch_stats()["supported"])
+        self.assertEqual(predict("again")["seen"], "again")
+
+
+class PredictBatcherCancelTests(TestCase):
+    def test_cancelled_caller_does_not_starve_its_batch(self):
+        def send(payloads):
+            time.sleep(0.2)
+            return [{"seen": p["message"]} for p in payloads]
+
+        batcher = ml_batch.PredictBatcher(send, max_size=8, max_wait_ms=50)
+
+        async def run():
+            futs = [asyncio.wrap_future(batcher.submit({"message": f"m{i}"})) for i in range(3)]
+            futs[0].cancel()  # gives up while queued
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(futs[1], 0.1)  # gives up while the batch is being sent
+            return await asyncio.wait_for(futs[2], 1.0)
+
+        try:
+            self.assertEqual(asyncio.run(run()), {"seen": "m2"})
+            stats = batcher.stats()
+            self.assertEqual((stats["items"], stats["cancelled"], stats["errors"]), (3, 1, 0))
+        finally:
+            batcher.close()
+
+
+def _empty_chat_reply(self):
+    if self.path == "/chat":
+        self.rfile.read(int(self.headers["Content-Length"]))
+        return self._send(200, {"reply": ""})
+    return _FakeML.do_POST(self)
+
+
+def _chat_without_crisis(self):
+    if self.path == "/chat":
+        self.rfile.read(int(self.headers["Content-Length"]))
+        return self._send(200, {"reply": "I'm here with you.", "crisis": False})
+    return _FakeML.do_POST(self)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.server, base = start_fake_ml(type("CountingML", (_FakeML,), {}))
+        self.settings_ctx = override_settings(MHCHAT_ML_API_BASE=base, MHCHAT_ML_HEALTH_INTERVAL_S=0)
+        self.settings_ctx.enable()
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+        ml_cache.reset_ml_response_cache()
+
+    def tearDown(self):
+        ml_cache.reset_ml_response_cache()
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+        self.settings_ctx.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_repeat_message_is_served_from_cache(self):
+        first = predict("Hello  there")
+        first["reply"] = "mutated by caller"
+        requests = ml_http.ml_http_stats()["requests"]
+        second = predict("hello there")
+        self.assertEqual(second["reply"], "echo: Hello  there")
+        self.assertEqual(ml_http.ml_http_stats()["requests"], requests)
+        stats = ml_cache.ml_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_predict_only_results_are_not_cached(self):
+        # /chat answered without a reply: the /predict fallback is returned but not stored
+        self.server.RequestHandlerClass.do_POST = _empty_chat_reply
+        first = predict("hello there")
+        self.assertNotIn("echo", first["reply"])
+        self.assertEqual(ml_cache.ml_cache_stats()["stores"], 0)
+        predict("hello there")
+        self.assertEqual(ml_cache.ml_cache_stats()["hits"], 0)
+
+    def test_crisis_from_predict_survives_the_chat_merge(self):
+        # /predict flags the message; /chat says crisis: false about its own reply
+        self.server.RequestHandlerClass._predict = staticmethod(lambda payload: {"intent": "suicidal", "crisis": True, "kb_hits": []})
+        self.server.RequestHandlerClass.do_POST = _chat_without_crisis
+        self.assertTrue(predict("i can't go on")["crisis"])
+        stats = ml_cache.ml_cache_stats()
+        self.assertEqual((stats["stores"], stats["skipped_crisis"]), (0, 1))
+        self.assertTrue(predict("i can't go on")["crisis"])
+        self.assertEqual(ml_cache.ml_cache_stats()["hits"], 0)
+
+    def test_apredict_makes_the_same_merge_and_cache_decisions(self):
+        self.server.RequestHandlerClass._predict = staticmethod(lambda payload: {"intent": "suicidal", "crisis": True, "kb_hits": []})
+        self.server.RequestHandlerClass.do_POST = _chat_without_crisis
+        self.assertEqual(asyncio.run(apredict("i can't go on", context=[])), predict("i can't go on", context=[]))
+        self.assertEqual(ml_cache.ml_cache_stats()["skipped_crisis"], 2)
+
+    def test_cache_hit_leaves_the_half_open_trial(self):
+        predict("hello there")
+        breaker = ml_health.get_ml_breaker()
+        breaker.trip()
+        breaker.probe_succeeded()
+        self.assertEqual(predict("hello there")["reply"], "echo: hello there")
+        self.assertTrue(breaker.allow())  # the trial is still there for a real call
+
+    def test_crisis_results_are_not_cached(self):
+        cache = ml_cache.LocalResponseCache()
+        cache.put("k", {"crisis": True, "reply": "call 988"})
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats()["skipped_crisis"], 1)
+
+    def test_ttl_and_caps(self):
+        now = [0.0]
+        cache = ml_cache.LocalResponseCache(max_entries=2, ttl_s=10, clock=lambda: now[0])
+        for k in "abc":
+            cache.put(k, {"reply": k})
+        self.assertIsNone(cache.get("a"))  # LRU-evicted
+        self.assertEqual(cache.get("c"), {"reply": "c"})
+        now[0] = 11
+        self.assertIsNone(cache.get("c"))  # expired
+        stats = cache.stats()
+        self.assertEqual((stats["evictions"], stats["expired"], stats["entries"]), (1, 1, 1))
+
+        small = ml_cache.LocalResponseCache(max_bytes=60)
+        small.put("x", {"reply": "x" * 30})
+        small.put("y", {"reply": "y" * 30})
+        self.assertEqual(small.stats()["entries"], 1)
+
+    def test_django_backend(self):
+        with override_settings(MHCHAT_ML_CACHE_BACKEND="django"):
+            cache = ml_cache.get_ml_response_cache()
+            self.assertIsInstance(cache, ml_cache.DjangoResponseCache)
+            key = ml_cache.prediction_cache_key("hi", [])
+            cache.put(key, {"reply": "hey"})
+            self.assertEqual(cache.get(key), {"reply": "hey"})
+
+
+class StreamingChatTests(TestCase):
+    def start(self, **attrs):
+        handler = type("StreamML", (_SlowPathML,), {"lock": threading.Lock(), "predict_calls": [], **attrs})
+        self.server, base = start_fake_ml(handler)
+        self.settings_ctx = override_settings(MHCHAT_ML_API_BASE=base, MHCHAT_ML_HEALTH_INTERVAL_S=0, MHCHAT_ML_CACHE_BACKEND="off")
+        self.settings_ctx.enable()
+
+    def setUp(self):
+        ml_health.reset_ml_health()
+        ml_async.reset_async_ml_clients()
+
+    def tearDown(self):
+        ml_async.reset_async_ml_clients()
+        ml_health.reset_ml_health()
+        self.settings_ctx.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _run(self, message):
+        deltas = []
+
+        async def on_delta(text):
+            deltas.append((time.monotonic(), text))
+
+        async def run():
+            started = time.monotonic()
+            result = await apredict(message, context=[], on_delta=on_delta)
+            return started, result
+
+        started, result = asyncio.run(run())
+        return started, result, deltas
+
+    def test_stale_pooled_connection_is_retried_for_streams(self):
+        self.start()
+
+        async def run():
+            client = ml_async.get_async_ml_client()
+            self.assertEqual((await client.request("GET", "/health")).status, 200)
+            # the connection dies while idle; the loop has not seen the EOF yet
+            reader, writer, _ = client._idle[-1]
+            writer.transport.get_extra_info("socket").shutdown(socket.SHUT_RDWR)
+            body = json.dumps({"message": "one two", "context": [], "stream": True}).encode()
+            async with client.stream("POST", "/chat", body, {"Content-Type": "application/json"}) as resp:
+                data = b"".join([chunk async for chunk in resp.chunks()])
+            return resp.status, data, client.stats()
+
+        status, data, stats = asyncio.run(run())
+        self.assertEqual(status, 200)
+        self.assertIn(b"echo:", data)
+        self.assertEqual(stats["stale_retries"], 1)
+
+    def test_deltas_arrive_before_the_full_reply(self):
+        self.start(stream_gap_s=0.05)
+        started, result, deltas = self._run("one two three four")
+        self.assertEqual("".join(d for _, d in deltas), "echo: one two three four")
+        self.assertEqual(result["reply"], "echo: one two three four")
+        self.assertEqual(result["sources"], ["kb"])
+        self.assertEqual(result["seen"], "one two three four")  # /predict keys kept
+        # first piece long before the last (5 deltas, 50ms apart)
+        self.assertLess(deltas[0][0] - started, deltas[-1][0] - started - 0.1)
+
+    def test_broken_stream_falls_back_to_predict_reply(self):
+        self.start(stream_break_after=2)
+        _, result, deltas = self._run("one two three")
+        self.assertEqual(len(deltas), 2)
+        self.assertNotIn("echo", result["reply"])  # _build_reply text, not the partial stream
+
+    def test_started_stream_outlives_the_deadline(self):
+        # 5 deltas 100ms apart: well past the 0.25s budget, but the user is
+        # already reading the reply, so it is finished and kept
+        self.start(stream_gap_s=0.1)
+        with override_settings(MHCHAT_ML_DEADLINE_S=0.25):
+            _, result, deltas = self._run("one two three four")
+        self.assertEqual("".join(d for _, d in deltas), "echo: one two three four")
+        self.assertEqual(result["reply"], "echo: one two three four")
+
+    def test_deadline_bounds_the_wait_for_the_first_delta(self):
+        self.start(path_delay_s={"/chat": 1.0})
+        with override_settings(MHCHAT_ML_DEADLINE_S=0.25):
+            started, result, deltas = self._run("one two")
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(deltas, [])
+        self.assertNotIn("echo", result["reply"])  # /predict reply
+
+
+class _SlowPathML(_FakeML):
+    """Per-path delays; ``slow_first`` only delays the first /predict (a slow replica)."""
+
+    path_delay_s = {}
+    slow_first = None
+    predict_calls = None
+
+    def do_POST(self):
+        if self.path == "/predict" and self.slow_first is not None:
+            with self.lock:
+                self.predict_calls.append(1)
+                first = len(self.predict_calls) == 1
+            if first:
+                time.sleep(self.slow_first)
+        time.sleep(self.path_delay_s.get(self.path, 0.0))
+        super().do_POST()
+
+
+class DeadlineTests(TestCase):
+    def start(self, **attrs):
+        handler = type("DeadlineML", (_SlowPathML,), {"lock": threading.Lock(), "predict_calls": [], **attrs})
+        self.server, base = start_fake_ml(handler)
+        self.settings_ctx = override_settings(
+            MHCHAT_ML_API_BASE=base, MHCHAT_ML_HEALTH_INTERVAL_S=0, MHCHAT_ML_CACHE_BACKEND="off",
+            MHCHAT_ML_DEADLINE_S=0.4,
+        )
+        self.settings_ctx.enable()
+        return handler
+
+    def setUp(self):
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+        ml_async.reset_async_ml_clients()
+        ml_deadline.reset_ml_deadline_stats()
+
+    def tearDown(self):
+        ml_http.reset_ml_http_client()
+        ml_async.reset_async_ml_clients()
+        ml_health.reset_ml_health()
+        self.settings_ctx.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_slow_predict_returns_none_within_budget(self):
+        self.start(path_delay_s={"/predict": 1.0})
+        started = time.monotonic()
+        self.assertIsNone(predict("hello"))
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(ml_deadline.ml_deadline_stats()["deadline_exceeded"], 1)
+
+    def test_slow_chat_keeps_predict_reply(self):
+        self.start(path_delay_s={"/chat": 1.0})
+        started = time.monotonic()
+        result = predict("hello")
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(result["seen"], "hello")
+        self.assertNotIn("echo", result["reply"])
+
+    def test_async_slow_predict_returns_none_within_budget(self):
+        self.start(path_delay_s={"/predict": 1.0})
+        started = time.monotonic()
+        self.assertIsNone(asyncio.run(apredict("hello", context=[])))
+        self.assertLess(time.monotonic() - started, 0.6)
+
+    def test_hedged_predict_beats_a_slow_replica(self):
+        handler = self.start(slow_first=1.0)
+        with override_settings(MHCHAT_ML_HEDGE=True, MHCHAT_ML_HEDGE_DELAY_MS=50, MHCHAT_ML_DEADLINE_S=3):
+            started = time.monotonic()
+            result = predict("hello")
+            elapsed = time.monotonic() - started
+        self.assertEqual(result["reply"], "echo: hello")
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(len(handler.predict_calls), 2)
+        stats = ml_deadline.ml_deadline_stats()
+        self.assertEqual((stats["hedges"], stats["hedge_wins"]), (1, 1))
+
+    def test_async_hedge(self):
+        self.start(slow_first=1.0)
+        with override_settings(MHCHAT_ML_HEDGE=True, MHCHAT_ML_HEDGE_DELAY_MS=50, MHCHAT_ML_DEADLINE_S=3):
+            started = time.monotonic()
+            result = asyncio.run(apredict("hello", context=[]))
+            elapsed = time.monotonic() - started
+        self.assertEqual(result["reply"], "echo: hello")
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(ml_deadline.ml_deadline_stats()["hedge_wins"], 1)
+
+
+class FakeServerFaultTests(TestCase):
+    def start(self, **profile):
+        self.profile = FaultProfile(seed=1, **profile)
+        self.server, base = start_fake_ml_server(self.profile)
+        self.settings_ctx = override_settings(
+            MHCHAT_ML_API_BASE=base, MHCHAT_ML_HEALTH_INTERVAL_S=0, MHCHAT_ML_CACHE_BACKEND="off",
+            MHCHAT_ML_DEADLINE_S=0.5,
+        )
+        self.settings_ctx.enable()
+
+    def setUp(self):
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+
+    def tearDown(self):
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+        self.settings_ctx.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_latency_specs(self):
+        self.start()
+        self.assertEqual(parse_latency("25"), ("fixed", (25.0,)))
+        self.assertEqual(parse_latency("lognormal:40:0.6"), ("lognormal", (40.0, 0.6)))
+        with self.assertRaises(ValueError):
+            parse_latency("uniform:10")
+        with self.assertRaises(ValueError):
+            FaultProfile(error_rate=0.7, reset_rate=0.5)
+
+    def test_healthy_server_answers(self):
+        self.start()
+        result = predict("hello")
+        self.assertIn("I hear you: hello", result["reply"])
+
+    def test_malformed_json_falls_back_without_retry(self):
+        self.start(malformed_rate=1.0)
+        self.assertIsNone(predict("hello"))
+        self.assertEqual(self.profile.stats()["malformed"], 1)
+
+    def test_errors_are_retried_then_fall_back(self):
+        self.start(error_rate=1.0)
+        self.assertIsNone(predict("hello"))
+        self.assertGreater(self.profile.stats()["error"], 1)
+
+    def test_slowloris_is_cut_off_by_the_deadline(self):
+        self.start(slowloris_rate=1.0, slowloris_gap_ms=50)
+        started = time.monotonic()
+        self.assertIsNone(predict("hello"))
+        self.assertLess(time.monotonic() - started, 0.8)
+
+
+class WireFormatTests(TestCase):
+    def start(self, **profile):
+        self.profile = FaultProfile(seed=1, **profile)
+        self.server, base = start_fake_ml_server(self.profile)
+        self.settings_ctx = override_settings(
+            MHCHAT_ML_API_BASE=base, MHCHAT_ML_HEALTH_INTERVAL_S=0, MHCHAT_ML_CACHE_BACKEND="off",
+        )
+        self.settings_ctx.enable()
+
+    def setUp(self):
+        ml_http.reset_ml_http_client()
+        ml_health.reset_ml_health()
+        ml_codec.reset_wire_codec()
+
+    def tearDown(self):
+        ml_http.reset_ml_http_client()
+        ml_async.reset_async_ml_clients()
+        ml_health.reset_ml_health()
+        ml_codec.reset_wire_codec()
+        self.settings_ctx.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_switches_to_msgpack_once_the_service_answers_in_it(self):
+        self.start()
+        self.assertIn("I hear you: hello", predict("hello")["reply"])
+        self.assertIn("I hear you: again", predict("again")["reply"])
+        stats = ml_codec.ml_wire_stats()
+        self.assertEqual(stats["sent_json"], 1)  # only the very first /predict
+        self.assertEqual(stats["sent_msgpack"], 3)
+        self.assertEqual(stats["received_msgpack"], 4)
+
+    def test_async_path_negotiates_too(self):
+        self.start()
+        result = asyncio.run(apredict("hello", context=[]))
+        self.assertIn("I hear you: hello", result["reply"])
+        self.assertEqual(ml_codec.ml_wire_stats()["sent_msgpack"], 1)
+
+    def test_gzip_responses(self):
+        self.start(gzip_min_bytes=1)
+        self.assertIn("I hear you: hello", predict("hello")["reply"])
+        stats = ml_codec.ml_wire_stats()
+        self.assertEqual(stats["received_gzip"], 2)
+        self.assertLess(stats["bytes_in_wire"], stats["bytes_in"] * 2)
+
+    def test_json_only_service_and_415_fallback(self):
+        self.start(msgpack=False)
+        codec = ml_codec.get_wire_codec()
+        codec.send_msgpack = True  # e.g. the service was downgraded since we negotiated
+        self.assertIn("I hear you: hello", predict("hello")["reply"])
+        stats = ml_codec.ml_wire_stats()
+        self.assertEqual(stats["fallbacks"], 1)
+        self.assertEqual((stats["received_msgpack"], stats["send_msgpack"], stats["offer_msgpack"]), (0, False, False))
+
+    def test_json_setting_never_offers_msgpack(self):
+        self.start()
+        with override_settings(MHCHAT_ML_WIRE_FORMAT="json"):
+            predict("hello")
+            stats = ml_codec.ml_wire_stats()
+        self.assertEqual((stats["sent_msgpack"], stats["received_msgpack"]), (0, 0))
@@ -1,5 +1,8 @@
+import time
+
 from django.test import TestCase
-from .nlp import analyze_message, safety_check
+from . import nlp
+from .nlp import analyze_message, analyze_and_check, safety_check
 
 class NluTest(TestCase):
     def test_analyze_and_safety(self):
@@ -12,4 +15,138 @@ class NluTest(TestCase):
         hi = analyze_message("Hi, hello!")
         self.assertEqual(hi['intent'], 'greeting')
         flagged2, s2 = safety_check("Hi", hi)
-        self.assertFalse(flagged2)
\ No newline at end of file
+        self.assertFalse(flagged2)
+
+class LexiconScanTest(TestCase):
+    def test_overlapping_hits_are_all_reported(self):
+        # "going to" (urgency) sits inside the suicidal pattern match.
+        flagged, severity = safety_check("I'm going to kill myself")
+        self.assertTrue(flagged)
+        self.assertEqual(severity, 'high')
+
+        flagged, severity = safety_check("thinking about suicide")
+        self.assertTrue(flagged)
+        self.assertEqual(severity, 'medium')
+
+    def test_intent_precedence_unchanged(self):
+        self.assertEqual(analyze_message("thanks, that helped")['intent'], 'help_request')
+        self.assertEqual(analyze_message("thank you so much")['intent'], 'thanks')
+        self.assertEqual(analyze_message("I took an overdose last week and feel fine")['intent'], 'suicidal')
+
+
+class AnalyzeAndCheckTest(TestCase):
+    def test_matches_separate_calls(self):
+        for text in ("I want to kill myself tonight", "hi", "I feel hopeless, suicide", "thanks a lot"):
+            meta = analyze_message(text)
+            self.assertEqual(analyze_and_check(text), (meta, *safety_check(text, meta)))
+
+
+class SafetyVerdictRegressionTest(TestCase):
+    # Verdicts of the original pipeline, safety_check(text, analyze_message(text)):
+    # the weighted sentiment scale must not change them.
+    BASELINE = {
+        "i am alone and i could just die": (True, 'medium'),
+        "so lonely i could die": (True, 'medium'),
+        "i feel sad and think about overdose": (True, 'medium'),
+        "i feel hopeless, suicide is on my mind": (True, 'medium'),
+        "i am bad at this, die hard fan": (True, 'medium'),
+        "i am happy my cat did not die": (False, 'low'),
+        "i feel down, good day though, might die laughing": (False, 'low'),
+        "i feel terrible and worthless, i want to end my life": (True, 'medium'),
+        "i want to kill myself tonight": (True, 'high'),
+    }
+
+    def test_crisis_phrases_keep_baseline_verdicts(self):
+        for text, verdict in self.BASELINE.items():
+            with self.subTest(text=text):
+                self.assertEqual(analyze_and_check(text)[1:], verdict)
+                self.assertEqual(safety_check(text), verdict)
+
+
+class SentimentScorerTest(TestCase):
+    def test_negation_and_intensity(self):
+        self.assertEqual(analyze_message("I'm not happy")['intent'], 'negative')
+        self.assertEqual(analyze_message("not bad at all")['intent'], 'positive')
+        sad = analyze_message("I feel sad")['sentiment']['compound']
+        very_sad = analyze_message("I feel very sad")['sentiment']['compound']
+        self.assertLess(very_sad, sad)
+        self.assertLess(sad, 0)
+        # negation scope ends after a few tokens
+        self.assertGreater(analyze_message("no, honestly today i feel happy")['sentiment']['compound'], 0)
+
+    def test_latency_budget(self):
+        # ~700 tokens, the size of a long attachment message
+        words = ("i am not feeling very good today but work was okay " * 64).split()
+        nlp._score_sentiment(words)
+        rounds = 200
+        start = time.perf_counter()
+        for _ in range(rounds):
+            nlp._score_sentiment(words)
+        per_call_us = (time.perf_counter() - start) / rounds * 1e6
+        self.assertLess(per_call_us, 1000, f"sentiment took {per_call_us:.0f}us per 700-token message")
+
+
+class EntityExtractionTest(TestCase):
+    def test_spans_and_categories(self):
+        text = "I took 20 Xanax tonight and want to cut myself this weekend"
+        ents = analyze_message(text)['entities']
+        self.assertEqual(ents['medication'], [{'value': 'xanax', 'start': 10, 'end': 15}])
+        self.assertEqual([e['value'] for e in ents['time']], ['tonight', 'this weekend'])
+        self.assertEqual([e['value'] for e in ents['self_harm_method']], ['cut myself'])
+        lowered = text.lower()
+        for spans in ents.values():
+            for e in spans:
+                self.assertEqual(lowered[e['start']:e['end']], e['value'])
+
+    def test_offsets_index_the_original_text(self):
+        text = "  \tI want to Cut my self   after my meds tonight"
+        for meta in (analyze_message(text), analyze_and_check(text)[0], nlp.analyze_messages([text])[0]):
+            ents = meta['entities']
+            self.assertEqual([e['value'] for e in ents['self_harm_method']], ['cut myself'])
+            spans = [(e['start'], e['end']) for spans in ents.values() for e in spans]
+            self.assertEqual(sorted(text[a:b] for a, b in spans), ['Cut my self', 'my meds', 'tonight'])
+
+    def test_whole_tokens_only(self):
+        # "weed" must not match inside "tweed"; no match -> empty dict
+        self.assertEqual(analyze_message("my tweed jacket")['entities'], {})
+
+
+class NluCacheTest(TestCase):
+    def setUp(self):
+        self.saved = nlp._NLU_CACHE
+        nlp._NLU_CACHE = nlp._LRUCache(2)
+
+    def tearDown(self):
+        nlp._NLU_CACHE = self.saved
+
+    def test_hits_misses_and_evictions(self):
+        analyze_message("I feel sad")
+        analyze_message("  i feel SAD ")  # same normalized text
+        safety_check("I feel sad")  # scan only: does not touch the cache
+        safety_check("I feel alone")
+        analyze_message("hello")
+        analyze_message("thanks")  # evicts "i feel sad"
+        stats = nlp.nlu_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['size']), (1, 3, 1, 2))
+
+    def test_cached_hits_do_not_keep_the_text(self):
+        analyze_message("I want to kill myself tonight " * 20)
+        (hits, _), = nlp._NLU_CACHE._data.values()
+        self.assertIsInstance(hits, frozenset)
+        self.assertEqual(hits, nlp._scan_lexicons(nlp._normalize("I want to kill myself tonight " * 20)))
+
+    def test_results_are_copies(self):
+        meta = analyze_message("I feel sad")
+        meta['sentiment']['compound'] = 99
+        self.assertNotEqual(analyze_message("I feel sad")['sentiment']['compound'], 99)
+
+    def test_invalidated_when_lexicons_change(self):
+        analyze_message("I feel grumpy")
+        nlp._NEG_WORDS["grumpy"] = 2.0
+        try:
+            nlp.recompile_lexicons()
+            self.assertEqual(analyze_message("I feel grumpy")['intent'], 'negative')
+            self.assertEqual(nlp.nlu_cache_stats()['invalidations'], 1)
+        finally:
+            nlp._NEG_WORDS.pop("grumpy", None)
+            nlp.recompile_lexicons()
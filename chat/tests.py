@@ -1,9 +1,9 @@
 # chat/tests.py
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from .models import Conversation, Message
 from .nlp import analyze_message
-from .tasks import handle_user_message
+from .tasks import handle_user_message, handle_user_message_async
 
 User = get_user_model()
 
@@ -25,3 +25,190 @@ class BasicFlowTests(TestCase):
         # refresh messages
         msgs = list(self.conv.messages.order_by('created_at'))
         self.assertTrue(len(msgs) >= 2)
+
+    @override_settings(MHCHAT_ML_API_BASE="http://127.0.0.1:9", MHCHAT_ML_HEALTH_INTERVAL_S=0)
+    async def test_async_pipeline_falls_back_without_ml(self):
+        from . import ml_health
+        ml_health.reset_ml_health()
+        m = await Message.objects.acreate(conversation=self.conv, sender='user', text='i feel a bit better today')
+        result = await handle_user_message_async(m.id)
+        self.assertEqual(result['status'], 'ok')
+        bot = await Message.objects.aget(id=result['bot_message_id'])
+        self.assertEqual(bot.sender, 'bot')
+        self.assertTrue(bot.text)
+        ml_health.reset_ml_health()
+
+    def test_reply_pipeline_query_budget(self):
+        from unittest import mock
+        from .ml_context import reset_context_cache
+        from .models import MessageAttachment
+
+        reset_context_cache()
+        m = Message.objects.create(conversation=self.conv, sender='user', text='i had a long week at work')
+        MessageAttachment.objects.create(message=m, file='attachments/notes.txt', file_name='notes.txt',
+                                         text_content='deadlines everywhere')
+        pred = {'reply': 'That sounds like a lot.', 'intent': 'casual_chat'}
+        with mock.patch('chat.tasks.ml_predict', return_value=pred) as ml_predict:
+            # load message+conversation+user, prefetch attachments, save NLU, context window,
+            # save ML metadata, insert bot reply
+            with self.assertNumQueries(6):
+                result = handle_user_message(m.id)
+        self.assertEqual(result['status'], 'ok')
+        args, kwargs = ml_predict.call_args
+        self.assertIn('deadlines everywhere', args[0])
+        self.assertEqual(kwargs['context'][-1]['text'], 'i had a long week at work')
+        reset_context_cache()
+
+    async def test_burst_is_answered_once(self):
+        from unittest import mock
+        from .tasks import reply_to_messages_async, screen_user_message_async
+
+        ids = []
+        for text in ('hey', 'so', 'i feel awful today'):
+            m = await Message.objects.acreate(conversation=self.conv, sender='user', text=text)
+            self.assertIsNone(await screen_user_message_async(m.id))
+            ids.append(m.id)
+        with mock.patch('chat.tasks.ml_apredict', new=mock.AsyncMock(return_value={'reply': 'one reply'})) as apredict:
+            result = await reply_to_messages_async(ids)
+        apredict.assert_awaited_once()
+        self.assertEqual(apredict.await_args.args[0], 'hey\nso\ni feel awful today')
+        self.assertEqual((result['status'], result['coalesced']), ('ok', 3))
+        self.assertEqual(await self.conv.messages.filter(sender='bot').acount(), 1)
+        last = await Message.objects.aget(id=ids[-1])
+        self.assertEqual(last.nlp_metadata['ml'], {'reply': 'one reply'})
+
+    async def test_burst_fallback_analysis_runs_off_the_event_loop(self):
+        import asyncio
+        from unittest import mock
+        from .nlp import analyze_message as real_analyze
+        from .tasks import reply_to_messages_async
+
+        ids = [(await Message.objects.acreate(conversation=self.conv, sender='user', text=text)).id
+               for text in ('ugh', 'work was awful')]
+        loops = []
+
+        def analyze(text):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            return real_analyze(text)
+
+        with mock.patch('chat.tasks.ml_apredict', new=mock.AsyncMock(return_value=None)), \
+                mock.patch('chat.tasks.analyze_message', side_effect=analyze):
+            result = await reply_to_messages_async(ids)
+        self.assertEqual(result['status'], 'ok')
+        self.assertEqual(loops, [None])
+
+
+class ReprocessNluCommandTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reproc', password='pass')
+        self.conv = Conversation.objects.create(user=self.user)
+
+    def test_rewrites_metadata_and_keeps_ml(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        m = Message.objects.create(conversation=self.conv, sender='user', text='I feel hopeless and alone',
+                                   nlp_metadata={'intent': 'stale', 'ml': {'intent': 'x'}})
+        bot = Message.objects.create(conversation=self.conv, sender='bot', text='hi', nlp_metadata={})
+        out = StringIO()
+        call_command('reprocess_nlu', workers=0, stdout=out)
+
+        m.refresh_from_db()
+        bot.refresh_from_db()
+        self.assertEqual(m.nlp_metadata['intent'], 'negative')
+        self.assertEqual(m.nlp_metadata['ml'], {'intent': 'x'})
+        self.assertEqual(bot.nlp_metadata, {})
+        self.assertIn('rows/s', out.getvalue())
+
+    def test_resumes_from_checkpoint(self):
+        import os
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+
+        first = Message.objects.create(conversation=self.conv, sender='user', text='hello', nlp_metadata={})
+        second = Message.objects.create(conversation=self.conv, sender='user', text='hello', nlp_metadata={})
+        with tempfile.TemporaryDirectory() as tmp:
+            ckpt = os.path.join(tmp, 'ckpt')
+            with open(ckpt, 'w') as fh:
+                fh.write(str(first.id))
+            call_command('reprocess_nlu', workers=0, checkpoint=ckpt, stdout=StringIO())
+            with open(ckpt) as fh:
+                self.assertEqual(fh.read(), str(second.id))
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.nlp_metadata, {})
+        self.assertEqual(second.nlp_metadata['intent'], 'greeting')
+
+
+@override_settings(MHCHAT_ML_CONTEXT_CONVERSATIONS=1024)
+class ConversationContextCacheTests(TestCase):
+    def setUp(self):
+        from . import ml_context
+        self.ml_context = ml_context
+        ml_context.reset_context_cache()
+        ml_context.get_context_cache()
+        self.user = User.objects.create_user(username='ctx', password='pass')
+        self.conv = Conversation.objects.create(user=self.user)
+
+    def tearDown(self):
+        self.ml_context.reset_context_cache()
+
+    def _say(self, text, sender='user'):
+        return Message.objects.create(conversation=self.conv, sender=sender, text=text)
+
+    def test_active_conversation_costs_no_queries(self):
+        from .ml_brain_client import _fetch_context
+        for i in range(7):
+            self._say(f'm{i}', sender='user' if i % 2 == 0 else 'bot')
+        with self.assertNumQueries(0):
+            context = _fetch_context(self.conv.id)
+        self.assertEqual([c['text'] for c in context], ['m2', 'm3', 'm4', 'm5', 'm6'])
+        self.assertEqual(context[-1], {'sender': 'user', 'text': 'm6'})
+
+    def test_miss_loads_once_then_hits(self):
+        for i in range(3):
+            self._say(f'm{i}')
+        self.ml_context.invalidate_conversation_context()
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.ml_context.conversation_context(self.conv.id)), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.ml_context.conversation_context(self.conv.id)), 3)
+
+    def test_delete_and_edit_are_reflected(self):
+        msgs = [self._say(f'm{i}') for i in range(6)]
+        msgs[4].delete()
+        self.assertEqual([c['text'] for c in self.ml_context.conversation_context(self.conv.id)], ['m0', 'm1', 'm2', 'm3', 'm5'])
+        msgs[5].text = 'edited'
+        msgs[5].save()
+        msgs[5].nlp_metadata = {'intent': 'x'}
+        msgs[5].save(update_fields=['nlp_metadata'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ml_context.conversation_context(self.conv.id)[-1]['text'], 'edited')
+
+    def test_lru_bound_and_disable(self):
+        with override_settings(MHCHAT_ML_CONTEXT_CONVERSATIONS=2):
+            cache = self.ml_context.get_context_cache()
+            convs = [Conversation.objects.create(user=self.user) for _ in range(3)]
+            self.assertIsNone(cache.get(convs[0].id))
+            self.assertEqual(cache.get(convs[2].id), [])
+        with override_settings(MHCHAT_ML_CONTEXT_CONVERSATIONS=0):
+            self._say('hello')
+            with self.assertNumQueries(1):
+                self.assertEqual(self.ml_context.conversation_context(self.conv.id)[-1]['text'], 'hello')
+
+    def test_ttl_reloads_windows_written_elsewhere(self):
+        now = [100.0]
+        cache = self.ml_context.ConversationContextCache(window=5, ttl_s=2.0, clock=lambda: now[0])
+        rows = [(1, 'user', 'hi')]
+        self.assertEqual(len(cache.load(self.conv.id, lambda: rows)), 1)
+        rows.append((2, 'bot', 'saved by another worker'))
+        now[0] += 1.0
+        self.assertEqual(len(cache.load(self.conv.id, lambda: rows)), 1)
+        now[0] += 1.5
+        self.assertEqual(cache.load(self.conv.id, lambda: rows)[-1]['text'], 'saved by another worker')
+        self.assertEqual(cache.stats()['expired'], 1)
@@ -10,7 +10,8 @@ from django.contrib.auth.models import User
 from .models import Conversation, Message, UserProfile, MessageAttachment
 from .serializers import ConversationSerializer, MessageSerializer
 from .attachments import extract_text_from_attachment
-from .tasks import handle_user_message
+from .jobs import durable, enqueue
+from .tasks import handle_user_message, reply_lane
 
 # Default app-level permission; you can override per-viewset as needed.
 DEFAULT_PERMS = [permissions.IsAuthenticated]
@@ -125,19 +126,24 @@ class MessageViewSet(viewsets.ModelViewSet):
                 except Exception:
                     pass
 
-            # Synchronous execution (no Celery dependency)
-            try:
-                handle_user_message(message.id)
-            except Exception as exc:
-                # Don't fail the creation; return created with a note that processing failed.
-                return Response(
-                    {
-                        "detail": "Message created but bot processing failed.",
-                        "error": str(exc),
-                        "message": MessageSerializer(message).data,
-                    },
-                    status=status.HTTP_201_CREATED,
-                )
+            if durable():
+                # Committed with the message; run_workers generates the reply and
+                # broadcasts it, so the client receives it over the WebSocket.
+                enqueue(handle_user_message, message.id, lane=reply_lane(message))
+            else:
+                # Synchronous execution (no Celery dependency)
+                try:
+                    handle_user_message(message.id)
+                except Exception as exc:
+                    # Don't fail the creation; return created with a note that processing failed.
+                    return Response(
+                        {
+                            "detail": "Message created but bot processing failed.",
+                            "error": str(exc),
+                            "message": MessageSerializer(message).data,
+                        },
+                        status=status.HTTP_201_CREATED,
+                    )
 
         # Refresh message and get bot response if it was created synchronously
         message.refresh_from_db()
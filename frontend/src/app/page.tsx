@@ -237,6 +237,7 @@ function ActiveChat() {
   const { currentConversation, messages, setMessages, appendMessage } = useChatStore();
   const [input, setInput] = useState("");
   const [isTyping, setIsTyping] = useState(false);
+  const [streamingReply, setStreamingReply] = useState("");
   const [wsConnected, setWsConnected] = useState(false);
   const [mounted, setMounted] = useState(false);
   const [attachments, setAttachments] = useState<File[]>([]);
@@ -253,6 +254,7 @@ function ActiveChat() {
     if (!mounted || !currentConversation) return;
 
     setIsTyping(false);
+    setStreamingReply("");
     setInput("");
     setAttachments([]);
 
@@ -279,6 +281,10 @@ function ActiveChat() {
             new Date(a.created_at).getTime() - new Date(b.created_at).getTime()
           );
           setMessages(sorted);
+        } else if (data.type === "ai_delta") {
+          // Partial bot reply; replaced by the saved message when it arrives
+          setIsTyping(true);
+          setStreamingReply((prev) => prev + (data.delta || ""));
         } else if (data.type === "message") {
           const msg = data.message;
           
@@ -289,6 +295,7 @@ function ActiveChat() {
           } else if (msg?.system === "ai_error") {
             console.error("AI Error:", msg.error);
             setIsTyping(false);
+            setStreamingReply("");
             return;
           }
           
@@ -298,6 +305,7 @@ function ActiveChat() {
             // Stop typing indicator when we receive a bot response
             if (msg.sender === "bot" || msg.sender === "system") {
               setIsTyping(false);
+              setStreamingReply("");
             }
           }
         }
@@ -322,7 +330,7 @@ function ActiveChat() {
     if (scrollRef.current) {
       scrollRef.current.scrollTop = scrollRef.current.scrollHeight;
     }
-  }, [messages, isTyping]);
+  }, [messages, isTyping, streamingReply]);
 
   const apiBase = process.env.NEXT_PUBLIC_API_BASE || "http://localhost:8000";
 
@@ -506,11 +514,17 @@ function ActiveChat() {
             <div className="w-8 h-8 rounded-full bg-indigo-100 flex items-center justify-center shrink-0 mb-1">
               <Bot size={16} className="text-indigo-600" />
             </div>
-            <div className="px-5 py-4 rounded-2xl rounded-bl-sm bg-white border border-slate-200 shadow-sm flex items-center gap-1.5 h-[46px]">
-              <span className="w-1.5 h-1.5 bg-indigo-400 rounded-full animate-bounce" style={{animationDelay: "0ms"}} />
-              <span className="w-1.5 h-1.5 bg-indigo-400 rounded-full animate-bounce" style={{animationDelay: "150ms"}} />
-              <span className="w-1.5 h-1.5 bg-indigo-400 rounded-full animate-bounce" style={{animationDelay: "300ms"}} />
-            </div>
+            {streamingReply ? (
+              <div className="px-5 py-3 rounded-2xl rounded-bl-sm bg-white border border-slate-200 shadow-sm text-sm text-slate-700 whitespace-pre-wrap max-w-[75%]">
+                {streamingReply}
+              </div>
+            ) : (
+              <div className="px-5 py-4 rounded-2xl rounded-bl-sm bg-white border border-slate-200 shadow-sm flex items-center gap-1.5 h-[46px]">
+                <span className="w-1.5 h-1.5 bg-indigo-400 rounded-full animate-bounce" style={{animationDelay: "0ms"}} />
+                <span className="w-1.5 h-1.5 bg-indigo-400 rounded-full animate-bounce" style={{animationDelay: "150ms"}} />
+                <span className="w-1.5 h-1.5 bg-indigo-400 rounded-full animate-bounce" style={{animationDelay: "300ms"}} />
+              </div>
+            )}
           </motion.div>
         )}
       </div>
@@ -203,6 +203,50 @@ else:
         }
     }
 
+# ------- mhchat-ml service (chat/ml_brain_client.py) -------
+MHCHAT_ML_API_BASE = os.environ.get("MHCHAT_ML_API_BASE", "http://127.0.0.1:8001")
+MHCHAT_ML_POOL_SIZE = int(os.environ.get("MHCHAT_ML_POOL_SIZE", 8))  # idle keep-alive connections per process
+MHCHAT_ML_POOL_IDLE_S = float(os.environ.get("MHCHAT_ML_POOL_IDLE_S", 30))
+MHCHAT_ML_ASYNC_CONCURRENCY = int(os.environ.get("MHCHAT_ML_ASYNC_CONCURRENCY", 64))  # in-flight requests per event loop
+MHCHAT_ML_BATCH_MAX_SIZE = int(os.environ.get("MHCHAT_ML_BATCH_MAX_SIZE", 0))  # >1 coalesces /predict into /predict_batch
+MHCHAT_ML_BATCH_MAX_WAIT_MS = float(os.environ.get("MHCHAT_ML_BATCH_MAX_WAIT_MS", 5))
+MHCHAT_ML_BATCH_WORKERS = int(os.environ.get("MHCHAT_ML_BATCH_WORKERS", 4))
+MHCHAT_ML_CACHE_BACKEND = os.environ.get("MHCHAT_ML_CACHE_BACKEND", "local")  # local | django | off (crisis results never cached)
+MHCHAT_ML_CACHE_TTL_S = float(os.environ.get("MHCHAT_ML_CACHE_TTL_S", 120))
+MHCHAT_ML_CACHE_MAX_ENTRIES = int(os.environ.get("MHCHAT_ML_CACHE_MAX_ENTRIES", 2048))
+MHCHAT_ML_CACHE_MAX_BYTES = int(os.environ.get("MHCHAT_ML_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+MHCHAT_ML_CONTEXT_WINDOW = int(os.environ.get("MHCHAT_ML_CONTEXT_WINDOW", 5))  # recent messages sent as context
+MHCHAT_ML_CONTEXT_CONVERSATIONS = int(os.environ.get("MHCHAT_ML_CONTEXT_CONVERSATIONS", 0))  # cached windows per process, 0 = query every time
+MHCHAT_ML_CONTEXT_TTL_S = float(os.environ.get("MHCHAT_ML_CONTEXT_TTL_S", 0))  # reload cached windows after this long, 0 = never
+MHCHAT_ML_DEADLINE_S = float(os.environ.get("MHCHAT_ML_DEADLINE_S", 3))  # whole-reply budget for predict(), 0 = none
+MHCHAT_ML_CALL_THREADS = int(os.environ.get("MHCHAT_ML_CALL_THREADS", 64))  # threads that run deadline-bounded calls
+MHCHAT_ML_HEDGE = os.environ.get("MHCHAT_ML_HEDGE", "0").lower() in ("1", "true", "yes")  # resend slow /predict after p95
+MHCHAT_ML_HEDGE_DELAY_MS = float(os.environ.get("MHCHAT_ML_HEDGE_DELAY_MS", 300))  # until enough latency samples exist
+MHCHAT_ML_WIRE_FORMAT = os.environ.get("MHCHAT_ML_WIRE_FORMAT", "auto")  # auto (msgpack when offered) | json
+MHCHAT_ML_STREAM = os.environ.get("MHCHAT_ML_STREAM", "0").lower() in ("1", "true", "yes")  # stream /chat as ai_delta events
+MHCHAT_ML_HEALTH_INTERVAL_S = float(os.environ.get("MHCHAT_ML_HEALTH_INTERVAL_S", 5))  # background /health probe, 0 = off
+MHCHAT_ML_BREAKER_FAILURES = int(os.environ.get("MHCHAT_ML_BREAKER_FAILURES", 5))  # consecutive failures to open
+MHCHAT_ML_BREAKER_RESET_S = float(os.environ.get("MHCHAT_ML_BREAKER_RESET_S", 10))  # open -> half-open after
+
+# ------- Job queue (chat/jobs.py, `manage.py run_workers`) -------
+MHCHAT_JOBS_BACKEND = os.environ.get("MHCHAT_JOBS_BACKEND", "inline")  # inline (in-process pool) | db (needs run_workers + shared channel layer)
+MHCHAT_JOBS_INLINE_WORKERS = int(os.environ.get("MHCHAT_JOBS_INLINE_WORKERS", 4))
+MHCHAT_JOBS_WORKERS = int(os.environ.get("MHCHAT_JOBS_WORKERS", 4))  # run_workers threads
+MHCHAT_JOBS_CRISIS_WORKERS = int(os.environ.get("MHCHAT_JOBS_CRISIS_WORKERS", 2))  # extra threads reserved for the crisis lane
+MHCHAT_JOBS_VISIBILITY_S = float(os.environ.get("MHCHAT_JOBS_VISIBILITY_S", 120))  # lease before a job is retried elsewhere
+MHCHAT_JOBS_MAX_ATTEMPTS = int(os.environ.get("MHCHAT_JOBS_MAX_ATTEMPTS", 3))
+MHCHAT_JOBS_RETRY_BASE_S = float(os.environ.get("MHCHAT_JOBS_RETRY_BASE_S", 5))
+MHCHAT_JOBS_KEEP_S = float(os.environ.get("MHCHAT_JOBS_KEEP_S", 86400))  # finished jobs kept this long
+MHCHAT_CONVERSATION_QUEUE_SIZE = int(os.environ.get("MHCHAT_CONVERSATION_QUEUE_SIZE", 8))  # pending WebSocket replies per conversation
+MHCHAT_CONVERSATION_COALESCE_MS = float(os.environ.get("MHCHAT_CONVERSATION_COALESCE_MS", 0))  # merge bursts into one reply, 0 = off
+MHCHAT_CONVERSATION_COALESCE_MAX_MS = float(os.environ.get("MHCHAT_CONVERSATION_COALESCE_MAX_MS", 2000))  # longest a burst is held
+
+# ------- Duplicate-message guard (chat/dedup.py) -------
+MHCHAT_DEDUP_BACKEND = os.environ.get("MHCHAT_DEDUP_BACKEND", "local")  # local | django (shared cache) | off
+MHCHAT_DEDUP_WINDOW_S = float(os.environ.get("MHCHAT_DEDUP_WINDOW_S", 5))
+MHCHAT_DEDUP_MAX_ENTRIES = int(os.environ.get("MHCHAT_DEDUP_MAX_ENTRIES", 100000))  # local backend cap
+MHCHAT_DEDUP_ALIAS = os.environ.get("MHCHAT_DEDUP_ALIAS", "default")  # django backend cache alias
+
 # ------- Email / Admins -------
 EMAIL_BACKEND = os.environ.get("EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend")
 DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL", "mhchat@example.com")
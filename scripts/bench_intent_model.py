@@ -0,0 +1,88 @@
+# scripts/bench_intent_model.py
+"""
+Compare worker cost of the intent model formats, each in a fresh interpreter:
+
+  joblib         sklearn pipeline.joblib (pandas/scipy/sklearn imported)
+  tfidf-logreg   chat.intent_model, JSON vocabulary + mmapped .npy arrays
+  hashed-linear  chat.intent_model, single compiled file (no sklearn)
+
+Reports import+load time, peak RSS after the first prediction, and mean
+per-message predict latency.
+
+    python scripts/train_intent.py --out /tmp/intent
+    python scripts/export_intent_model.py --src /tmp/intent
+    python scripts/bench_intent_model.py --root /tmp/intent
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = r'''
+import json, resource, sys, time
+t0 = time.perf_counter()
+kind, path, n = sys.argv[1], sys.argv[2], int(sys.argv[3])
+if kind == "joblib":
+    import joblib
+    model = joblib.load(path)
+    predict = lambda text: model.predict_proba([text])
+else:
+    sys.path.insert(0, sys.argv[4])
+    from chat.intent_model import load_classifier
+    model = load_classifier(path)
+    predict = lambda text: model.predict_proba([text])
+msgs = ["hi there", "i am feeling really sad and alone today", "thank you so much",
+        "can you help me cope with stress at work", "i want to die"]
+predict(msgs[0])
+load_s = time.perf_counter() - t0
+t1 = time.perf_counter()
+for i in range(n):
+    predict(msgs[i % len(msgs)])
+per_msg_us = (time.perf_counter() - t1) / n * 1e6
+rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({"load_s": load_s, "rss_mb": rss_mb, "per_msg_us": per_msg_us,
+                  "sklearn_loaded": "sklearn" in sys.modules}))
+'''
+
+
+def run(kind, path, n):
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, kind, str(path), str(n), REPO],
+        check=True, capture_output=True, text=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default=os.environ.get("MHCHAT_INTENT_MODEL_DIR", "artifacts/intent"))
+    parser.add_argument("-n", type=int, default=2000, help="predictions per engine")
+    args = parser.parse_args()
+
+    root = Path(args.root)
+    by_format = {}
+    for version_dir in sorted(p for p in root.iterdir() if (p / "manifest.json").is_file()):
+        fmt = json.loads((version_dir / "manifest.json").read_text())["format"]
+        by_format[fmt] = version_dir  # newest of each format wins
+
+    cases = []
+    if "tfidf-logreg" in by_format and (by_format["tfidf-logreg"] / "pipeline.joblib").is_file():
+        cases.append(("joblib", by_format["tfidf-logreg"] / "pipeline.joblib"))
+    for fmt in ("tfidf-logreg", "hashed-linear"):
+        if fmt in by_format:
+            cases.append((fmt, by_format[fmt]))
+    if not cases:
+        sys.exit(f"No intent model artifacts under {root}")
+
+    print(f"{'engine':14s} {'import+load':>12s} {'peak RSS':>10s} {'per msg':>10s}  sklearn")
+    for kind, path in cases:
+        r = run(kind, path, args.n)
+        print(f"{kind:14s} {r['load_s'] * 1000:10.0f}ms {r['rss_mb']:8.1f}MB {r['per_msg_us']:8.1f}us  {r['sklearn_loaded']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# scripts/bench_ml_wire.py
+"""
+Serialization cost of mhchat-ml payloads per wire format.
+
+For a corpus of realistic /predict + /chat exchanges (message, five context
+messages, fallback_hint; responses with kb_hits, summary, web_highlights and
+sources) measures, per message, the CPU spent encoding both requests and
+decoding both responses through chat.ml_codec, and the bytes on the wire:
+
+    json          what the client sent before negotiation existed
+    msgpack       after the service has answered in MessagePack
+    json+gzip     JSON responses gzipped by the service (>= --gzip-min-bytes)
+    msgpack+gzip
+
+    python scripts/bench_ml_wire.py -n 500 --out wire.json
+"""
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from bench_nlu_suite import _git_revision, _percentile, _prose, make_chat_corpus  # noqa: E402
+from chat import ml_codec  # noqa: E402
+
+
+def make_exchanges(n, seed):
+    """[(predict_req, predict_resp, chat_req, chat_resp)] built from the NLU bench corpus."""
+    rnd = random.Random(seed)
+    texts = [text for _, text in make_chat_corpus(max(n, 50) + 5, seed)]
+    exchanges = []
+    for i in range(n):
+        message = texts[i + 5]
+        context = [{"sender": "user" if j % 2 == 0 else "bot", "text": texts[i + j][:600]} for j in range(5)]
+        kb_hits = [_prose(rnd, rnd.randint(120, 260)) for _ in range(rnd.randint(1, 3))]
+        pred = {"intent": "mental_health_support", "intent_score": round(rnd.random(), 4), "crisis": False, "kb_hits": kb_hits}
+        chat = {
+            "reply": _prose(rnd, rnd.randint(200, 700)),
+            "summary": _prose(rnd, rnd.randint(200, 500)),
+            "web_highlights": [
+                {"title": _prose(rnd, 50), "url": f"https://example.org/article/{rnd.randint(1, 10**6)}", "snippet": _prose(rnd, 200)}
+                for _ in range(3)
+            ],
+            "sources": [f"kb:{rnd.randint(1, 500)}" for _ in range(4)],
+        }
+        exchanges.append((
+            {"message": message, "context": context},
+            pred,
+            {"message": message, "context": context, "fallback_hint": kb_hits[0]},
+            chat,
+        ))
+    return exchanges
+
+
+def _response(obj, fmt, gzip_min_bytes):
+    """(headers, body) as the service would send ``obj``."""
+    if fmt.startswith("msgpack"):
+        body, headers = ml_codec.msgpack.packb(obj, use_bin_type=True), {"content-type": ml_codec.MSGPACK}
+    else:
+        body, headers = json.dumps(obj).encode("utf-8"), {"content-type": ml_codec.JSON}
+    if fmt.endswith("+gzip") and len(body) >= gzip_min_bytes:
+        body = gzip.compress(body, compresslevel=5)
+        headers["content-encoding"] = "gzip"
+    return headers, body
+
+
+def bench_format(fmt, exchanges, rounds, gzip_min_bytes):
+    codec = ml_codec.WireCodec()
+    codec.send_msgpack = fmt.startswith("msgpack")
+    wire = [(_response(pred, fmt, gzip_min_bytes), _response(chat, fmt, gzip_min_bytes)) for _, pred, _, chat in exchanges]
+    samples = []
+    bytes_out = bytes_in = 0
+    clock = time.perf_counter_ns
+    for r in range(rounds):
+        for (preq, _, creq, _), (presp, cresp) in zip(exchanges, wire):
+            t0 = clock()
+            b1, _ = codec.encode(preq)
+            codec.decode(*presp)
+            b2, _ = codec.encode(creq)
+            codec.decode(*cresp)
+            samples.append(clock() - t0)
+            if r == 0:
+                bytes_out += len(b1) + len(b2)
+                bytes_in += len(presp[1]) + len(cresp[1])
+    samples.sort()
+    n = len(exchanges)
+    return {
+        "cpu_p50_us": _percentile(samples, 50) / 1000.0,
+        "cpu_p99_us": _percentile(samples, 99) / 1000.0,
+        "cpu_mean_us": sum(samples) / len(samples) / 1000.0,
+        "bytes_out_per_msg": bytes_out / n,
+        "bytes_in_per_msg": bytes_in / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=500, help="exchanges")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--gzip-min-bytes", type=int, default=1024)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    if ml_codec.msgpack is None:
+        sys.exit("msgpack is not installed (pip install msgpack)")
+    exchanges = make_exchanges(args.n, args.seed)
+    results = {fmt: bench_format(fmt, exchanges, args.rounds, args.gzip_min_bytes)
+               for fmt in ("json", "msgpack", "json+gzip", "msgpack+gzip")}
+
+    base = results["json"]
+    print(f"{'format':14s} {'cpu p50 us':>11s} {'cpu mean us':>12s} {'out B/msg':>10s} {'in B/msg':>9s} {'bytes saved':>12s}")
+    for fmt, r in results.items():
+        total = r["bytes_out_per_msg"] + r["bytes_in_per_msg"]
+        saved = 1.0 - total / (base["bytes_out_per_msg"] + base["bytes_in_per_msg"])
+        r["bytes_saved_vs_json"] = saved
+        r["cpu_vs_json"] = r["cpu_mean_us"] / base["cpu_mean_us"]
+        print(f"{fmt:14s} {r['cpu_p50_us']:11.1f} {r['cpu_mean_us']:12.1f} {r['bytes_out_per_msg']:10.0f} "
+              f"{r['bytes_in_per_msg']:9.0f} {saved:11.1%}")
+
+    if args.out:
+        report = {
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "git": _git_revision(),
+                "python": platform.python_version(),
+                "msgpack": ".".join(map(str, ml_codec.msgpack.version)),
+                "n": args.n,
+                "rounds": args.rounds,
+                "gzip_min_bytes": args.gzip_min_bytes,
+            },
+            "results": results,
+        }
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# scripts/bench_nlu.py
+"""
+Benchmark the compiled lexicon scan in chat/nlp.py against the previous
+per-lexicon implementation (kept inline below as the reference).
+
+Usage (from the repo root):
+    python scripts/bench_nlu.py [--chars 4000] [--repeat 300]
+
+Also checks that both implementations agree on intent and severity for the
+whole generated corpus, so it doubles as a parity check.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Measure the analysis itself, not the per-text result cache.
+os.environ.setdefault("MHCHAT_NLU_CACHE_SIZE", "0")
+
+from chat import nlp  # noqa: E402
+
+
+# --- reference implementation (pre-compiled-scanner behaviour) ---------------
+
+def legacy_analyze_message(text):
+    t = nlp._normalize(text)
+    words = re.findall(r"[a-z']+", t)
+    # Sentiment and entities are shared with chat.nlp: this reference only
+    # covers the lexicon scan and the keyword rules.
+    compound = nlp._score_sentiment(words)["compound"]
+    nlp._extract_entities(t, words)
+    intent = "unknown"
+    if any(g in t for g in nlp._GREETINGS) and len(t.split()) <= 3:
+        intent = "greeting"
+    elif any(w in t for w in ("help", "cope", "support", "talk to someone", "talk to a human")):
+        intent = "help_request"
+    elif any(w in t for w in ("thank", "thanks")):
+        intent = "thanks"
+    elif any(re.search(p, t) for p in nlp._SUICIDAL_PATTERNS) or any(c in t for c in nlp._CRISIS_WORDS):
+        intent = "suicidal"
+    elif compound > 0.2:
+        intent = "positive"
+    elif compound < -0.2:
+        intent = "negative"
+    return {"intent": intent, "sentiment": {"compound": float(compound)}}
+
+
+def legacy_safety_check(text, nlp_meta=None):
+    t = nlp._normalize(text)
+    flagged, severity = False, "low"
+    if any(re.search(p, t) for p in nlp._SUICIDAL_PATTERNS):
+        flagged = True
+        if any(uw in t for uw in nlp._URGENCY_WORDS):
+            severity = "high"
+        elif "i want to kill myself" in t or "i am going to kill myself" in t:
+            severity = "high"
+        else:
+            severity = "medium"
+    if not flagged and any(c in t for c in nlp._CRISIS_WORDS):
+        # the pipeline's crisis gate: count-based compound, as analyze_message computed it
+        words = re.findall(r"[a-z']+", t)
+        neg = sum(1 for w in words if w in nlp._NEG_WORDS)
+        pos = sum(1 for w in words if w in nlp._POS_WORDS)
+        comp = (pos - neg) / (pos + neg) if pos + neg else 0.0
+        if comp < -0.3:
+            flagged, severity = True, "medium"
+    return flagged, severity
+
+
+# --- corpus -------------------------------------------------------------------
+
+_FILLER = (
+    "i feel sad today and the weather is okay but my job is hard this is a long "
+    "attachment text with many words about life stress sleep family friends work"
+).split()
+_SNIPPETS = [
+    "hi", "hello there", "thanks so much", "i need help", "i want to kill myself",
+    "i'm going to kill myself tonight", "i feel hopeless and alone", "not worth living",
+    "i have a plan", "i am happy and relieved", "i want to die", "overdose", "good morning",
+]
+
+
+def make_corpus(n, chars, snippet_rate=0.0, seed=7):
+    """``n`` texts of ``chars`` characters; ``snippet_rate`` of the words are lexicon snippets."""
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        parts = []
+        while sum(len(p) + 1 for p in parts) < chars:
+            parts.append(rnd.choice(_SNIPPETS) if rnd.random() < snippet_rate else rnd.choice(_FILLER))
+        corpus.append(" ".join(parts)[:chars])
+    return corpus
+
+
+def bench(fn, corpus, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            fn(text)
+    return (time.perf_counter() - start) / (repeat * len(corpus)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chars", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=300)
+    parser.add_argument("--docs", type=int, default=20)
+    args = parser.parse_args()
+
+    corpora = {
+        # Long attachment-style prose with no risk language: the common case,
+        # where every legacy regex has to scan the whole text.
+        "prose": make_corpus(args.docs, args.chars),
+        # Risk language every ~50 words: legacy any() short-circuits early here.
+        "risk-dense": make_corpus(args.docs, args.chars, snippet_rate=0.02),
+    }
+
+    mismatches = 0
+    checked = [t for docs in corpora.values() for t in docs] + _SNIPPETS
+    for text in checked:
+        meta = nlp.analyze_message(text)
+        if meta["intent"] != legacy_analyze_message(text)["intent"]:
+            mismatches += 1
+        if nlp.safety_check(text, meta) != legacy_safety_check(text, meta):
+            mismatches += 1
+    print(f"parity: {len(checked)} texts, {mismatches} mismatches")
+
+    def legacy_pipeline(text):
+        return legacy_safety_check(text, legacy_analyze_message(text))
+
+    rows = [
+        ("analyze_message", legacy_analyze_message, nlp.analyze_message),
+        ("safety_check", legacy_safety_check, nlp.safety_check),
+        ("analyze+safety", legacy_pipeline, nlp.analyze_and_check),
+    ]
+    for label, docs in corpora.items():
+        print(f"{label}: {args.chars}-char inputs, {args.repeat} x {len(docs)} calls")
+        for name, old, new in rows:
+            old_us = bench(old, docs, args.repeat)
+            new_us = bench(new, docs, args.repeat)
+            print(f"  {name:16s} legacy {old_us:8.1f} us   compiled {new_us:8.1f} us   x{old_us / new_us:.2f}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
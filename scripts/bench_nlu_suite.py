@@ -0,0 +1,238 @@
+# scripts/bench_nlu_suite.py
+"""
+NLU micro-benchmark suite over a reproducible synthetic chat corpus.
+
+Measures throughput and p50/p99 latency of:
+  nlp.analyze_message, nlp.safety_check, nlp.generate_bot_response,
+  nlp._extract_entities (gazetteer pass alone), ml_brain_client._build_reply
+and writes the numbers as JSON so runs can be compared before/after a change.
+
+    python scripts/bench_nlu_suite.py --out bench_before.json
+    ... change code ...
+    python scripts/bench_nlu_suite.py --out bench_after.json --compare bench_before.json
+
+The NLU result cache is disabled unless --nlu-cache is given, so results
+measure the analysis itself.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+# --- corpus -------------------------------------------------------------------
+
+_GREETINGS = ["hi", "hello", "hey", "hey there", "good morning", "hiya", "hello?", "hi again"]
+_CHAT = [
+    "i feel sad today", "thanks for listening", "i can't sleep at night", "work has been stressful",
+    "i had a good day actually", "my friends don't understand me", "i need help coping with anxiety",
+    "i feel a bit better now", "everything feels hopeless", "can we talk about my family",
+    "i'm not happy with how things are going", "i feel lonely most evenings",
+]
+_CRISIS = [
+    "i want to kill myself", "i'm going to kill myself tonight", "i want to die", "i have a plan to end my life",
+    "life is not worth living anymore", "thinking about suicide", "i took an overdose", "i want to hang myself",
+]
+_PROSE = (
+    "today i went to work and tried to focus but my mind kept drifting back to the argument with my sister "
+    "i know she means well but it feels like nobody listens when i explain how tired i am all the time "
+    "my therapist suggested writing things down so this is what i have been doing every evening before bed "
+    "some days are okay and some days are really bad and i never know which one it will be in the morning "
+    "i have been eating less and sleeping more and i stopped going to the gym because it felt pointless"
+).split()
+
+
+def _prose(rnd, n_chars):
+    words = []
+    size = 0
+    while size < n_chars:
+        w = rnd.choice(_PROSE)
+        words.append(w)
+        size += len(w) + 1
+    return " ".join(words)[:n_chars]
+
+
+def make_chat_corpus(n=2000, seed=1234):
+    """
+    Deterministic list of (kind, text) chat messages with a realistic mix:
+    mostly short greetings/chit-chat, some crisis language, some paragraphs,
+    and a tail of long messages carrying attachment text (as built by
+    tasks._build_message_text) up to 4000 characters.
+    """
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        roll = rnd.random()
+        if roll < 0.20:
+            corpus.append(("greeting", rnd.choice(_GREETINGS)))
+        elif roll < 0.60:
+            corpus.append(("chat", rnd.choice(_CHAT)))
+        elif roll < 0.70:
+            lead = _prose(rnd, rnd.randint(0, 120))
+            corpus.append(("crisis", f"{lead} {rnd.choice(_CRISIS)}".strip()))
+        elif roll < 0.90:
+            # paragraph: log-normal length, median ~300 chars
+            corpus.append(("paragraph", _prose(rnd, min(1500, int(rnd.lognormvariate(5.7, 0.6))))))
+        else:
+            base = rnd.choice(_CHAT)
+            body = _prose(rnd, rnd.randint(1000, 3900 - len(base)))
+            if rnd.random() < 0.3:
+                body += " " + rnd.choice(_CRISIS)
+            corpus.append(("attachment", f"{base}\n\n[Attachment: journal.txt]\n{body}"[:4000]))
+    return corpus
+
+
+def make_predictions(n=500, seed=1234):
+    """Synthetic mhchat-ml /predict payloads for _build_reply."""
+    rnd = random.Random(seed)
+    intents = ["casual_chat", "mental_health_support", "greeting", "crisis"]
+    kb = [
+        "Try box breathing: inhale 4s, hold 4s, exhale 4s, hold 4s.",
+        "Grounding: name 5 things you can see, 4 you can touch, 3 you can hear.",
+        "Write down three small things that went okay today.",
+    ]
+    preds = []
+    for _ in range(n):
+        preds.append({
+            "intent": rnd.choice(intents),
+            "intent_score": round(rnd.random(), 3),
+            "crisis": rnd.random() < 0.1,
+            "kb_hits": rnd.sample(kb, rnd.randint(0, len(kb))),
+        })
+    return preds
+
+
+# --- measurement --------------------------------------------------------------
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def measure(fn, inputs, rounds):
+    """Time ``fn(*args)`` for every args tuple in ``inputs``, ``rounds`` times over."""
+    samples = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for _ in range(rounds):
+        for args in inputs:
+            t0 = clock()
+            fn(*args)
+            samples.append(clock() - t0)
+    total_s = (clock() - start) / 1e9
+    samples.sort()
+    return {
+        "calls": len(samples),
+        "throughput_per_s": len(samples) / total_s if total_s else 0.0,
+        "mean_us": statistics.fmean(samples) / 1000.0,
+        "p50_us": _percentile(samples, 50) / 1000.0,
+        "p99_us": _percentile(samples, 99) / 1000.0,
+        "max_us": samples[-1] / 1000.0,
+    }
+
+
+def _git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_suite(n, rounds, seed):
+    from chat import ml_brain_client, nlp
+
+    corpus = make_chat_corpus(n, seed)
+    texts = [(text,) for _, text in corpus]
+    long_texts = [(text,) for kind, text in corpus if kind == "attachment"]
+    metas = [(text, nlp.analyze_message(text)) for (text,) in texts]
+    entity_inputs = [(t, nlp._WORD_RE.findall(t)) for t in (nlp._normalize(text) for (text,) in texts)]
+    preds = [(p,) for p in make_predictions(max(100, n // 4), seed)]
+    random.seed(seed)  # _build_reply picks casual replies with random.choice
+
+    results = {
+        "analyze_message": measure(nlp.analyze_message, texts, rounds),
+        "analyze_message[attachment]": measure(nlp.analyze_message, long_texts, rounds),
+        "safety_check": measure(nlp.safety_check, metas, rounds),
+        "entities": measure(nlp._extract_entities, entity_inputs, rounds),
+        "analyze_and_check": measure(nlp.analyze_and_check, texts, rounds),
+        "generate_bot_response": measure(nlp.generate_bot_response, metas, rounds),
+        "generate_bot_response[no meta]": measure(nlp.generate_bot_response, texts, rounds),
+        "ml_brain_client._build_reply": measure(ml_brain_client._build_reply, preds, rounds),
+    }
+    kinds = {}
+    for kind, text in corpus:
+        kinds.setdefault(kind, []).append(len(text))
+    corpus_info = {
+        kind: {"count": len(lengths), "median_chars": int(statistics.median(lengths)), "max_chars": max(lengths)}
+        for kind, lengths in sorted(kinds.items())
+    }
+    return results, corpus_info
+
+
+def print_table(results, baseline=None):
+    header = f"{'benchmark':32s} {'ops/s':>10s} {'p50 us':>9s} {'p99 us':>9s}"
+    if baseline:
+        header += f" {'p50 vs base':>12s}"
+    print(header)
+    for name, r in results.items():
+        line = f"{name:32s} {r['throughput_per_s']:10.0f} {r['p50_us']:9.1f} {r['p99_us']:9.1f}"
+        base = (baseline or {}).get(name)
+        if base and base.get("p50_us"):
+            line += f" {r['p50_us'] / base['p50_us']:11.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=2000, help="corpus size")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--nlu-cache", action="store_true", help="keep the NLU result cache enabled")
+    args = parser.parse_args()
+
+    if not args.nlu_cache:
+        os.environ["MHCHAT_NLU_CACHE_SIZE"] = "0"
+
+    results, corpus_info = run_suite(args.n, args.rounds, args.seed)
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "n": args.n,
+            "rounds": args.rounds,
+            "seed": args.seed,
+            "nlu_cache": bool(args.nlu_cache),
+        },
+        "corpus": corpus_info,
+        "results": results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh).get("results")
+    print_table(results, baseline)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
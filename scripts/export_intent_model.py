@@ -0,0 +1,60 @@
+# scripts/export_intent_model.py
+"""
+Compile a trained intent model (scripts/train_intent.py output) into the
+single-file hashed-linear format read by chat.intent_model.HashedLinearClassifier.
+
+    python scripts/export_intent_model.py [--src artifacts/intent] [--out artifacts/intent]
+
+--src may be the artifact root (its LATEST version is used) or a version
+directory. The compiled model is written as a new version "<version>-hlm"
+and LATEST is pointed at it. No scikit-learn import is needed.
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat.intent_model import resolve_artifact, write_hashed_linear  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--src", default=os.environ.get("MHCHAT_INTENT_MODEL_DIR", "artifacts/intent"))
+parser.add_argument("--out", default=None, help="artifact root to write to (default: the source root)")
+args = parser.parse_args()
+
+src = Path(args.src)
+if not (src / "manifest.json").is_file():
+    src = resolve_artifact(src)
+if src is None:
+    sys.exit(f"No trained intent model found under {args.src}")
+
+with open(src / "manifest.json", encoding="utf-8") as fh:
+    manifest = json.load(fh)
+if manifest.get("format") != "tfidf-logreg":
+    sys.exit(f"{src} has format {manifest.get('format')!r}; expected 'tfidf-logreg'")
+
+with open(src / "vocabulary.json", encoding="utf-8") as fh:
+    vocabulary = json.load(fh)
+idf = np.load(src / "idf.npy")
+coef = np.load(src / "coef.npy")
+intercept = np.load(src / "intercept.npy")
+
+out_root = Path(args.out) if args.out else src.parent
+version = f"{manifest['version']}-hlm"
+out_dir = out_root / version
+out_dir.mkdir(parents=True, exist_ok=True)
+
+analyzer = {k: manifest[k] for k in ("classes", "ngram_range", "lowercase", "token_pattern") if k in manifest}
+write_hashed_linear(out_dir / "model.hlm", {"version": version, **analyzer}, vocabulary, idf, coef, intercept)
+with open(out_dir / "manifest.json", "w", encoding="utf-8") as fh:
+    json.dump({"format": "hashed-linear", "version": version, "file": "model.hlm",
+               "compiled_from": manifest["version"], **analyzer}, fh, indent=2)
+
+latest_tmp = out_root / "LATEST.tmp"
+latest_tmp.write_text(version, encoding="utf-8")
+os.replace(latest_tmp, out_root / "LATEST")
+print(f"Compiled {src.name} -> {out_dir / 'model.hlm'} ({(out_dir / 'model.hlm').stat().st_size} bytes)")
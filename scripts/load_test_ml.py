@@ -0,0 +1,261 @@
+# scripts/load_test_ml.py
+"""
+Load test for the mhchat-ml client against the offline fake service.
+
+Starts chat.ml_fake_server in-process (or uses --target URL), then drives one
+of these at the given concurrency:
+  predict   ml_brain_client.predict from worker threads
+  async     ml_brain_client.apredict as concurrent tasks on one event loop
+  pipeline  tasks.handle_user_message end to end, on a throwaway sqlite DB
+
+and reports throughput, p50/p95/p99/max latency and how often the local
+fallback was used (ML returned nothing), plus the faults the server injected.
+
+    python scripts/load_test_ml.py --mode predict -c 32 -n 2000 --latency lognormal:40:0.6 --error-rate 0.05
+    python scripts/load_test_ml.py --mode async -c 200 --slowloris-rate 0.05 --set MHCHAT_ML_DEADLINE_S=1
+    python scripts/load_test_ml.py --mode pipeline -c 8 -n 300 --out load.json
+
+--set KEY=VALUE overrides any MHCHAT_ML_* setting (deadline, hedging, batching,
+cache, ...). The response cache is off unless --set MHCHAT_ML_CACHE_BACKEND=local.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from bench_nlu_suite import _git_revision, _percentile, make_chat_corpus  # noqa: E402
+from chat.ml_fake_server import add_profile_arguments, profile_from_args, start_fake_ml_server  # noqa: E402
+
+
+def make_messages(n, seed):
+    """Non-crisis chat messages (crisis text never reaches mhchat-ml), each unique so dedup lets it through."""
+    corpus = [text for kind, text in make_chat_corpus(max(n * 2, 100), seed) if kind != "crisis"]
+    return [f"{corpus[i % len(corpus)]} #{i}" for i in range(n)]
+
+
+def _setup_django(base_url, overrides, pipeline):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mhchat_proj.settings")
+    os.environ["MHCHAT_ML_API_BASE"] = base_url
+    os.environ.setdefault("MHCHAT_ML_CACHE_BACKEND", "off")
+    os.environ["CHANNEL_LAYER_BACKEND"] = "memory"
+    if pipeline:
+        # never write load-test rows to a configured Postgres
+        for name in ("DATABASE_URL", "POSTGRES_DB"):
+            os.environ.pop(name, None)
+    os.environ.update(overrides)
+
+    import django
+
+    django.setup()
+
+
+_errors = {}
+_errors_lock = threading.Lock()
+
+
+def _count_error(exc):
+    key = f"{type(exc).__name__}: {str(exc)[:120]}"
+    with _errors_lock:
+        _errors[key] = _errors.get(key, 0) + 1
+
+
+def summarize(samples, wall_s):
+    """samples: [(latency_s, outcome)] with outcome "ml", "fallback", "error" or "flagged"."""
+    latencies = sorted(lat * 1000.0 for lat, _ in samples)
+    outcomes = {"ml": 0, "fallback": 0, "error": 0, "flagged": 0}
+    for _, outcome in samples:
+        outcomes[outcome] += 1
+    n = len(samples) - outcomes["flagged"]
+    return {
+        "calls": len(samples),
+        "wall_s": wall_s,
+        "throughput_per_s": len(samples) / wall_s if wall_s else 0.0,
+        "mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "max_ms": latencies[-1] if latencies else 0.0,
+        "outcomes": outcomes,
+        "fallback_rate": (outcomes["fallback"] + outcomes["error"]) / n if n else 0.0,
+        "errors": dict(sorted(_errors.items(), key=lambda kv: -kv[1])[:10]),
+    }
+
+
+def _run_threads(call, messages, concurrency):
+    samples = []
+    lock = threading.Lock()
+
+    def one(message):
+        t0 = time.perf_counter()
+        try:
+            outcome = call(message)
+        except Exception as exc:
+            outcome = "error"
+            _count_error(exc)
+        with lock:
+            samples.append((time.perf_counter() - t0, outcome))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, messages))
+    return samples, time.perf_counter() - start
+
+
+def run_predict(messages, concurrency):
+    from chat.ml_brain_client import predict
+
+    return _run_threads(lambda m: "ml" if predict(m) else "fallback", messages, concurrency)
+
+
+def run_async(messages, concurrency):
+    from chat.ml_brain_client import apredict
+
+    async def main():
+        sem = asyncio.Semaphore(concurrency)
+        samples = []
+
+        async def one(message):
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    outcome = "ml" if await apredict(message, context=[]) else "fallback"
+                except Exception as exc:
+                    outcome = "error"
+                    _count_error(exc)
+                samples.append((time.perf_counter() - t0, outcome))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(m) for m in messages))
+        return samples, time.perf_counter() - start
+
+    return asyncio.run(main())
+
+
+def run_pipeline(messages, concurrency):
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+
+    from chat.models import Conversation, Message
+    from chat.tasks import handle_user_message
+
+    # file-backed, not shared-cache :memory: (which raises "table is locked" under concurrent writers)
+    workdir = tempfile.mkdtemp(prefix="mhchat-loadtest-")
+    connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(workdir, "db.sqlite3")
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        user = get_user_model().objects.create_user(username="loadtest", password="x")
+        convs = [Conversation.objects.create(user=user) for _ in range(max(1, concurrency))]
+        ids = [
+            Message.objects.create(conversation=convs[i % len(convs)], sender="user", text=text).id
+            for i, text in enumerate(messages)
+        ]
+
+        def call(message_id):
+            result = handle_user_message(message_id)
+            if result.get("status") == "flagged":
+                return "flagged"  # safety path: no ML call by design
+            if result.get("status") != "ok":
+                raise RuntimeError(result.get("error") or result.get("status"))
+            meta = Message.objects.filter(id=message_id).values_list("nlp_metadata", flat=True).first() or {}
+            return "ml" if "ml" in meta else "fallback"
+
+        return _run_threads(call, ids, concurrency)
+    finally:
+        connection.creation.destroy_test_db(connection.settings_dict["NAME"], verbosity=0)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(report):
+    r = report["results"]
+    print(f"mode={report['meta']['mode']} concurrency={report['meta']['concurrency']} calls={r['calls']}")
+    print(f"  throughput  {r['throughput_per_s']:10.1f} /s   wall {r['wall_s']:.2f}s")
+    print(f"  latency ms  p50 {r['p50_ms']:.1f}  p95 {r['p95_ms']:.1f}  p99 {r['p99_ms']:.1f}  max {r['max_ms']:.1f}")
+    print(f"  outcomes    {r['outcomes']}  fallback rate {r['fallback_rate']:.1%}")
+    for error, count in r["errors"].items():
+        print(f"  error x{count:<5d} {error}")
+    if report.get("server"):
+        print(f"  server      {report['server']}")
+    for name in ("deadline", "breaker", "batch", "cache"):
+        if report["client"].get(name):
+            print(f"  {name:11s} {report['client'][name]}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("predict", "async", "pipeline"), default="predict")
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-n", type=int, default=1000, help="number of messages")
+    parser.add_argument("--target", help="use this mhchat-ml base URL instead of the fake server")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="MHCHAT_ML_* override")
+    parser.add_argument("--out", help="write results JSON here")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    overrides = dict(item.split("=", 1) for item in args.set)
+    server = profile = None
+    if args.target:
+        base_url = args.target
+    else:
+        profile = profile_from_args(args)
+        server, base_url = start_fake_ml_server(profile)
+    _setup_django(base_url, overrides, args.mode == "pipeline")
+
+    messages = make_messages(args.n, args.seed)
+    runner = {"predict": run_predict, "async": run_async, "pipeline": run_pipeline}[args.mode]
+    try:
+        samples, wall_s = runner(messages, args.concurrency)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    from chat.ml_batch import ml_batch_stats
+    from chat.ml_cache import ml_cache_stats
+    from chat.ml_deadline import ml_deadline_stats
+    from chat.ml_health import ml_breaker_stats
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "mode": args.mode,
+            "concurrency": args.concurrency,
+            "n": args.n,
+            "target": args.target or "fake",
+            "overrides": overrides,
+            "fault_profile": None if args.target else {
+                "latency": args.latency, "chat_latency": args.chat_latency, "error_rate": args.error_rate,
+                "reset_rate": args.reset_rate, "malformed_rate": args.malformed_rate,
+                "slowloris_rate": args.slowloris_rate, "slowloris_gap_ms": args.slowloris_gap_ms,
+            },
+        },
+        "results": summarize(samples, wall_s),
+        "server": profile.stats() if profile is not None else None,
+        "client": {
+            "deadline": ml_deadline_stats(),
+            "breaker": ml_breaker_stats(),
+            "batch": ml_batch_stats(),
+            "cache": ml_cache_stats(),
+        },
+    }
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
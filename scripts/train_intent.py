@@ -1,11 +1,64 @@
 # scripts/train_intent.py
+"""
+Train the TF-IDF + LogisticRegression intent model and export it as a
+versioned artifact for chat/intent_model.py.
+
+    python scripts/train_intent.py [--data data/intent_samples.csv] [--out artifacts/intent]
+
+Writes <out>/<version>/{manifest.json,vocabulary.json,idf.npy,coef.npy,intercept.npy,pipeline.joblib}
+and points <out>/LATEST at the new version. Run scripts/export_intent_model.py
+afterwards to compile it into the single-file format workers load fastest.
+"""
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
 import pandas as pd
-from sklearn.pipeline import make_pipeline
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
-import joblib
-df = pd.read_csv('data/intent_samples.csv')
+from sklearn.pipeline import make_pipeline
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--data", default="data/intent_samples.csv")
+parser.add_argument("--out", default=os.environ.get("MHCHAT_INTENT_MODEL_DIR", "artifacts/intent"))
+args = parser.parse_args()
+
+df = pd.read_csv(args.data)
 pipe = make_pipeline(TfidfVectorizer(ngram_range=(1,2), max_features=10000), LogisticRegression(max_iter=500))
 pipe.fit(df['text'].astype(str).values, df['intent'].values)
-joblib.dump(pipe, 'chat/nlp.py')
-print('Saved chat/nlp.py')
+
+vec, clf = pipe.steps[0][1], pipe.steps[1][1]
+version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+out_dir = os.path.join(args.out, version)
+os.makedirs(out_dir, exist_ok=True)
+
+manifest = {
+    "format": "tfidf-logreg",
+    "version": version,
+    "classes": [str(c) for c in clf.classes_],
+    "ngram_range": list(vec.ngram_range),
+    "lowercase": vec.lowercase,
+    "token_pattern": vec.token_pattern,
+    "n_features": len(vec.vocabulary_),
+    "trained_on": os.path.basename(args.data),
+    "n_samples": int(len(df)),
+}
+with open(os.path.join(out_dir, "vocabulary.json"), "w", encoding="utf-8") as fh:
+    json.dump({term: int(idx) for term, idx in vec.vocabulary_.items()}, fh)
+np.save(os.path.join(out_dir, "idf.npy"), vec.idf_.astype(np.float32))
+# Row per feature so a message only touches the rows of its own terms.
+np.save(os.path.join(out_dir, "coef.npy"), np.ascontiguousarray(clf.coef_.T, dtype=np.float32))
+np.save(os.path.join(out_dir, "intercept.npy"), clf.intercept_.astype(np.float32))
+joblib.dump(pipe, os.path.join(out_dir, "pipeline.joblib"))
+# manifest last: a directory without one is ignored by the loader
+with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as fh:
+    json.dump(manifest, fh, indent=2)
+
+latest_tmp = os.path.join(args.out, "LATEST.tmp")
+with open(latest_tmp, "w", encoding="utf-8") as fh:
+    fh.write(version)
+os.replace(latest_tmp, os.path.join(args.out, "LATEST"))
+print(f"Saved intent model {version} to {out_dir}")